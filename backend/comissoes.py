@@ -0,0 +1,92 @@
+"""
+Motor de comissões: comissão base (% das vendas) + bônus da maior faixa de meta
+atingida (as faixas não acumulam) - vales do período.
+
+É a única implementação da regra: a performance da vendedora, o relatório de
+pagamentos e a simulação de configurações usam calcular_folha. O cálculo é feito em
+lote com NumPy, uma linha por (vendedora, mês) ou por vendedora no período, então
+reaplicar uma configuração a meses de histórico custa só as operações vetoriais.
+"""
+import numpy as np
+
+CONFIG_PADRAO = {
+    "percentual_comissao": 1.0,
+    "bonus_tiers": [
+        {"percentual_meta": 80, "valor_bonus": 100},
+        {"percentual_meta": 90, "valor_bonus": 150},
+        {"percentual_meta": 100, "valor_bonus": 200},
+        {"percentual_meta": 110, "valor_bonus": 300},
+    ],
+}
+
+
+def faixas_da_config(config: dict):
+    """(limiares em % da meta, bônus) das faixas, em ordem crescente de limiar."""
+    tiers = sorted(config.get("bonus_tiers") or [], key=lambda t: t["percentual_meta"])
+    limiares = np.array([t["percentual_meta"] for t in tiers], dtype=float)
+    valores = np.array([t["valor_bonus"] for t in tiers], dtype=float)
+    return limiares, valores
+
+
+def calcular_folha(total_vendas, meta_vendas, total_vales, config: dict) -> dict:
+    """
+    Aplica `config` (percentual_comissao, bonus_tiers) a todas as linhas de uma vez.
+    Recebe sequências alinhadas e devolve arrays: percentual_atingido, comissao_base,
+    faixa (quantas faixas foram alcançadas, 0 = nenhuma), bonus_valor,
+    falta_percentual_proxima_faixa e total_a_pagar.
+    """
+    vendas = np.asarray(total_vendas, dtype=float)
+    meta = np.asarray(meta_vendas, dtype=float)
+    vales = np.asarray(total_vales, dtype=float)
+
+    percentual = np.zeros_like(vendas)
+    np.divide(vendas * 100, meta, out=percentual, where=meta > 0)
+    comissao_base = vendas * float(config.get("percentual_comissao", 1.0)) / 100
+
+    limiares, valores = faixas_da_config(config)
+    faixa = np.searchsorted(limiares, percentual, side="right")
+    if len(limiares):
+        bonus = np.where(faixa > 0, valores[np.maximum(faixa - 1, 0)], 0.0)
+        proximo = limiares[np.minimum(faixa, len(limiares) - 1)]
+        falta = np.where(faixa < len(limiares), proximo - percentual, 0.0)
+    else:
+        bonus = np.zeros_like(vendas)
+        falta = np.zeros_like(vendas)
+
+    return {
+        "percentual_atingido": percentual,
+        "comissao_base": comissao_base,
+        "faixa": faixa,
+        "bonus_valor": bonus,
+        "falta_percentual_proxima_faixa": falta,
+        "total_a_pagar": comissao_base + bonus - vales,
+    }
+
+
+def calcular_folha_por_config(linhas: list, configs: dict, config_unica: dict = None) -> list:
+    """
+    Calcula a folha de linhas de várias filiais: cada linha (dict com filial_id,
+    total_vendas, meta_vendas, total_vales) usa a configuração da sua filial em
+    `configs` (ou CONFIG_PADRAO), ou `config_unica` para todas. Um cálculo vetorial
+    por configuração distinta; devolve um dict de resultados por linha, na ordem recebida.
+    """
+    grupos = {}
+    for i, linha in enumerate(linhas):
+        chave = None if config_unica is not None else linha.get("filial_id")
+        grupos.setdefault(chave, []).append(i)
+
+    resultados = [None] * len(linhas)
+    for chave, indices in grupos.items():
+        config = config_unica if config_unica is not None else (configs.get(chave) or CONFIG_PADRAO)
+        folha = calcular_folha(
+            [linhas[i]["total_vendas"] for i in indices],
+            [linhas[i]["meta_vendas"] for i in indices],
+            [linhas[i]["total_vales"] for i in indices],
+            config,
+        )
+        for posicao, i in enumerate(indices):
+            resultados[i] = {
+                campo: (int(valores[posicao]) if campo == "faixa" else float(valores[posicao]))
+                for campo, valores in folha.items()
+            }
+    return resultados
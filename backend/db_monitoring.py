@@ -0,0 +1,167 @@
+"""
+Listeners do pymongo para o pool de conexões e para os comandos.
+
+Os eventos chegam nas threads do executor do Motor, então todo estado
+compartilhado é protegido por lock. Os snapshots são dicts simples,
+expostos em /api/admin/db-pool.
+"""
+import threading
+import time
+from collections import deque
+
+from pymongo import monitoring
+
+
+def _percentil(amostras, p):
+    if not amostras:
+        return 0.0
+    ordenadas = sorted(amostras)
+    idx = min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))
+    return ordenadas[idx]
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Espera de checkout, conexões em uso/abertas e falhas de checkout."""
+
+    def __init__(self, amostras: int = 2048):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._esperas_ms = deque(maxlen=amostras)
+        self.checkouts = 0
+        self.checkout_falhas = 0
+        self.espera_total_ms = 0.0
+        self.espera_max_ms = 0.0
+        self.aguardando = 0
+        self.em_uso = 0
+        self.em_uso_max = 0
+        self.abertas = 0
+        self.pool_cleared = 0
+
+    # O checkout começa e termina na mesma thread, então o início fica em thread-local
+    def connection_check_out_started(self, event):
+        self._local.inicio = time.perf_counter()
+        with self._lock:
+            self.aguardando += 1
+
+    def connection_checked_out(self, event):
+        espera_ms = (time.perf_counter() - getattr(self._local, "inicio", time.perf_counter())) * 1000
+        with self._lock:
+            self.aguardando = max(0, self.aguardando - 1)
+            self.checkouts += 1
+            self.em_uso += 1
+            self.em_uso_max = max(self.em_uso_max, self.em_uso)
+            self.espera_total_ms += espera_ms
+            self.espera_max_ms = max(self.espera_max_ms, espera_ms)
+            self._esperas_ms.append(espera_ms)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.aguardando = max(0, self.aguardando - 1)
+            self.checkout_falhas += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.em_uso = max(0, self.em_uso - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.abertas += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.abertas = max(0, self.abertas - 1)
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            esperas = list(self._esperas_ms)
+            return {
+                "checkouts": self.checkouts,
+                "checkout_falhas": self.checkout_falhas,
+                "aguardando_checkout": self.aguardando,
+                "conexoes_em_uso": self.em_uso,
+                "conexoes_em_uso_max": self.em_uso_max,
+                "conexoes_abertas": self.abertas,
+                "pool_cleared": self.pool_cleared,
+                "espera_checkout_ms": {
+                    "media": self.espera_total_ms / self.checkouts if self.checkouts else 0.0,
+                    "max": self.espera_max_ms,
+                    "p50": _percentil(esperas, 50),
+                    "p95": _percentil(esperas, 95),
+                    "p99": _percentil(esperas, 99),
+                },
+            }
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """Latência por comando e coleção (find/products, aggregate/sales, ...)."""
+
+    def __init__(self, observadores=None):
+        self._lock = threading.Lock()
+        self._pendentes = {}
+        self._stats = {}
+        # Funções chamadas com (comando, colecao, duracao_ms, falhou) a cada comando concluído
+        self.observadores = list(observadores or [])
+
+    @staticmethod
+    def _chave_evento(event):
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        alvo = event.command.get(event.command_name)
+        colecao = alvo if isinstance(alvo, str) else ""
+        with self._lock:
+            self._pendentes[self._chave_evento(event)] = colecao
+
+    def _finalizar(self, event, falhou: bool):
+        duracao_ms = event.duration_micros / 1000
+        with self._lock:
+            colecao = self._pendentes.pop(self._chave_evento(event), "")
+            stats = self._stats.setdefault((event.command_name, colecao), {
+                "count": 0, "falhas": 0, "total_ms": 0.0, "max_ms": 0.0
+            })
+            stats["count"] += 1
+            stats["total_ms"] += duracao_ms
+            stats["max_ms"] = max(stats["max_ms"], duracao_ms)
+            if falhou:
+                stats["falhas"] += 1
+        for observador in self.observadores:
+            observador(event.command_name, colecao, duracao_ms, falhou)
+        return colecao, duracao_ms
+
+    def succeeded(self, event):
+        self._finalizar(event, falhou=False)
+
+    def failed(self, event):
+        self._finalizar(event, falhou=True)
+
+    def snapshot(self) -> list:
+        with self._lock:
+            itens = [
+                {
+                    "comando": comando,
+                    "colecao": colecao,
+                    "count": s["count"],
+                    "falhas": s["falhas"],
+                    "media_ms": s["total_ms"] / s["count"] if s["count"] else 0.0,
+                    "max_ms": s["max_ms"],
+                    "total_ms": s["total_ms"],
+                }
+                for (comando, colecao), s in self._stats.items()
+            ]
+        return sorted(itens, key=lambda i: i["total_ms"], reverse=True)
@@ -0,0 +1,105 @@
+"""
+Canal de eventos por filial (venda criada/estornada, estoque alterado, movimento de caixa),
+entregue por Server-Sent Events em /api/eventos.
+
+O broker é do processo: publicar() nunca bloqueia o handler que escreveu. Cada assinante
+tem uma fila limitada; eventos com a mesma chave de coalescência (ex.: estoque do mesmo
+produto) substituem o pendente anterior, e se a fila estoura ela é descartada e o cliente
+recebe um único "resync" para recarregar a tela inteira.
+
+Com vários workers do uvicorn cada um só vê as próprias escritas; nesse caso ligue
+EVENTOS_CHANGE_STREAMS=1 (requer replica set) para alimentar o broker de cada worker
+a partir dos change streams do MongoDB.
+"""
+import asyncio
+import itertools
+import json
+from collections import OrderedDict
+
+
+class Assinatura:
+    def __init__(self, filial_id: str, max_pendentes: int):
+        self.filial_id = filial_id
+        self.max_pendentes = max_pendentes
+        self._pendentes = OrderedDict()
+        self._sinal = asyncio.Event()
+        self._sequencia = itertools.count()
+        self.descartados = 0
+
+    def entregar(self, evento: dict, chave=None):
+        if chave is not None:
+            # Coalescência: mantém só o estado mais recente, na posição do mais recente
+            self._pendentes.pop(chave, None)
+        else:
+            chave = ("seq", next(self._sequencia))
+        if len(self._pendentes) >= self.max_pendentes:
+            # Cliente lento: em vez de acumular, pede para ele recarregar tudo
+            self.descartados += len(self._pendentes)
+            self._pendentes.clear()
+            self._pendentes["resync"] = {"tipo": "resync", "dados": {}}
+        if "resync" not in self._pendentes:
+            self._pendentes[chave] = evento
+        self._sinal.set()
+
+    async def proximos(self, timeout: float) -> list:
+        """Espera até `timeout` segundos e retorna os eventos pendentes (lista vazia = heartbeat)."""
+        if not self._pendentes:
+            self._sinal.clear()
+            try:
+                await asyncio.wait_for(self._sinal.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        eventos = list(self._pendentes.values())
+        self._pendentes.clear()
+        return eventos
+
+
+class Broker:
+    def __init__(self, max_pendentes: int = 200):
+        self.max_pendentes = max_pendentes
+        self._assinantes = {}
+        self._ids = itertools.count(1)
+
+    def assinar(self, filial_id: str) -> Assinatura:
+        assinatura = Assinatura(filial_id, self.max_pendentes)
+        self._assinantes.setdefault(filial_id, set()).add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura: Assinatura):
+        assinantes = self._assinantes.get(assinatura.filial_id)
+        if assinantes:
+            assinantes.discard(assinatura)
+            if not assinantes:
+                del self._assinantes[assinatura.filial_id]
+
+    def tem_assinantes(self, filial_id=None) -> bool:
+        if filial_id is None:
+            return bool(self._assinantes)
+        return bool(self._assinantes.get(filial_id))
+
+    def publicar(self, filial_id, tipo: str, dados: dict, chave=None):
+        """Publica para os assinantes da filial (filial_id None = todas as filiais)."""
+        if filial_id is None:
+            destinos = [a for assinantes in self._assinantes.values() for a in assinantes]
+        else:
+            destinos = self._assinantes.get(filial_id, ())
+        if not destinos:
+            return
+        evento = {"id": next(self._ids), "tipo": tipo, "dados": dados}
+        for assinatura in list(destinos):
+            assinatura.entregar(evento, (tipo, chave) if chave is not None else None)
+
+    def estatisticas(self) -> dict:
+        return {
+            "filiais": len(self._assinantes),
+            "assinantes": sum(len(a) for a in self._assinantes.values()),
+        }
+
+
+def formatar_sse(evento: dict) -> bytes:
+    partes = []
+    if evento.get("id") is not None:
+        partes.append(f"id: {evento['id']}")
+    partes.append(f"event: {evento['tipo']}")
+    partes.append("data: " + json.dumps(evento["dados"], default=str, ensure_ascii=False))
+    return ("\n".join(partes) + "\n\n").encode()
@@ -0,0 +1,185 @@
+"""
+Métricas no formato texto do Prometheus, sem dependências externas.
+
+Contadores, gauges e histogramas com labels, um middleware ASGI que mede
+cada requisição pelo template da rota (/api/sales/{sale_id}, não o id real)
+e uma tarefa que mede o atraso do event loop.
+"""
+import asyncio
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatar_labels(nomes, valores, extra=None):
+    pares = list(zip(nomes, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def _formatar_valor(v):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nome, descricao, labels=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def _chave(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self):
+        linhas = [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            itens = list(self._valores.items())
+        for chave, valor in itens:
+            linhas.extend(self._render_amostra(chave, valor))
+        return linhas
+
+    def _render_amostra(self, chave, valor):
+        return [f"{self.nome}{_formatar_labels(self.labels, chave)} {_formatar_valor(valor)}"]
+
+
+class Counter(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor=1, **labels):
+        chave = self._chave(labels)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+
+class Gauge(_Metrica):
+    tipo = "gauge"
+
+    def set(self, valor, **labels):
+        with self._lock:
+            self._valores[self._chave(labels)] = valor
+
+
+class Histogram(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome, descricao, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(nome, descricao, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, valor, **labels):
+        chave = self._chave(labels)
+        with self._lock:
+            estado = self._valores.get(chave)
+            if estado is None:
+                estado = self._valores[chave] = {"buckets": [0] * len(self.buckets), "soma": 0.0, "count": 0}
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    estado["buckets"][i] += 1
+                    break
+            estado["soma"] += valor
+            estado["count"] += 1
+
+    def _render_amostra(self, chave, estado):
+        linhas = []
+        acumulado = 0
+        for limite, n in zip(self.buckets, estado["buckets"]):
+            acumulado += n
+            labels = _formatar_labels(self.labels, chave, ("le", _formatar_valor(float(limite))))
+            linhas.append(f"{self.nome}_bucket{labels} {acumulado}")
+        base = _formatar_labels(self.labels, chave)
+        linhas.append(f"{self.nome}_sum{base} {_formatar_valor(estado['soma'])}")
+        linhas.append(f"{self.nome}_count{base} {estado['count']}")
+        return linhas
+
+
+class Registry:
+    def __init__(self):
+        self._metricas = []
+        self._coletores = []
+
+    def counter(self, nome, descricao, labels=()):
+        return self._registrar(Counter(nome, descricao, labels))
+
+    def gauge(self, nome, descricao, labels=()):
+        return self._registrar(Gauge(nome, descricao, labels))
+
+    def histogram(self, nome, descricao, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._registrar(Histogram(nome, descricao, labels, buckets))
+
+    def _registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def coletor(self, fn):
+        """Registra uma função chamada antes de cada render (para gauges derivados de snapshots)"""
+        self._coletores.append(fn)
+        return fn
+
+    def render(self) -> str:
+        for fn in self._coletores:
+            fn()
+        linhas = []
+        for metrica in self._metricas:
+            linhas.extend(metrica.render())
+        return "\n".join(linhas) + "\n"
+
+
+class MetricsMiddleware:
+    """Conta requisições e mede latência por método, template da rota e status."""
+
+    def __init__(self, app, requisicoes: Counter, latencia: Histogram):
+        self.app = app
+        self.requisicoes = requisicoes
+        self.latencia = latencia
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        inicio = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duracao = time.perf_counter() - inicio
+            # O roteador do FastAPI coloca a rota resolvida no scope
+            rota = scope.get("route")
+            template = getattr(rota, "path", None) or "<sem_rota>"
+            labels = {"method": scope["method"], "route": template, "status": str(status_code)}
+            self.requisicoes.inc(**labels)
+            self.latencia.observe(duracao, **labels)
+
+
+async def medir_lag_event_loop(gauge: Gauge, histograma: Histogram, intervalo: float = 0.5):
+    """Dorme `intervalo` segundos e mede quanto o loop demorou a mais para acordar."""
+    loop = asyncio.get_running_loop()
+    while True:
+        inicio = loop.time()
+        await asyncio.sleep(intervalo)
+        lag = max(0.0, loop.time() - inicio - intervalo)
+        gauge.set(lag)
+        histograma.observe(lag)
@@ -0,0 +1,99 @@
+"""
+Cache do processo para dados de referência que mudam poucas vezes por mês (filiais,
+configurações de comissão, usuários), compartilhado por todos os handlers.
+
+Cada entrada guarda a versão da coleção (collection_versions, a mesma do ETag) em que
+foi carregada. O worker que escreve invalida na hora, ao incrementar a versão; os
+demais conferem as versões no banco no máximo a cada `revalidar_segundos` (uma
+consulta para todas as coleções do cache) e recarregam o que ficou para trás.
+"""
+import asyncio
+import copy
+import time
+
+
+class CacheReferencias:
+    def __init__(self, obter_versoes, colecoes, revalidar_segundos: float = 5.0, ao_consultar=None):
+        """
+        obter_versoes: async (lista de coleções) -> {coleção: versão}
+        ao_consultar: callback(resultado) com "hit" ou "miss", para métricas
+        """
+        self._obter_versoes = obter_versoes
+        self.colecoes = list(colecoes)
+        self.revalidar_segundos = revalidar_segundos
+        self._ao_consultar = ao_consultar
+        self._versoes = {}
+        self._conferido_em = None
+        self._conferindo = None
+        self._entradas = {}  # (coleção, chave) -> (versão, valor)
+        self._carregando = {}  # (coleção, chave, versão) -> Future do carregamento em andamento
+
+    def acompanha(self, colecao: str) -> bool:
+        return colecao in self.colecoes
+
+    async def versoes(self, colecoes=None) -> dict:
+        """Versões conhecidas, conferidas no banco se a última conferência expirou."""
+        expirou = self._conferido_em is None or time.monotonic() - self._conferido_em >= self.revalidar_segundos
+        if expirou:
+            if self._conferindo is None or self._conferindo.done():
+                self._conferindo = asyncio.ensure_future(self._conferir())
+            await asyncio.shield(self._conferindo)
+        return {c: self._versoes.get(c, 0) for c in (colecoes or self.colecoes)}
+
+    async def _conferir(self):
+        versoes = await self._obter_versoes(self.colecoes)
+        for colecao, versao in versoes.items():
+            # Nunca volta atrás: uma invalidação local pode ser mais nova que a leitura
+            self._versoes[colecao] = max(versao, self._versoes.get(colecao, 0))
+        self._conferido_em = time.monotonic()
+
+    async def obter(self, colecao: str, chave, carregar):
+        """
+        Valor de (coleção, chave), carregado por `carregar()` (async) quando ausente ou de
+        versão antiga. Retorna uma cópia: o handler pode alterar à vontade.
+        """
+        versao = (await self.versoes([colecao]))[colecao]
+        entrada = self._entradas.get((colecao, chave))
+        if entrada is not None and entrada[0] == versao:
+            self._registrar("hit")
+            return copy.deepcopy(entrada[1])
+
+        self._registrar("miss")
+        # Um carregamento por chave e versão: requisições simultâneas esperam o mesmo, mas
+        # quem chega depois de uma invalidação não pega carona num carregamento anterior
+        # à escrita
+        pendente = self._carregando.get((colecao, chave, versao))
+        if pendente is None:
+            pendente = asyncio.ensure_future(self._carregar(colecao, chave, versao, carregar))
+            self._carregando[(colecao, chave, versao)] = pendente
+        return copy.deepcopy(await asyncio.shield(pendente))
+
+    async def _carregar(self, colecao, chave, versao, carregar):
+        try:
+            valor = await carregar()
+            # Guarda com a versão vista antes de carregar: se houve escrita no meio, a
+            # versão conhecida já é maior e a próxima leitura recarrega. Um carregamento
+            # antigo que termina depois de um mais novo não sobrescreve a entrada
+            atual = self._entradas.get((colecao, chave))
+            if atual is None or atual[0] <= versao:
+                self._entradas[(colecao, chave)] = (versao, valor)
+            return valor
+        finally:
+            self._carregando.pop((colecao, chave, versao), None)
+
+    def invalidar(self, colecao: str, versao: int):
+        """Chamado por quem acabou de escrever, com a versão nova da coleção."""
+        if colecao not in self.colecoes:
+            return
+        self._versoes[colecao] = max(versao, self._versoes.get(colecao, 0))
+        for chave in [k for k in self._entradas if k[0] == colecao]:
+            del self._entradas[chave]
+
+    def limpar(self):
+        self._versoes.clear()
+        self._entradas.clear()
+        self._conferido_em = None
+
+    def _registrar(self, resultado: str):
+        if self._ao_consultar:
+            self._ao_consultar(resultado)
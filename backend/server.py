@@ -1,18 +1,36 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
+import asyncio
+import base64
+import json
 import logging
+import random
+import re
+import unicodedata
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone, timedelta
+import hashlib
+from datetime import date, datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from seed_data import seed_database
+from compression import CompressionMiddleware
+from db_monitoring import PoolMonitor, CommandMonitor
+from metrics import Registry, MetricsMiddleware, medir_lag_event_loop
+from slow_queries import SlowQueryRecorder, handler_atual
+from eventos import Broker, formatar_sse
+from comissoes import CONFIG_PADRAO, calcular_folha_por_config
+from referencias import CacheReferencias
 from zoneinfo import ZoneInfo
 
 ROOT_DIR = Path(__file__).parent
@@ -25,14 +43,76 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 hours
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+# Metrics (texto Prometheus em /api/metrics)
+metrics_registry = Registry()
+http_requests_total = metrics_registry.counter(
+    "http_requests_total", "Requisições HTTP por método, rota e status", ["method", "route", "status"])
+http_request_duration = metrics_registry.histogram(
+    "http_request_duration_seconds", "Latência das requisições HTTP", ["method", "route", "status"])
+mongodb_command_duration = metrics_registry.histogram(
+    "mongodb_command_duration_seconds", "Latência dos comandos MongoDB", ["command", "collection"])
+mongodb_command_failures = metrics_registry.counter(
+    "mongodb_command_failures_total", "Comandos MongoDB com erro", ["command", "collection"])
+mongodb_pool_connections = metrics_registry.gauge(
+    "mongodb_pool_connections", "Conexões do pool por estado", ["estado"])
+mongodb_pool_checkout_wait = metrics_registry.gauge(
+    "mongodb_pool_checkout_wait_seconds", "Espera para obter conexão do pool", ["quantil"])
+cache_requests_total = metrics_registry.counter(
+    "cache_requests_total", "Consultas a caches por resultado (hit/miss)", ["cache", "result"])
+eventos_assinantes = metrics_registry.gauge(
+    "eventos_assinantes", "Conexões abertas no canal de eventos (SSE)")
+event_loop_lag = metrics_registry.gauge(
+    "event_loop_lag_seconds", "Último atraso medido do event loop")
+event_loop_lag_histogram = metrics_registry.histogram(
+    "event_loop_lag_distribution_seconds", "Distribuição do atraso do event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+def observar_comando_mongo(comando: str, colecao: str, duracao_ms: float, falhou: bool):
+    mongodb_command_duration.observe(duracao_ms / 1000, command=comando, collection=colecao)
+    if falhou:
+        mongodb_command_failures.inc(command=comando, collection=colecao)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+
+# Parâmetros do pool (só os definidos no ambiente; o resto fica no padrão do pymongo).
+# Dimensione MONGO_MAX_POOL_SIZE pelo número de workers do uvicorn: cada worker tem seu pool.
+MONGO_POOL_ENV = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+}
+mongo_pool_options = {
+    opcao: int(os.environ[var]) for opcao, var in MONGO_POOL_ENV.items() if os.environ.get(var)
+}
+
+pool_monitor = PoolMonitor()
+command_monitor = CommandMonitor(observadores=[observar_comando_mongo])
+slow_query_recorder = SlowQueryRecorder(
+    limite_ms=float(os.environ.get('SLOW_QUERY_MS', '200')),
+    amostragem=float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE', '1.0')),
+    explains_por_minuto=int(os.environ.get('SLOW_QUERY_EXPLAINS_PER_MIN', '10')),
+)
+client = AsyncIOMotorClient(
+    mongo_url,
+    event_listeners=[pool_monitor, command_monitor, slow_query_recorder],
+    **mongo_pool_options
+)
 db = client[os.environ['DB_NAME']]
 
+async def marcar_handler(request: Request):
+    # Identifica o handler nas operações lentas (o contexto segue para as threads do Motor)
+    rota = request.scope.get("route")
+    endpoint = getattr(rota, "endpoint", None)
+    handler_atual.set(endpoint.__name__ if endpoint else request.url.path)
+
 # Create the main app
 app = FastAPI(title="ExploTrack API", version="2.0.0")
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", dependencies=[Depends(marcar_handler)])
 
 # ==================== MODELS ====================
 
@@ -96,7 +176,6 @@ class CustomerBase(BaseModel):
     limite_credito: float = 0.0
     saldo_devedor: float = 0.0  # Dívida de compras a prazo
     credito_loja: float = 0.0  # Crédito de trocas
-    data_ultimo_credito: Optional[datetime] = None
     filial_id: Optional[str] = None  # Cliente pode ser associado a uma filial
 
 class CustomerCreate(CustomerBase):
@@ -105,7 +184,11 @@ class CustomerCreate(CustomerBase):
 class Customer(CustomerBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    # Gravado só pelas movimentações de crédito (ISO UTC, comparado como texto na expiração);
+    # fora do CustomerCreate para a edição do cadastro não sobrescrever
+    data_ultimo_credito: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Sale Item Model
 class SaleItem(BaseModel):
@@ -155,6 +238,17 @@ class Sale(SaleBase):
     estornada: bool = False
     estornada_em: Optional[str] = None
     estornada_por: Optional[str] = None
+    client_id: Optional[str] = None  # id gerado no caixa quando a venda foi feita offline
+
+# Venda registrada offline e enviada depois em lote (/sales/sync)
+class SaleSync(SaleCreate):
+    client_id: str
+    # Obrigatória: sem ela a venda offline seria gravada com a hora da sincronização
+    data: datetime
+    hora: Optional[str] = None
+
+class SalesSyncRequest(BaseModel):
+    vendas: List[SaleSync]
     
 
 # Payment Plan Models
@@ -268,6 +362,567 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
         raise HTTPException(status_code=400, detail="Usuário inativo")
     return current_user
 
+# ==================== VERSÕES DE COLEÇÃO / ETAG ====================
+
+# Cada coleção de referência tem um contador em db.collection_versions, incrementado
+# em toda escrita. O ETag é derivado desses contadores, então uma requisição condicional
+# com If-None-Match só custa a leitura do contador (e nenhum payload).
+# Escritas feitas fora da API (scripts) devem chamar incrementar_versao também.
+
+async def incrementar_versao(colecao: str) -> int:
+    doc = await db.collection_versions.find_one_and_update(
+        {"_id": colecao},
+        {"$inc": {"versao": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    cache_referencias.invalidar(colecao, doc["versao"])
+    return doc["versao"]
+
+# Catálogos (products/customers) mudam a cada venda: em vez de disputar um único
+# documento, marcar_alteracao incrementa um de VERSAO_SHARDS documentos sorteados
+# ({"_id": "products#3", "colecao": "products"}) e obter_versoes soma todos. A soma só
+# cresce, que é o que o ETag precisa; o número em si não é usado como cursor.
+VERSAO_SHARDS = int(os.environ.get('SYNC_VERSAO_SHARDS', '16'))
+
+async def marcar_alteracao(colecao: str):
+    await db.collection_versions.update_one(
+        {"_id": f"{colecao}#{random.randrange(VERSAO_SHARDS)}"},
+        {"$inc": {"versao": 1}, "$set": {"colecao": colecao}},
+        upsert=True
+    )
+
+async def obter_versoes(colecoes: List[str]) -> dict:
+    docs = await db.collection_versions.find(
+        {"$or": [{"_id": {"$in": colecoes}}, {"colecao": {"$in": colecoes}}]}
+    ).to_list(None)
+    versoes = {c: 0 for c in colecoes}
+    for d in docs:
+        colecao = d.get("colecao", d["_id"])
+        versoes[colecao] = versoes.get(colecao, 0) + d.get("versao", 0)
+    return versoes
+
+def calcular_etag(versoes: dict, request: Request, current_user: User) -> str:
+    # A resposta varia com os parâmetros e com o escopo do usuário (admin vê tudo, gerente só a filial)
+    partes = [f"{c}:{v}" for c, v in sorted(versoes.items())]
+    partes.append(request.url.path)
+    partes.append(str(sorted(request.query_params.multi_items())))
+    partes.append(f"{current_user.role}:{current_user.filial_id}")
+    return '"' + hashlib.sha256("|".join(partes).encode()).hexdigest()[:32] + '"'
+
+def etag_corresponde(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidatos = [c.strip().removeprefix("W/") for c in if_none_match.split(",")]
+    return etag in candidatos
+
+async def verificar_etag(request: Request, response: Response, colecoes: List[str], current_user: User) -> Optional[Response]:
+    """
+    Retorna uma resposta 304 se o cliente já tem a versão atual.
+    Caso contrário define o ETag na resposta e retorna None para o handler seguir.
+    """
+    if all(cache_referencias.acompanha(c) for c in colecoes):
+        versoes = await cache_referencias.versoes(colecoes)
+    else:
+        versoes = await obter_versoes(colecoes)
+    etag = calcular_etag(versoes, request, current_user)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_corresponde(request, etag):
+        cache_requests_total.inc(cache="etag", result="hit")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    cache_requests_total.inc(cache="etag", result="miss")
+    response.headers.update(headers)
+    return None
+
+# ==================== CACHE DE REFERÊNCIA ====================
+
+# Filiais, configurações de comissão e usuários: lidos por quase toda tela e alterados
+# poucas vezes por mês. Ficam no cache do processo (referencias.py), invalidado pela
+# versão da coleção; incrementar_versao, chamado pelos handlers que escrevem, invalida
+# na hora neste worker, e os outros percebem em até REFERENCIA_CACHE_REVALIDAR_SECONDS.
+cache_referencias = CacheReferencias(
+    obter_versoes,
+    ["filiais", "comissao_config", "users"],
+    revalidar_segundos=float(os.environ.get('REFERENCIA_CACHE_REVALIDAR_SECONDS', '5')),
+    ao_consultar=lambda resultado: cache_requests_total.inc(cache="referencias", result=resultado),
+)
+
+async def listar_filiais() -> List[dict]:
+    return await cache_referencias.obter(
+        "filiais", "todas", lambda: db.filiais.find({}, {"_id": 0}).to_list(None)
+    )
+
+async def listar_usuarios() -> List[dict]:
+    """Todos os usuários, sem o hash da senha."""
+    return await cache_referencias.obter(
+        "users", "todos", lambda: db.users.find({}, {"_id": 0, "hashed_password": 0}).to_list(None)
+    )
+
+async def usuarios_da_filial(filial_id: Optional[str]) -> List[dict]:
+    return [u for u in await listar_usuarios() if u.get("filial_id") == filial_id]
+
+async def filtro_vendas_da_equipe(filial_id: str) -> dict:
+    """
+    Filtro das vendas das vendedoras lotadas na filial (filial_id do usuário), feitas em
+    qualquer filial. É a regra de atribuição da folha: a vendedora que também vende numa
+    filial de filiais_acesso recebe tudo na própria filial, com a configuração dela, como
+    na sua tela de performance. Vendas antigas sem vendedor_id casam pelo nome.
+    """
+    usuarios = await usuarios_da_filial(filial_id)
+    return {"$or": [
+        {"vendedor_id": {"$in": [u["id"] for u in usuarios]}},
+        {"vendedor_id": {"$in": [None, ""]}, "vendedor": {"$in": [u["full_name"] for u in usuarios]}},
+    ]}
+
+async def configs_comissao_por_filial() -> dict:
+    async def carregar():
+        return {c["filial_id"]: c for c in await db.comissao_config.find({}, {"_id": 0}).to_list(None)}
+    return await cache_referencias.obter("comissao_config", "por_filial", carregar)
+
+# ==================== IDEMPOTÊNCIA ====================
+
+# POSTs que movem dinheiro/estoque aceitam o header Idempotency-Key. A primeira requisição
+# reserva a chave (insert com _id único); a resposta fica gravada e uma repetição com a
+# mesma chave recebe a resposta gravada, sem executar o handler de novo.
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+# Reserva "processando" mais velha que isso é considerada abandonada (worker caiu no meio)
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '60'))
+
+async def reservar_idempotencia(doc_id: str, hash_corpo: str) -> Optional[Response]:
+    agora = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": doc_id, "hash": hash_corpo, "estado": "processando", "created_at": agora
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+
+    existente = await db.idempotency_keys.find_one({"_id": doc_id})
+    if existente is None:
+        # Expirou entre o insert e a leitura
+        return await reservar_idempotencia(doc_id, hash_corpo)
+    if existente["hash"] != hash_corpo:
+        raise HTTPException(status_code=422, detail="Idempotency-Key já usada com outro conteúdo")
+    if existente["estado"] == "concluido":
+        return JSONResponse(
+            content=existente["resposta"],
+            status_code=existente["status_code"],
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+    assumida = await db.idempotency_keys.find_one_and_update(
+        {"_id": doc_id, "estado": "processando", "created_at": {"$lt": agora - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}},
+        {"$set": {"created_at": agora}}
+    )
+    if assumida:
+        return None
+    raise HTTPException(
+        status_code=409,
+        detail="Requisição com esta Idempotency-Key ainda está em processamento",
+        headers={"Retry-After": "1"}
+    )
+
+async def executar_idempotente(idempotency_key: Optional[str], escopo: str, current_user: User, payload, executar):
+    """
+    Executa `executar()` no máximo uma vez por (usuário, escopo, Idempotency-Key).
+    Sem o header, só executa. Erros liberam a chave para o cliente tentar de novo.
+    """
+    if not idempotency_key:
+        return await executar()
+    if len(idempotency_key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key muito longa (máx. 255)")
+
+    doc_id = f"{current_user.id}:{escopo}:{idempotency_key}"
+    hash_corpo = hashlib.sha256(
+        json.dumps(jsonable_encoder(payload), sort_keys=True).encode()
+    ).hexdigest()
+
+    replay = await reservar_idempotencia(doc_id, hash_corpo)
+    if replay is not None:
+        return replay
+
+    try:
+        resultado = await executar()
+    except Exception:
+        await db.idempotency_keys.delete_one({"_id": doc_id, "estado": "processando"})
+        raise
+
+    await db.idempotency_keys.update_one(
+        {"_id": doc_id},
+        {"$set": {"estado": "concluido", "status_code": 200, "resposta": jsonable_encoder(resultado)}}
+    )
+    return resultado
+
+# ==================== SINCRONIZAÇÃO INCREMENTAL (CATÁLOGOS) ====================
+
+# Toda escrita em products/customers grava `gravado_em` com $currentDate, ou seja, com o
+# relógio do banco no mesmo comando da escrita (GRAVADO_EM entra no update), e
+# `updated_at` para exibição; remoções viram tombstones em sync_tombstones. O feed
+# /products/changes e /customers/changes pagina por (gravado_em, id) a partir do cursor
+# "epoch_ms:id" do cliente. Um documento só aparece no feed SYNC_SETTLE_SECONDS depois
+# de gravado (comparando com $$NOW, também do banco): duas escritas simultâneas podem
+# ficar visíveis fora da ordem de gravado_em, e a folga cobre essa janela.
+SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', '2'))
+SYNC_PAGE_MAX = 1000
+GRAVADO_EM = {"$currentDate": {"gravado_em": True}}
+
+async def carimbo_sync(colecao: str) -> dict:
+    """Campos de controle para o $set de uma escrita; o update também leva **GRAVADO_EM."""
+    await marcar_alteracao(colecao)
+    return {"updated_at": datetime.now(timezone.utc).isoformat()}
+
+async def inserir_com_carimbo(colecao: str, doc: dict):
+    """insert_one com gravado_em do banco; o índice único continua valendo (DuplicateKeyError)."""
+    await db[colecao].update_one({"id": doc["id"]}, {"$setOnInsert": doc, **GRAVADO_EM}, upsert=True)
+
+async def registrar_remocoes(colecao: str, docs: List[dict]):
+    """Grava tombstones ({"id", "filial_id"} de cada documento removido) com um único carimbo."""
+    if not docs:
+        return
+    carimbo = await carimbo_sync(colecao)
+    await db.sync_tombstones.bulk_write([
+        UpdateOne(
+            {"colecao": colecao, "id": d["id"]},
+            {"$set": {"filial_id": d.get("filial_id"), **carimbo}, **GRAVADO_EM},
+            upsert=True
+        )
+        for d in docs
+    ], ordered=False)
+
+def ler_cursor_sync(since: str) -> tuple:
+    # Cursor "epoch_ms:id" devolvido pelo feed; "0" (ou vazio) = desde o início. Cursores
+    # antigos ("versao:id") viram um instante perto de 1970 e o cliente ressincroniza tudo.
+    epoch_ms, _, ultimo_id = (since or "0").partition(":")
+    try:
+        return datetime.fromtimestamp(int(epoch_ms) / 1000, tz=timezone.utc), ultimo_id
+    except (ValueError, OverflowError, OSError):
+        raise HTTPException(status_code=400, detail="Cursor 'since' inválido")
+
+def codificar_cursor_sync(gravado_em: datetime, doc_id: str) -> str:
+    if gravado_em.tzinfo is None:
+        gravado_em = gravado_em.replace(tzinfo=timezone.utc)
+    return f"{int(gravado_em.timestamp() * 1000)}:{doc_id}"
+
+async def feed_alteracoes(colecao: str, since: str, filial_id: Optional[str], limit: int) -> dict:
+    gravado_em, ultimo_id = ler_cursor_sync(since)
+    limit = max(1, min(limit, SYNC_PAGE_MAX))
+    query = {
+        "$or": [{"gravado_em": {"$gt": gravado_em}}, {"gravado_em": gravado_em, "id": {"$gt": ultimo_id}}],
+        "$expr": {"$lte": ["$gravado_em", {"$subtract": ["$$NOW", int(SYNC_SETTLE_SECONDS * 1000)]}]},
+    }
+    if filial_id:
+        query["filial_id"] = filial_id
+
+    ordem = [("gravado_em", 1), ("id", 1)]
+    alterados = await db[colecao].find(query, {"_id": 0}).sort(ordem).limit(limit + 1).to_list(limit + 1)
+    removidos = await db.sync_tombstones.find(
+        {**query, "colecao": colecao}, {"_id": 0, "colecao": 0}
+    ).sort(ordem).limit(limit + 1).to_list(limit + 1)
+
+    eventos = sorted(
+        [(d["gravado_em"], d["id"], False, d) for d in alterados]
+        + [(t["gravado_em"], t["id"], True, t) for t in removidos],
+        key=lambda e: (e[0], e[1])
+    )
+    tem_mais = len(eventos) > limit
+    eventos = eventos[:limit]
+    cursor = codificar_cursor_sync(eventos[-1][0], eventos[-1][1]) if eventos else (since or "0")
+    return {
+        "itens": [d for _, _, removido, d in eventos if not removido],
+        "removidos": [d["id"] for _, _, removido, d in eventos if removido],
+        "cursor": cursor,
+        "tem_mais": tem_mais,
+    }
+
+async def preencher_versoes_sync():
+    """Documentos gravados antes do feed (ou por scripts) entram com gravado_em em 1970."""
+    for colecao in ["products", "customers", "sync_tombstones"]:
+        await db[colecao].update_many(
+            {"gravado_em": {"$exists": False}},
+            [{"$set": {
+                "gravado_em": datetime(1970, 1, 1, tzinfo=timezone.utc),
+                "updated_at": {"$ifNull": ["$updated_at", {"$ifNull": ["$created_at", "1970-01-01T00:00:00+00:00"]}]},
+            }}]
+        )
+
+# ==================== PAGINAÇÃO POR CURSOR (KEYSET) ====================
+
+# Telas com dezenas de milhares de linhas paginam por cursor em vez de skip: o cursor
+# guarda (valor do campo de ordenação, id) da última linha e a próxima página começa
+# logo depois dela, usando o índice (filial_id, campo, id) em qualquer profundidade.
+PAGINA_LIMITE_MAX = 500
+
+def codificar_cursor(valor, doc_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([valor, doc_id]).encode()).decode()
+
+def decodificar_cursor(cursor: str):
+    try:
+        valor, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return valor, doc_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def filtro_apos_cursor(campo: str, direcao: int, valor, doc_id: str, desempate: bool) -> dict:
+    """Linhas depois de (valor, id) na ordem (campo, id). Nulos vêm antes na ordem
+    crescente e depois na decrescente, como no MongoDB."""
+    operador = "$gt" if direcao == 1 else "$lt"
+    if valor is None:
+        condicoes = [{campo: None, "id": {operador: doc_id}}] if desempate else []
+        if direcao == 1:
+            condicoes.append({campo: {"$ne": None}})
+    else:
+        condicoes = [{campo: {operador: valor}}]
+        if desempate:
+            condicoes.append({campo: valor, "id": {operador: doc_id}})
+        if direcao == -1:
+            condicoes.append({campo: None})
+    if not condicoes:
+        # Último nulo da ordem decrescente sem desempate: não há mais linhas
+        return {"id": {"$in": []}}
+    return {"$or": condicoes} if len(condicoes) > 1 else condicoes[0]
+
+async def pagina_keyset(colecao: str, filtro: dict, campo: str, direcao: int, cursor: Optional[str],
+                        limit: int, desempate: bool = True) -> dict:
+    """
+    Uma página de `colecao` ordenada por `campo` (e `id` como desempate, dispensável
+    quando o campo já é único no filtro). Retorna {itens, cursor, tem_mais}.
+    """
+    limit = max(1, min(limit, PAGINA_LIMITE_MAX))
+    if cursor:
+        valor, doc_id = decodificar_cursor(cursor)
+        filtro = {"$and": [filtro, filtro_apos_cursor(campo, direcao, valor, doc_id, desempate)]}
+    ordem = [(campo, direcao)] + ([("id", direcao)] if desempate else [])
+
+    itens = await db[colecao].find(filtro, {"_id": 0}).sort(ordem).limit(limit + 1).to_list(limit + 1)
+    tem_mais = len(itens) > limit
+    itens = itens[:limit]
+    proximo = codificar_cursor(itens[-1].get(campo), itens[-1]["id"]) if tem_mais else None
+    return {"itens": itens, "cursor": proximo, "tem_mais": tem_mais}
+
+def parametros_ordenacao(ordenar: str, direcao: str, permitidos: dict):
+    if ordenar not in permitidos:
+        raise HTTPException(status_code=400, detail=f"ordenar deve ser um de: {', '.join(permitidos)}")
+    if direcao not in ["asc", "desc"]:
+        raise HTTPException(status_code=400, detail="direcao deve ser asc ou desc")
+    return ordenar, 1 if direcao == "asc" else -1, permitidos[ordenar]
+
+# ==================== BUSCA DE CLIENTES (TYPEAHEAD) ====================
+
+# Cada cliente guarda nome sem acento/minúsculo, CPF e telefone só com dígitos. A busca
+# do PDV faz prefixo (^termo) nesses campos, que o índice (filial_id, campo) resolve
+# como faixa, sem varrer a base de clientes.
+BUSCA_CLIENTES_LIMITE_MAX = 20
+
+def normalizar_texto(texto: Optional[str]) -> str:
+    sem_acento = unicodedata.normalize("NFKD", texto or "").encode("ascii", "ignore").decode()
+    return " ".join(sem_acento.lower().split())
+
+def somente_digitos(texto: Optional[str]) -> str:
+    return re.sub(r"\D", "", texto or "")
+
+def campos_busca_cliente(doc: dict) -> dict:
+    return {
+        "nome_busca": normalizar_texto(doc.get("nome")),
+        "cpf_digitos": somente_digitos(doc.get("cpf")) or None,
+        "telefone_digitos": somente_digitos(doc.get("telefone")) or None,
+    }
+
+async def preencher_campos_busca_clientes(lote: int = 500):
+    """
+    Calcula os campos de busca (inclusive o CPF normalizado) dos clientes gravados antes
+    deles existirem, em lotes. Um CPF que já pertence a outro cliente não entra no índice
+    único: o cliente fica com cpf_duplicado=True para revisão (scripts/normalizar_cpfs.py).
+    Bases em que só os campos do typeahead foram preenchidos (sem cpf_digitos) também
+    passam por aqui.
+    """
+    filtro = {"$or": [{"nome_busca": {"$exists": False}}, {"cpf_digitos": {"$exists": False}}]}
+    while True:
+        pendentes = await db.customers.find(
+            filtro, {"_id": 0, "id": 1, "nome": 1, "cpf": 1, "telefone": 1}
+        ).limit(lote).to_list(lote)
+        if not pendentes:
+            break
+        try:
+            await db.customers.bulk_write([
+                UpdateOne({"id": c["id"]}, {"$set": campos_busca_cliente(c)}) for c in pendentes
+            ], ordered=False)
+        except BulkWriteError as e:
+            erros = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in erros):
+                raise
+            duplicados = [pendentes[err["index"]] for err in erros]
+            await db.customers.bulk_write([
+                UpdateOne({"id": c["id"]}, {"$set": {**campos_busca_cliente(c), "cpf_digitos": None, "cpf_duplicado": True}})
+                for c in duplicados
+            ], ordered=False)
+            logger.warning("%d clientes com CPF repetido marcados com cpf_duplicado", len(duplicados))
+        if len(pendentes) < lote:
+            break
+    await resolver_cpfs_repetidos(lote)
+
+async def resolver_cpfs_repetidos(lote: int = 500):
+    """
+    CPFs repetidos entre clientes que já têm cpf_digitos (gravados enquanto o índice
+    cpf_unico não existia) impedem a criação do índice. Em cada grupo o cliente mais
+    antigo fica com o CPF e os demais recebem cpf_digitos=None e cpf_duplicado=True,
+    como no --corrigir de scripts/normalizar_cpfs.py.
+    """
+    grupos = await db.customers.aggregate([
+        {"$match": {"cpf_digitos": {"$type": "string"}}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {"_id": "$cpf_digitos", "ids": {"$push": "$id"}, "quantidade": {"$sum": 1}}},
+        {"$match": {"quantidade": {"$gt": 1}}},
+    ], allowDiskUse=True).to_list(None)
+    ids = [i for g in grupos for i in g["ids"][1:]]
+    for i in range(0, len(ids), lote):
+        await db.customers.update_many(
+            {"id": {"$in": ids[i:i + lote]}}, {"$set": {"cpf_digitos": None, "cpf_duplicado": True}}
+        )
+    if ids:
+        logger.warning("%d clientes com CPF repetido marcados com cpf_duplicado", len(ids))
+
+# O índice cpf_unico é quem barra CPF repetido no cadastro. Se ele não existir (falhou
+# no startup), create/update de cliente consultam antes pelo índice busca_cpf: há corrida
+# entre dois cadastros simultâneos, mas o repetido não passa em silêncio.
+cpf_unico_estado = {"ativo": False}
+
+async def garantir_cpf_unico():
+    """Depois do backfill, tenta de novo o índice cpf_unico e registra se ele existe."""
+    for colecao, chaves, opcoes in INDICES:
+        if opcoes.get("name") == "cpf_unico":
+            try:
+                await db[colecao].create_index(chaves, **opcoes)
+            except OperationFailure as e:
+                logger.warning("Índice cpf_unico não criado: %s", e)
+    cpf_unico_estado["ativo"] = "cpf_unico" in await db.customers.index_information()
+    if not cpf_unico_estado["ativo"]:
+        logger.error("Índice cpf_unico ausente: CPF repetido verificado por consulta no cadastro de clientes")
+
+async def verificar_cpf_sem_indice(cpf_digitos: Optional[str], exceto_id: Optional[str] = None):
+    """Sem o índice cpf_unico, faz a checagem dele: DuplicateKeyError se o CPF já é de outro cliente."""
+    if not cpf_digitos or cpf_unico_estado["ativo"]:
+        return
+    if await db.customers.find_one({"cpf_digitos": cpf_digitos, "id": {"$ne": exceto_id}}, {"_id": 1}):
+        raise DuplicateKeyError(f"cpf_digitos {cpf_digitos} já cadastrado")
+
+# ==================== EVENTOS EM TEMPO REAL (SSE) ====================
+
+# Vendas, estornos, estoque e movimentos de caixa são publicados por filial em
+# /api/eventos. Por padrão quem publica são os handlers de escrita; com
+# EVENTOS_CHANGE_STREAMS=1 (replica set) os change streams alimentam o broker de cada
+# worker e os handlers deixam de publicar, para não duplicar.
+EVENTOS_HEARTBEAT_SECONDS = float(os.environ.get('EVENTOS_HEARTBEAT_SECONDS', '15'))
+eventos_broker = Broker(max_pendentes=int(os.environ.get('EVENTOS_FILA_MAX', '200')))
+eventos_estado = {"change_streams": os.environ.get('EVENTOS_CHANGE_STREAMS') == '1'}
+
+# O que a tela de fechamento precisa para aplicar a venda ao resumo sem recarregar
+CAMPOS_EVENTO_VENDA = ["id", "filial_id", "total", "modalidade_pagamento", "pagamentos", "parcelas", "items",
+                       "vendedor", "vendedor_id", "customer_id", "is_troca", "estornada", "data", "hora"]
+
+def publicar_evento(filial_id: Optional[str], tipo: str, dados: dict, chave=None):
+    if eventos_estado["change_streams"]:
+        return
+    eventos_broker.publicar(filial_id, tipo, dados, chave)
+
+def publicar_venda(tipo: str, doc: dict):
+    publicar_evento(doc.get("filial_id"), tipo, {k: doc.get(k) for k in CAMPOS_EVENTO_VENDA})
+
+def publicar_estoque(filial_id: Optional[str], product_id: str, quantidade: int):
+    # Coalescido por produto: o cliente só precisa da quantidade mais recente
+    publicar_evento(filial_id, "estoque_alterado", {"product_id": product_id, "quantidade": quantidade}, chave=product_id)
+
+def traduzir_mudanca(change: dict):
+    """Converte um evento de change stream no evento equivalente dos handlers."""
+    colecao = change["ns"]["coll"]
+    operacao = change["operationType"]
+    doc = change.get("fullDocument") or {}
+    alterados = change.get("updateDescription", {}).get("updatedFields", {})
+
+    if colecao == "sales":
+        if operacao == "insert":
+            eventos_broker.publicar(doc.get("filial_id"), "venda_criada", {k: doc.get(k) for k in CAMPOS_EVENTO_VENDA})
+        elif operacao == "update" and alterados.get("estornada"):
+            eventos_broker.publicar(doc.get("filial_id"), "venda_estornada", {k: doc.get(k) for k in CAMPOS_EVENTO_VENDA})
+    elif colecao == "products":
+        if doc and (operacao in ("insert", "replace") or "quantidade" in alterados):
+            eventos_broker.publicar(
+                doc.get("filial_id"), "estoque_alterado",
+                {"product_id": doc.get("id"), "quantidade": doc.get("quantidade")}, chave=doc.get("id")
+            )
+    elif colecao == "caixa_movimentos":
+        if operacao == "delete":
+            # O delete não traz o documento: sem a filial, avisa todas
+            eventos_broker.publicar(None, "caixa_movimento", {"acao": "removido"})
+        elif doc:
+            doc.pop("_id", None)
+            acao = "criado" if operacao == "insert" else "alterado"
+            eventos_broker.publicar(doc.get("filial_id"), "caixa_movimento", {"acao": acao, "movimento": doc})
+
+async def observar_change_streams():
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": ["sales", "products", "caixa_movimentos"]},
+        "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+    }}]
+    primeira_conexao = True
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup") as stream:
+                if not primeira_conexao:
+                    # Eventos perdidos enquanto o stream estava fora: clientes recarregam
+                    eventos_broker.publicar(None, "resync", {})
+                primeira_conexao = False
+                async for change in stream:
+                    traduzir_mudanca(change)
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            # Ex.: mongod standalone (change streams exigem replica set)
+            logger.warning("Change streams indisponíveis (%s); eventos publicados pelos handlers", e)
+            eventos_estado["change_streams"] = False
+            return
+        except Exception as e:
+            logger.warning("Change stream interrompido: %s; reconectando", e)
+            await asyncio.sleep(5)
+
+@api_router.get("/eventos")
+async def stream_eventos(request: Request, filial_id: str, token: Optional[str] = None):
+    """
+    Server-Sent Events da filial: venda_criada, venda_estornada, estoque_alterado,
+    caixa_movimento e resync (recarregar tudo). O EventSource do navegador não envia
+    headers, então o JWT pode vir em ?token=.
+    """
+    if not token:
+        token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not token:
+        raise HTTPException(status_code=401, detail="Não autenticado", headers={"WWW-Authenticate": "Bearer"})
+    current_user = await get_current_active_user(await get_current_user(token))
+    if current_user.role != "admin" and filial_id != current_user.filial_id and filial_id not in current_user.filiais_acesso:
+        raise HTTPException(status_code=403, detail="Sem acesso aos eventos desta filial")
+
+    assinatura = eventos_broker.assinar(filial_id)
+
+    async def gerar():
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                eventos = await assinatura.proximos(EVENTOS_HEARTBEAT_SECONDS)
+                if not eventos:
+                    yield b": ping\n\n"
+                    continue
+                yield b"".join(formatar_sse(e) for e in eventos)
+        finally:
+            eventos_broker.cancelar(assinatura)
+
+    return StreamingResponse(
+        gerar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register", response_model=User)
@@ -286,6 +941,7 @@ async def register(user: UserCreate):
     doc = user_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.users.insert_one(doc)
+    await incrementar_versao("users")
     
     return User(**user_dict, id=user_obj.id, created_at=user_obj.created_at)
 
@@ -320,16 +976,17 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
 
 @api_router.get("/users", response_model=List[User])
-async def get_all_users(current_user: User = Depends(get_current_active_user)):
+async def get_all_users(request: Request, response: Response, current_user: User = Depends(get_current_active_user)):
+    not_modified = await verificar_etag(request, response, ["users"], current_user)
+    if not_modified:
+        return not_modified
+
     # Admin vê todos os usuários
     if current_user.role == "admin":
-        users = await db.users.find({}, {"_id": 0, "hashed_password": 0}).to_list(100)
+        users = await listar_usuarios()
     # Gerentes e vendedoras veem apenas usuários da mesma filial
     elif current_user.role in ["gerente", "vendedora"]:
-        users = await db.users.find(
-            {"filial_id": current_user.filial_id}, 
-            {"_id": 0, "hashed_password": 0}
-        ).to_list(100)
+        users = await usuarios_da_filial(current_user.filial_id)
     else:
         raise HTTPException(status_code=403, detail="Sem permissão para listar usuários")
     
@@ -349,6 +1006,7 @@ async def update_user(user_id: str, user_data: UserCreate, current_user: User =
         update_dict['hashed_password'] = get_password_hash(user_data.password)
     
     await db.users.update_one({"id": user_id}, {"$set": update_dict})
+    await incrementar_versao("users")
     return {"message": "Usuário atualizado com sucesso"}
 
 @api_router.delete("/users/{user_id}")
@@ -360,6 +1018,7 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_act
     result = await db.users.delete_one({"id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    await incrementar_versao("users")
     return {"message": "Usuário excluído com sucesso"}
 
 # ==================== PRODUCT ROUTES ====================
@@ -381,18 +1040,63 @@ async def create_product(product: ProductCreate, current_user: User = Depends(ge
     product_obj = Product(**product.model_dump())
     doc = product_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
+    doc.update(await carimbo_sync("products"))
     
-    await db.products.insert_one(doc)
+    try:
+        await inserir_com_carimbo("products", doc)
+    except DuplicateKeyError:
+        # Cadastro simultâneo do mesmo código: o índice único filial_codigo_unico barra o segundo
+        raise HTTPException(status_code=400, detail="Código de produto já existe nesta filial")
     return product_obj
 
+@api_router.put("/products/upsert")
+async def upsert_product(product: ProductCreate, current_user: User = Depends(get_current_active_user)):
+    """
+    Cria ou atualiza o produto pelo código dentro da filial, numa única operação
+    atômica (índice único em filial_id + codigo). Retorna o produto e `criado`.
+    """
+    if current_user.role not in ["admin", "gerente"]:
+        raise HTTPException(status_code=403, detail="Apenas administradores e gerentes podem cadastrar produtos")
+
+    novo_id = str(uuid.uuid4())
+    agora = datetime.now(timezone.utc).isoformat()
+    update_data = product.model_dump()
+    update_data.update(await carimbo_sync("products"))
+    filtro = {"filial_id": product.filial_id, "codigo": product.codigo}
+    operacao = {"$set": update_data, "$setOnInsert": {"id": novo_id, "created_at": agora}, **GRAVADO_EM}
+
+    try:
+        doc = await db.products.find_one_and_update(
+            filtro, operacao, upsert=True, return_document=ReturnDocument.AFTER, projection={"_id": 0}
+        )
+    except DuplicateKeyError:
+        # Dois upserts do mesmo código ao mesmo tempo: um insere, o outro colide no índice
+        # único. Agora o documento existe e a repetição vira update.
+        doc = await db.products.find_one_and_update(
+            filtro, operacao, return_document=ReturnDocument.AFTER, projection={"_id": 0}
+        )
+        if doc is None:
+            raise HTTPException(status_code=409, detail="Produto alterado por outra operação; tente novamente")
+
+    publicar_estoque(doc.get('filial_id'), doc['id'], doc['quantidade'])
+    for campo in ['created_at', 'updated_at']:
+        if isinstance(doc.get(campo), str):
+            doc[campo] = datetime.fromisoformat(doc[campo])
+    return {**Product(**doc).model_dump(), "criado": doc['id'] == novo_id}
+
 @api_router.get("/products", response_model=List[Product])
 async def get_products(
+    request: Request,
+    response: Response,
     filial_id: Optional[str] = None, 
     skip: int = 0, 
     limit: int = 100, 
     current_user: User = Depends(get_current_active_user)
 ):
+    not_modified = await verificar_etag(request, response, ["products"], current_user)
+    if not_modified:
+        return not_modified
+
     query = {}
     if filial_id:
         query["filial_id"] = filial_id
@@ -406,6 +1110,69 @@ async def get_products(
             p['updated_at'] = datetime.fromisoformat(p['updated_at'])
     return products
 
+# campo de ordenação -> precisa de desempate por id (codigo já é único na filial)
+ORDENACAO_PRODUTOS = {"codigo": False, "descricao": True, "quantidade": True, "preco_venda": True}
+ESTOQUE_BAIXO = 5
+
+@api_router.get("/products/pagina")
+async def get_products_pagina(
+    filial_id: str,
+    q: Optional[str] = None,
+    categoria: Optional[str] = None,
+    estoque: Optional[str] = None,
+    ordenar: str = "codigo",
+    direcao: str = "asc",
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Produtos da filial para a tela de cadastro, filtrados e ordenados no servidor.
+    Passe o `cursor` da resposta para a próxima página. Sem cursor (primeira página)
+    a resposta traz também `total`, e sem busca nem filtros também `ultimo_codigo`
+    (maior código numérico da filial, que varre todos os produtos dela).
+    """
+    campo, sentido, desempate = parametros_ordenacao(ordenar, direcao, ORDENACAO_PRODUTOS)
+    filtro = {"filial_id": filial_id}
+    if q:
+        termo = re.escape(q.strip())
+        filtro["$or"] = [
+            {"codigo": {"$regex": f"^{termo}"}},
+            {"descricao": {"$regex": termo, "$options": "i"}},
+            {"categoria": {"$regex": termo, "$options": "i"}},
+        ]
+    if categoria:
+        filtro["categoria"] = categoria
+    if estoque == "baixo":
+        filtro["quantidade"] = {"$lt": ESTOQUE_BAIXO}
+    elif estoque == "zerado":
+        filtro["quantidade"] = {"$lte": 0}
+    elif estoque:
+        raise HTTPException(status_code=400, detail="estoque deve ser baixo ou zerado")
+
+    pagina = await pagina_keyset("products", filtro, campo, sentido, cursor, limit, desempate)
+    if not cursor:
+        pagina["total"] = await db.products.count_documents(filtro)
+    if not cursor and not (q or categoria or estoque):
+        maior = await db.products.aggregate([
+            {"$match": {"filial_id": filial_id}},
+            {"$group": {"_id": None, "maior": {"$max": {
+                "$convert": {"input": "$codigo", "to": "long", "onError": None, "onNull": None}
+            }}}},
+        ]).to_list(1)
+        pagina["ultimo_codigo"] = maior[0]["maior"] if maior else None
+    return pagina
+
+@api_router.get("/products/changes")
+async def get_products_changes(
+    since: str = "0",
+    filial_id: Optional[str] = None,
+    limit: int = 500,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Produtos alterados/removidos depois do cursor `since` (use o `cursor` da resposta anterior)."""
+    return await feed_alteracoes("products", since, filial_id, limit)
+
 @api_router.get("/products/{product_id}", response_model=Product)
 async def get_product(product_id: str, current_user: User = Depends(get_current_active_user)):
     product = await db.products.find_one({"id": product_id}, {"_id": 0})
@@ -476,11 +1243,18 @@ async def update_product(product_id: str, product: ProductCreate, current_user:
             raise HTTPException(status_code=400, detail="Código de produto já existe nesta filial")
     
     update_data = product.model_dump()
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data.update(await carimbo_sync("products"))
     
-    await db.products.update_one({"id": product_id}, {"$set": update_data})
+    try:
+        updated = await db.products.find_one_and_update(
+            {"id": product_id}, {"$set": update_data, **GRAVADO_EM},
+            return_document=ReturnDocument.AFTER, projection={"_id": 0}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Código de produto já existe nesta filial")
+    if update_data['quantidade'] != existing.get('quantidade'):
+        publicar_estoque(update_data.get('filial_id'), product_id, update_data['quantidade'])
     
-    updated = await db.products.find_one({"id": product_id}, {"_id": 0})
     if isinstance(updated.get('created_at'), str):
         updated['created_at'] = datetime.fromisoformat(updated['created_at'])
     if isinstance(updated.get('updated_at'), str):
@@ -493,35 +1267,39 @@ async def delete_product(product_id: str, current_user: User = Depends(get_curre
     if current_user.role not in ["admin", "gerente"]:
         raise HTTPException(status_code=403, detail="Apenas administradores e gerentes podem excluir produtos")
     
-    result = await db.products.delete_one({"id": product_id})
-    if result.deleted_count == 0:
+    removido = await db.products.find_one_and_delete({"id": product_id}, {"_id": 0, "id": 1, "filial_id": 1})
+    if not removido:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
+    await registrar_remocoes("products", [removido])
     return {"message": "Produto excluído com sucesso"}
 
 # ==================== CUSTOMER ROUTES ====================
 
+async def erro_cpf_duplicado(cpf_digitos: str) -> HTTPException:
+    existing = await db.customers.find_one({"cpf_digitos": cpf_digitos}, {"_id": 0, "nome": 1})
+    return HTTPException(
+        status_code=400,
+        detail=f"Já existe um cliente cadastrado com este CPF: {existing.get('nome') if existing else ''}"
+    )
+
 @api_router.post("/customers", response_model=Customer)
 async def create_customer(customer: CustomerCreate, current_user: User = Depends(get_current_active_user)):
-    # 1. Validação de CPF Duplicado
-    if customer.cpf:
-        # Limpa pontuação do CPF para comparar apenas números (opcional, mas recomendado)
-        cpf_limpo = customer.cpf.replace(".", "").replace("-", "").strip()
-        
-        # Busca se já existe algum cliente com esse CPF (mesmo em outras filiais, pois a pessoa é única)
-        # Se quiser limitar por filial, adicione "filial_id": customer.filial_id na busca
-        existing = await db.customers.find_one({"cpf": customer.cpf}, {"_id": 0})
-        
-        if existing:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Já existe um cliente cadastrado com este CPF: {existing.get('nome')}"
-            )
-
     customer_obj = Customer(**customer.model_dump())
     doc = customer_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
-    
-    await db.customers.insert_one(doc)
+    if doc['credito_loja'] > 0:
+        # Crédito inicial no cadastro: o prazo de validade começa agora
+        doc['data_ultimo_credito'] = doc['created_at']
+    doc.update(campos_busca_cliente(doc))
+    doc.update(await carimbo_sync("customers"))
+    
+    # CPF único em todas as filiais (a pessoa é única): quem garante é o índice
+    # cpf_unico sobre os dígitos, sem consulta prévia e sem corrida entre dois cadastros
+    try:
+        await verificar_cpf_sem_indice(doc['cpf_digitos'])
+        await inserir_com_carimbo("customers", doc)
+    except DuplicateKeyError:
+        raise await erro_cpf_duplicado(doc['cpf_digitos'])
     return customer_obj
 
 @api_router.get("/customers", response_model=List[Customer])
@@ -542,6 +1320,83 @@ async def get_customers(
             c['created_at'] = datetime.fromisoformat(c['created_at'])
     return customers
 
+ORDENACAO_CLIENTES = {"nome": True, "saldo_devedor": True, "credito_loja": True}
+
+@api_router.get("/customers/pagina")
+async def get_customers_pagina(
+    filial_id: str,
+    q: Optional[str] = None,
+    situacao: Optional[str] = None,
+    ordenar: str = "nome",
+    direcao: str = "asc",
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Clientes da filial para a tela de cadastro, filtrados e ordenados no servidor.
+    situacao: com_debito (saldo devedor) ou com_credito (crédito de loja).
+    Sem cursor a resposta traz também `total`.
+    """
+    campo, sentido, desempate = parametros_ordenacao(ordenar, direcao, ORDENACAO_CLIENTES)
+    filtro = {"filial_id": filial_id}
+    if q:
+        termo = re.escape(q.strip())
+        filtro["$or"] = [
+            {"nome": {"$regex": termo, "$options": "i"}},
+            {"telefone": {"$regex": termo}},
+            {"cpf": {"$regex": termo}},
+        ]
+    if situacao == "com_debito":
+        filtro["saldo_devedor"] = {"$gt": 0}
+    elif situacao == "com_credito":
+        filtro["credito_loja"] = {"$gt": 0}
+    elif situacao:
+        raise HTTPException(status_code=400, detail="situacao deve ser com_debito ou com_credito")
+
+    pagina = await pagina_keyset("customers", filtro, campo, sentido, cursor, limit, desempate)
+    if not cursor:
+        pagina["total"] = await db.customers.count_documents(filtro)
+    return pagina
+
+@api_router.get("/customers/busca")
+async def buscar_clientes(
+    filial_id: str,
+    q: str,
+    limit: int = 10,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Typeahead do PDV: clientes da filial cujo nome começa com `q` (sem diferenciar
+    acentos e maiúsculas) ou, se `q` tiver dígitos, cujo CPF ou telefone começa com eles.
+    """
+    limit = max(1, min(limit, BUSCA_CLIENTES_LIMITE_MAX))
+    nome = normalizar_texto(q)
+    digitos = somente_digitos(q)
+    if len(nome) < 2 and len(digitos) < 3:
+        return []
+
+    projecao = {"_id": 0, "id": 1, "nome": 1, "cpf": 1, "telefone": 1,
+                "saldo_devedor": 1, "credito_loja": 1, "limite_credito": 1}
+    if digitos and not re.search(r"[a-z]", nome):
+        # Termo sem letras (com ou sem pontuação): CPF ou telefone
+        prefixo = {"$regex": f"^{digitos}"}
+        filtro = {"filial_id": filial_id, "$or": [{"cpf_digitos": prefixo}, {"telefone_digitos": prefixo}]}
+        return await db.customers.find(filtro, projecao).limit(limit).to_list(limit)
+
+    filtro = {"filial_id": filial_id, "nome_busca": {"$regex": f"^{re.escape(nome)}"}}
+    return await db.customers.find(filtro, projecao).sort("nome_busca", 1).limit(limit).to_list(limit)
+
+@api_router.get("/customers/changes")
+async def get_customers_changes(
+    since: str = "0",
+    filial_id: Optional[str] = None,
+    limit: int = 500,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Clientes alterados/removidos depois do cursor `since` (use o `cursor` da resposta anterior)."""
+    return await feed_alteracoes("customers", since, filial_id, limit)
+
 @api_router.get("/customers/{customer_id}", response_model=Customer)
 async def get_customer(customer_id: str, current_user: User = Depends(get_current_active_user)):
     customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
@@ -552,8 +1407,14 @@ async def get_customer(customer_id: str, current_user: User = Depends(get_curren
     return Customer(**customer)
 
 @api_router.get("/customers/{customer_id}/sales")
-async def get_customer_sales(customer_id: str, current_user: User = Depends(get_current_active_user)):
-    sales = await db.sales.find({"customer_id": customer_id}, {"_id": 0}).to_list(1000)
+async def get_customer_sales(
+    customer_id: str,
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    projection = build_sale_projection(fields, view) or {"_id": 0}
+    sales = await db.sales.find({"customer_id": customer_id}, projection).to_list(1000)
     for s in sales:
         if isinstance(s.get('data'), str):
             s['data'] = datetime.fromisoformat(s['data'])
@@ -566,7 +1427,24 @@ async def update_customer(customer_id: str, customer: CustomerCreate, current_us
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
     
     update_data = customer.model_dump()
-    await db.customers.update_one({"id": customer_id}, {"$set": update_data})
+    if update_data['credito_loja'] > existing.get('credito_loja', 0) or (
+        update_data['credito_loja'] > 0 and not existing.get('data_ultimo_credito')
+    ):
+        # Crédito lançado à mão no cadastro conta como movimentação
+        update_data['data_ultimo_credito'] = datetime.now(timezone.utc).isoformat()
+    update_data.update(campos_busca_cliente(update_data))
+    update_data.update(await carimbo_sync("customers"))
+    if existing.get('cpf_duplicado'):
+        update_data['cpf_duplicado'] = False
+    try:
+        await verificar_cpf_sem_indice(update_data['cpf_digitos'], customer_id)
+        await db.customers.update_one({"id": customer_id}, {"$set": update_data, **GRAVADO_EM})
+    except DuplicateKeyError:
+        if not existing.get('cpf_duplicado') or somente_digitos(existing.get('cpf')) != update_data['cpf_digitos']:
+            raise await erro_cpf_duplicado(update_data['cpf_digitos'])
+        # Cliente legado que já dividia o CPF com outro: segue fora do índice até a revisão
+        update_data.update({"cpf_digitos": None, "cpf_duplicado": True})
+        await db.customers.update_one({"id": customer_id}, {"$set": update_data, **GRAVADO_EM})
     
     updated = await db.customers.find_one({"id": customer_id}, {"_id": 0})
     if isinstance(updated.get('created_at'), str):
@@ -575,9 +1453,10 @@ async def update_customer(customer_id: str, customer: CustomerCreate, current_us
 
 @api_router.delete("/customers/{customer_id}")
 async def delete_customer(customer_id: str, current_user: User = Depends(get_current_active_user)):
-    result = await db.customers.delete_one({"id": customer_id})
-    if result.deleted_count == 0:
+    removido = await db.customers.find_one_and_delete({"id": customer_id}, {"_id": 0, "id": 1, "filial_id": 1})
+    if not removido:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    await registrar_remocoes("customers", [removido])
     return {"message": "Cliente excluído com sucesso"}
 
 
@@ -628,12 +1507,19 @@ class PagamentoSaldo(PagamentoSaldoBase):
 async def pagar_saldo_devedor(
     customer_id: str, 
     pagamento: PagamentoSaldoBase, 
-    current_user: User = Depends(get_current_active_user)
+    current_user: User = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Registra um pagamento parcial ou total do saldo devedor de um cliente
     Qualquer vendedora ou admin pode receber pagamentos
     """
+    return await executar_idempotente(
+        idempotency_key, f"POST /customers/{customer_id}/pagar-saldo", current_user, pagamento,
+        lambda: processar_pagamento_saldo(customer_id, pagamento, current_user)
+    )
+
+async def processar_pagamento_saldo(customer_id: str, pagamento: PagamentoSaldoBase, current_user: User):
     # Buscar cliente
     customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
     if not customer:
@@ -655,12 +1541,16 @@ async def pagar_saldo_devedor(
     doc['data'] = doc['data'].isoformat()
     
     await db.pagamentos_saldo.insert_one(doc)
+    await acumular_no_caixa(
+        doc['filial_id'], dia_do_registro(doc['data']),
+        {campo_pagamento_divida(doc.get('forma_pagamento')): doc['valor']}
+    )
     
     # Atualizar saldo devedor do cliente
     novo_saldo = customer.get('saldo_devedor', 0) - pagamento.valor
     await db.customers.update_one(
         {"id": customer_id},
-        {"$set": {"saldo_devedor": max(0, novo_saldo)}}
+        {"$set": {"saldo_devedor": max(0, novo_saldo), **await carimbo_sync("customers")}, **GRAVADO_EM}
     )
     
     return {
@@ -693,8 +1583,93 @@ async def get_historico_pagamentos(
 
 # ==================== SALES ROUTES ====================
 
+# Views nomeadas para listagens de vendas. Cada view vira uma projeção no MongoDB,
+# então os arrays de itens e campos pouco usados nem saem do banco.
+SALE_VIEWS = {
+    "summary": [
+        "id", "data", "hora", "total", "desconto", "modalidade_pagamento", "pagamentos",
+        "parcelas", "vendedor", "vendedor_id", "customer_id", "filial_id",
+        "online", "encomenda", "is_troca", "estornada"
+    ],
+}
+
+# Campos que podem ser pedidos via fields= (modelo Sale + extras gravados por estorno/crédito)
+SALE_FIELDS = set(Sale.model_fields) | {"credito_usado", "motivo_estorno"}
+
+def build_sale_projection(fields: Optional[str] = None, view: Optional[str] = None) -> Optional[dict]:
+    """
+    Converte fields= (lista separada por vírgula) ou view= em uma projeção MongoDB.
+    Retorna None quando o documento completo deve ser retornado.
+    """
+    if view and view != "full":
+        if view not in SALE_VIEWS:
+            raise HTTPException(status_code=400, detail=f"View inválida: {view}")
+        selected = list(SALE_VIEWS[view])
+    else:
+        selected = []
+
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        invalid = [f for f in requested if f not in SALE_FIELDS]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalid)}")
+        selected.extend(requested)
+
+    if not selected:
+        return None
+
+    projection = {"_id": 0, "id": 1}
+    for f in selected:
+        projection[f] = 1
+    return projection
+
+def montar_venda(sale_data: dict, hora_atual_se_hoje: bool = True):
+    """Monta o Sale e o documento do banco (data/hora no fuso da loja, FUSO_LOJA)."""
+    agora = datetime.now(FUSO_LOJA)
+
+    # Lógica de Data:
+    # Se NÃO tem data (venda normal), usa AGORA.
+    if not sale_data.get('data'):
+        sale_data['data'] = agora
+    # Se TEM data (retroativa enviada pelo front), mantemos ela.
+
+    # Garante que a 'hora' seja gravada
+    data_registro = sale_data['data']
+    if isinstance(data_registro, str):
+        data_registro = datetime.fromisoformat(data_registro.replace('Z', '+00:00'))
+    if data_registro.tzinfo:
+        # Grava na hora local: o prefixo de `data` é o dia comercial da venda (dia_da_venda)
+        data_registro = data_registro.astimezone(FUSO_LOJA)
+        sale_data['data'] = data_registro
+
+    # Se a data do registro for "hoje", usa a hora atual. Se for passado, usa 12:00.
+    # (vendas sincronizadas do modo offline mantêm a hora em que foram feitas)
+    if hora_atual_se_hoje and data_registro.date() == agora.date():
+        sale_data['hora'] = agora.strftime("%H:%M:%S")
+    else:
+        # Se for retroativo e não tiver hora, define 12:00:00
+        if not sale_data.get('hora'):
+            sale_data['hora'] = "12:00:00"
+
+    sale_obj = Sale(**sale_data)
+    doc = sale_obj.model_dump()
+    doc['data'] = doc['data'].isoformat()
+    return sale_obj, doc
+
 @api_router.post("/sales", response_model=Sale)
-async def create_sale(sale: SaleCreate, current_user: User = Depends(get_current_active_user)):
+async def create_sale(
+    sale: SaleCreate,
+    current_user: User = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return await executar_idempotente(
+        idempotency_key, "POST /sales", current_user, sale,
+        lambda: processar_venda(sale, current_user)
+    )
+
+async def processar_venda(sale: SaleCreate, current_user: User):
+    carimbo = await carimbo_sync("products")
+
     # If it's a troca (exchange), ADD quantity back to stock instead of subtracting
     if sale.is_troca:
         for item in sale.items:
@@ -707,8 +1682,9 @@ async def create_sale(sale: SaleCreate, current_user: User = Depends(get_current
             
             await db.products.update_one(
                 {"id": item.product_id},
-                {"$set": {"quantidade": new_quantity, "updated_at": datetime.now(timezone.utc).isoformat()}}
+                {"$set": {"quantidade": new_quantity, **carimbo}, **GRAVADO_EM}
             )
+            publicar_estoque(product.get('filial_id'), item.product_id, new_quantity)
     else:
         # Normal sale: SUBTRACT quantity from stock
         for item in sale.items:
@@ -722,45 +1698,16 @@ async def create_sale(sale: SaleCreate, current_user: User = Depends(get_current
             
             await db.products.update_one(
                 {"id": item.product_id},
-                {"$set": {"quantidade": new_quantity, "updated_at": datetime.now(timezone.utc).isoformat()}}
+                {"$set": {"quantidade": new_quantity, **carimbo}, **GRAVADO_EM}
             )
-    
-    # Create sale
-    sale_data = sale.model_dump()
-    
-    # Fuso Horário de São Paulo
-    try:
-        br_timezone = ZoneInfo("America/Sao_Paulo")
-    except:
-        br_timezone = timezone(timedelta(hours=-3)) # Fallback se ZoneInfo falhar
-
-    agora = datetime.now(br_timezone)
-
-    # Lógica de Data:
-    # Se NÃO tem data (venda normal), usa AGORA.
-    if not sale_data.get('data'):
-        sale_data['data'] = agora
-    # Se TEM data (retroativa enviada pelo front), mantemos ela.
-
-    # Garante que a 'hora' seja gravada
-    data_registro = sale_data['data']
-    if isinstance(data_registro, str):
-        data_registro = datetime.fromisoformat(data_registro.replace('Z', '+00:00'))
+            publicar_estoque(product.get('filial_id'), item.product_id, new_quantity)
 
-    # Se a data do registro for "hoje", usa a hora atual. Se for passado, usa 12:00.
-    if data_registro.date() == agora.date():
-        sale_data['hora'] = agora.strftime("%H:%M:%S")
-    else:
-        # Se for retroativo e não tiver hora, define 12:00:00
-        if not sale_data.get('hora'):
-            sale_data['hora'] = "12:00:00"
-
-    sale_obj = Sale(**sale_data)
-    doc = sale_obj.model_dump()
-    doc['data'] = doc['data'].isoformat()
-    # ----------------------------------
+    # Create sale
+    sale_obj, doc = montar_venda(sale.model_dump())
     
     await db.sales.insert_one(doc)
+    await acumular_progresso_metas([doc])
+    publicar_venda("venda_criada", doc)
     
     # Update customer credit/debt if applicable
     if sale.customer_id:
@@ -771,11 +1718,142 @@ async def create_sale(sale: SaleCreate, current_user: User = Depends(get_current
                 new_saldo = customer.get('saldo_devedor', 0) + sale.total
                 await db.customers.update_one(
                     {"id": sale.customer_id},
-                    {"$set": {"saldo_devedor": new_saldo}}
+                    {"$set": {"saldo_devedor": new_saldo, **await carimbo_sync("customers")}, **GRAVADO_EM}
                 )
     
     return sale_obj
 
+SYNC_MAX_VENDAS = int(os.environ.get('SYNC_MAX_VENDAS', '500'))
+
+@api_router.post("/sales/sync")
+async def sync_sales(lote: SalesSyncRequest, current_user: User = Depends(get_current_active_user)):
+    """
+    Recebe, em ordem, as vendas feitas com o caixa offline. Cada venda tem um client_id
+    gerado no caixa: reenviar o mesmo lote não duplica nada. O estoque é validado na ordem
+    do lote e aplicado com um único bulk de $inc; vendas sem estoque voltam como conflito.
+
+    A validação usa o estoque lido no início: uma venda do PDV (create_sale) concorrente
+    com a sincronização pode deixar a quantidade negativa. Isso é aceito de propósito:
+    a venda offline já aconteceu e a peça já saiu da loja, então ela é gravada e o
+    estoque negativo aparece para ajuste no cadastro de produtos.
+    """
+    if len(lote.vendas) > SYNC_MAX_VENDAS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {SYNC_MAX_VENDAS} vendas por sincronização")
+
+    client_ids = [v.client_id for v in lote.vendas]
+    ja_gravadas = {
+        s["client_id"]: s["id"]
+        for s in await db.sales.find(
+            {"client_id": {"$in": client_ids}}, {"_id": 0, "client_id": 1, "id": 1}
+        ).to_list(len(client_ids))
+    }
+
+    product_ids = list({item.product_id for v in lote.vendas for item in v.items})
+    estoque = {
+        p["id"]: p
+        for p in await db.products.find(
+            {"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "quantidade": 1, "descricao": 1, "filial_id": 1}
+        ).to_list(len(product_ids))
+    }
+
+    resultados = [None] * len(lote.vendas)
+    pendentes = []  # (posição no lote, venda, doc, variação de estoque por produto)
+    vistos = set()
+    for pos, venda in enumerate(lote.vendas):
+        if venda.client_id in ja_gravadas:
+            resultados[pos] = {"status": "duplicada", "sale_id": ja_gravadas[venda.client_id]}
+            continue
+        if venda.client_id in vistos:
+            resultados[pos] = {"status": "duplicada", "detail": "client_id repetido no lote"}
+            continue
+        vistos.add(venda.client_id)
+
+        # Simula o estoque na ordem do lote: uma venda só entra se todos os itens têm saldo
+        variacao = {}
+        conflito = None
+        for item in venda.items:
+            product = estoque.get(item.product_id)
+            if not product:
+                conflito = f"Produto {item.codigo} não encontrado"
+                break
+            delta = item.quantidade if venda.is_troca else -item.quantidade
+            variacao[item.product_id] = variacao.get(item.product_id, 0) + delta
+            if product['quantidade'] + variacao[item.product_id] < 0:
+                conflito = f"Estoque insuficiente para {item.descricao}"
+                break
+        if conflito:
+            resultados[pos] = {"status": "conflito", "detail": conflito}
+            continue
+        for product_id, delta in variacao.items():
+            estoque[product_id]['quantidade'] += delta
+
+        sale_data = venda.model_dump()
+        data_venda = sale_data.get('data')
+        if data_venda and data_venda.tzinfo:
+            # O caixa costuma mandar UTC (Z); as vendas gravam a hora local da loja, cujo
+            # prefixo é o dia comercial usado pelo fechamento, metas e folha
+            data_venda = data_venda.astimezone(FUSO_LOJA)
+            sale_data['data'] = data_venda
+        if data_venda and not sale_data.get('hora'):
+            sale_data['hora'] = data_venda.strftime("%H:%M:%S")
+        _, doc = montar_venda(sale_data, hora_atual_se_hoje=False)
+        pendentes.append((pos, venda, doc, variacao))
+
+    # Inserção sem ordem: uma venda duplicada por outro envio simultâneo não bloqueia as demais
+    falhas = {}
+    if pendentes:
+        try:
+            await db.sales.insert_many([doc for _, _, doc, _ in pendentes], ordered=False)
+        except BulkWriteError as e:
+            falhas = {err["index"]: err for err in e.details.get("writeErrors", [])}
+
+    variacao_total = {}
+    saldo_clientes = {}
+    for idx, (pos, venda, doc, variacao) in enumerate(pendentes):
+        erro = falhas.get(idx)
+        if erro is not None:
+            if erro.get("code") == 11000:
+                resultados[pos] = {"status": "duplicada"}
+            else:
+                resultados[pos] = {"status": "erro", "detail": erro.get("errmsg")}
+            continue
+        resultados[pos] = {"status": "criada", "sale_id": doc["id"]}
+        for product_id, delta in variacao.items():
+            variacao_total[product_id] = variacao_total.get(product_id, 0) + delta
+        if venda.customer_id and venda.modalidade_pagamento == "Credito" and not venda.is_troca:
+            saldo_clientes[venda.customer_id] = saldo_clientes.get(venda.customer_id, 0) + venda.total
+
+    await acumular_progresso_metas([doc for idx, (_, _, doc, _) in enumerate(pendentes) if idx not in falhas])
+    if variacao_total:
+        carimbo = await carimbo_sync("products")
+        # $inc sem condição de saldo: veja a docstring sobre estoque negativo
+        await db.products.bulk_write([
+            UpdateOne({"id": product_id}, {"$inc": {"quantidade": delta}, "$set": carimbo, **GRAVADO_EM})
+            for product_id, delta in variacao_total.items()
+        ], ordered=False)
+    if saldo_clientes:
+        carimbo = await carimbo_sync("customers")
+        await db.customers.bulk_write([
+            UpdateOne({"id": customer_id}, {"$inc": {"saldo_devedor": valor}, "$set": carimbo, **GRAVADO_EM})
+            for customer_id, valor in saldo_clientes.items()
+        ], ordered=False)
+
+    for idx, (pos, venda, doc, variacao) in enumerate(pendentes):
+        if idx not in falhas:
+            publicar_venda("venda_criada", doc)
+    if variacao_total and eventos_broker.tem_assinantes():
+        # Relê as quantidades finais (o $inc não devolve o valor) só se alguém estiver ouvindo
+        for p in await db.products.find(
+            {"id": {"$in": list(variacao_total)}}, {"_id": 0, "id": 1, "quantidade": 1, "filial_id": 1}
+        ).to_list(len(variacao_total)):
+            publicar_estoque(p.get("filial_id"), p["id"], p["quantidade"])
+
+    itens = [{"client_id": v.client_id, **r} for v, r in zip(lote.vendas, resultados)]
+    resumo = {}
+    for item in itens:
+        resumo[item["status"]] = resumo.get(item["status"], 0) + 1
+    return {"resumo": resumo, "resultados": itens}
+
 @api_router.delete("/sales/{sale_id}/estornar")
 async def estornar_venda(sale_id: str, current_user: User = Depends(get_current_active_user)):
     # Apenas admin e gerente podem estornar vendas
@@ -793,14 +1871,16 @@ async def estornar_venda(sale_id: str, current_user: User = Depends(get_current_
     
     # 1. Devolver produtos ao estoque
     produtos_devolvidos = []
+    carimbo = await carimbo_sync("products")
     for item in sale['items']:
         product = await db.products.find_one({"id": item['product_id']}, {"_id": 0})
         if product:
             new_quantity = product['quantidade'] + item['quantidade']
             await db.products.update_one(
                 {"id": item['product_id']},
-                {"$set": {"quantidade": new_quantity, "updated_at": datetime.now(timezone.utc).isoformat()}}
+                {"$set": {"quantidade": new_quantity, **carimbo}, **GRAVADO_EM}
             )
+            publicar_estoque(product.get('filial_id'), item['product_id'], new_quantity)
             produtos_devolvidos.append({
                 "produto": product['descricao'],
                 "quantidade": item['quantidade']
@@ -816,7 +1896,7 @@ async def estornar_venda(sale_id: str, current_user: User = Depends(get_current_
                 new_saldo = max(0, customer.get('saldo_devedor', 0) - sale['total'])
                 await db.customers.update_one(
                     {"id": sale['customer_id']},
-                    {"$set": {"saldo_devedor": new_saldo}}
+                    {"$set": {"saldo_devedor": new_saldo, **await carimbo_sync("customers")}, **GRAVADO_EM}
                 )
                 cliente_atualizado = True
             
@@ -831,15 +1911,17 @@ async def estornar_venda(sale_id: str, current_user: User = Depends(get_current_
                             "credito_loja": new_credito,
                             # ATUALIZAÇÃO IMPORTANTE:
                             # Se devolveu crédito, atualiza a data para contar o prazo de validade a partir de hoje
-                            "data_ultimo_credito": datetime.now(timezone.utc).isoformat()
-                        }
+                            "data_ultimo_credito": datetime.now(timezone.utc).isoformat(),
+                            **await carimbo_sync("customers")
+                        },
+                        **GRAVADO_EM
                     }
                 )
                 cliente_atualizado = True
     
     # 3. Marcar venda como estornada (mantém no histórico mas marcada)
-    await db.sales.update_one(
-        {"id": sale_id},
+    marcada = await db.sales.update_one(
+        {"id": sale_id, "estornada": {"$ne": True}},
         {"$set": {
             "estornada": True,
             "estornada_em": datetime.now(timezone.utc).isoformat(),
@@ -847,6 +1929,10 @@ async def estornar_venda(sale_id: str, current_user: User = Depends(get_current_
             "motivo_estorno": "Cancelamento de venda"
         }}
     )
+    if marcada.modified_count:
+        # Só quem marcou a venda desconta do progresso (dois estornos simultâneos não descontam duas vezes)
+        await acumular_progresso_metas([sale], sinal=-1)
+    publicar_venda("venda_estornada", sale)
     
     # 4. Registrar log de auditoria do estorno
     estorno_log = {
@@ -880,8 +1966,12 @@ async def get_sales(
     data_fim: Optional[str] = None,    
     skip: int = 0, 
     limit: int = 100, 
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
     current_user: User = Depends(get_current_active_user)
 ):
+    projection = build_sale_projection(fields, view)
+
     query = {}
     if filial_id:
         query["filial_id"] = filial_id
@@ -898,11 +1988,15 @@ async def get_sales(
             limit = 50000 
 
     # Busca no banco
-    sales = await db.sales.find(query, {"_id": 0}).sort("data", -1).skip(skip).limit(limit).to_list(limit)
+    sales = await db.sales.find(query, projection or {"_id": 0}).sort("data", -1).skip(skip).limit(limit).to_list(limit)
     
     for s in sales:
         if isinstance(s.get('data'), str):
             s['data'] = datetime.fromisoformat(s['data'])
+
+    # Com projeção o documento é parcial e não valida contra o modelo Sale completo
+    if projection:
+        return JSONResponse(content=jsonable_encoder(sales))
     return sales
 # ------------------------------------------------------
 @api_router.get("/sales/{sale_id}", response_model=Sale)
@@ -984,7 +2078,17 @@ async def update_goal(vendedor: str, mes: int, ano: int, goal_data: GoalCreate,
 # ==================== STORE CREDIT ROUTES ====================
 
 @api_router.post("/store-credits", response_model=StoreCredit)
-async def create_store_credit(credit: StoreCreditCreate, current_user: User = Depends(get_current_active_user)):
+async def create_store_credit(
+    credit: StoreCreditCreate,
+    current_user: User = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return await executar_idempotente(
+        idempotency_key, "POST /store-credits", current_user, credit,
+        lambda: processar_store_credit(credit)
+    )
+
+async def processar_store_credit(credit: StoreCreditCreate):
     credit_obj = StoreCredit(**credit.model_dump())
     doc = credit_obj.model_dump()
     doc['data'] = doc['data'].isoformat()
@@ -999,7 +2103,8 @@ async def create_store_credit(credit: StoreCreditCreate, current_user: User = De
             {"id": credit.customer_id},
             {"$set": {"credito_loja": new_credit,
               # ADICIONE ISTO: Atualiza a data do crédito para HOJE
-             "data_ultimo_credito": datetime.now(timezone.utc).isoformat()}}
+             "data_ultimo_credito": datetime.now(timezone.utc).isoformat(),
+             **await carimbo_sync("customers")}, **GRAVADO_EM}
         )
     
     return credit_obj
@@ -1037,7 +2142,7 @@ async def expirar_credito(customer_id: str, current_user: User = Depends(get_cur
     # Zera o crédito
     await db.customers.update_one(
         {"id": customer_id},
-        {"$set": {"credito_loja": 0.0}}
+        {"$set": {"credito_loja": 0.0, **await carimbo_sync("customers")}, **GRAVADO_EM}
     )
     
     # Registra no log de créditos como uma saída (negativo) para auditoria
@@ -1054,6 +2159,174 @@ async def expirar_credito(customer_id: str, current_user: User = Depends(get_cur
     
     return {"message": "Créditos expirados com sucesso", "valor_removido": valor_removido}
 
+# ==================== EXPIRAÇÃO AUTOMÁTICA DE CRÉDITO ====================
+
+# Crédito de loja sem movimentação há mais de CREDITO_VALIDADE_DIAS é zerado por um job
+# periódico (mesmo prazo do alerta na tela de clientes). Com vários workers só quem
+# detém o lease em job_locks executa a rodada. Zerar crédito não tem volta, então o job
+# vem desligado: liga com CREDITO_EXPIRACAO_AUTOMATICA=1 e só roda se o prazo também
+# estiver definido explicitamente (o padrão de 30 dias vale para o alerta e para a
+# expiração manual pelo admin).
+CREDITO_VALIDADE_DIAS = int(os.environ.get('CREDITO_VALIDADE_DIAS', '30'))
+CREDITO_EXPIRACAO_AUTOMATICA = os.environ.get('CREDITO_EXPIRACAO_AUTOMATICA', '0') == '1'
+CREDITO_VALIDADE_CONFIGURADA = 'CREDITO_VALIDADE_DIAS' in os.environ
+CREDITO_EXPIRACAO_INTERVALO_MINUTOS = float(os.environ.get('CREDITO_EXPIRACAO_INTERVALO_MINUTOS', '60'))
+CREDITO_EXPIRACAO_LOTE = int(os.environ.get('CREDITO_EXPIRACAO_LOTE', '500'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '300'))
+
+INSTANCIA_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+async def adquirir_lease(nome: str, segundos: int = JOB_LEASE_SECONDS) -> bool:
+    """Pega (ou renova) o lease do job. Falso se outro worker detém um lease ainda válido."""
+    agora = datetime.now(timezone.utc)
+    try:
+        await db.job_locks.find_one_and_update(
+            {"_id": nome, "$or": [{"dono": INSTANCIA_ID}, {"expira_em": {"$lt": agora.isoformat()}}]},
+            {"$set": {"dono": INSTANCIA_ID, "expira_em": (agora + timedelta(seconds=segundos)).isoformat()}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # O documento existe com outro dono e lease válido: o upsert colide no _id
+        return False
+
+async def liberar_lease(nome: str):
+    await db.job_locks.delete_one({"_id": nome, "dono": INSTANCIA_ID})
+
+async def expirar_creditos_vencidos(validade_dias: int = CREDITO_VALIDADE_DIAS, executado_por: str = "rotina automática") -> dict:
+    """
+    Zera o crédito dos clientes cuja última movimentação de crédito é anterior ao prazo,
+    em lotes: um bulk_write nos clientes e um insert_many com as saídas em store_credits.
+    Cada update confere valor e data lidos; um crédito concedido no meio da rodada não é zerado.
+    """
+    limite = (datetime.now(timezone.utc) - timedelta(days=validade_dias)).isoformat()
+    # credito_loja > 0 faz a consulta usar o índice parcial credito_a_expirar
+    filtro = {"credito_loja": {"$gt": 0}, "data_ultimo_credito": {"$lt": limite}}
+    resumo = {"clientes": 0, "valor_total": 0.0, "lotes": 0}
+
+    while True:
+        lote = await db.customers.find(
+            filtro, {"_id": 0, "id": 1, "credito_loja": 1, "data_ultimo_credito": 1}
+        ).sort("data_ultimo_credito", 1).limit(CREDITO_EXPIRACAO_LOTE).to_list(CREDITO_EXPIRACAO_LOTE)
+        if not lote:
+            break
+        if not await adquirir_lease("expirar_creditos"):
+            # Lease perdido (rodada passou do prazo e outro worker assumiu)
+            break
+
+        rodada = str(uuid.uuid4())
+        carimbo = await carimbo_sync("customers")
+        resultado = await db.customers.bulk_write([
+            UpdateOne(
+                {"id": c["id"], "credito_loja": c["credito_loja"], "data_ultimo_credito": c["data_ultimo_credito"]},
+                {"$set": {"credito_loja": 0.0, "credito_expirado_rodada": rodada, **carimbo}, **GRAVADO_EM}
+            )
+            for c in lote
+        ], ordered=False)
+
+        expirados = lote
+        if resultado.modified_count < len(lote):
+            alterados = {
+                c["id"] for c in await db.customers.find(
+                    {"id": {"$in": [c["id"] for c in lote]}, "credito_expirado_rodada": rodada}, {"_id": 0, "id": 1}
+                ).to_list(len(lote))
+            }
+            expirados = [c for c in lote if c["id"] in alterados]
+
+        agora = datetime.now(timezone.utc).isoformat()
+        if expirados:
+            await db.store_credits.insert_many([{
+                "id": str(uuid.uuid4()),
+                "customer_id": c["id"],
+                "valor": -c["credito_loja"],
+                "origem": "expiracao_prazo",
+                "observacoes": f"Crédito expirado por {executado_por} ({validade_dias} dias sem movimentação)",
+                "data": agora,
+                "usado": True
+            } for c in expirados], ordered=False)
+
+        resumo["clientes"] += len(expirados)
+        resumo["valor_total"] = round(resumo["valor_total"] + sum(c["credito_loja"] for c in expirados), 2)
+        resumo["lotes"] += 1
+        if len(lote) < CREDITO_EXPIRACAO_LOTE:
+            break
+
+    return resumo
+
+async def normalizar_data_ultimo_credito(lote: int = 500):
+    """
+    Deixa data_ultimo_credito como texto ISO (UTC) em todos os clientes: a expiração
+    compara com $lt em texto, que não casa com Date. Converte os Date gravados pela
+    edição do cadastro e preenche a data de quem tem crédito sem data, com a última
+    movimentação em store_credits (ou agora, se não houver).
+    """
+    while True:
+        pendentes = await db.customers.find(
+            {"data_ultimo_credito": {"$type": "date"}}, {"_id": 0, "id": 1, "data_ultimo_credito": 1}
+        ).limit(lote).to_list(lote)
+        if not pendentes:
+            break
+        await db.customers.bulk_write([
+            UpdateOne({"id": c["id"], "data_ultimo_credito": c["data_ultimo_credito"]}, {"$set": {
+                "data_ultimo_credito": c["data_ultimo_credito"].replace(tzinfo=timezone.utc).isoformat()
+            }})
+            for c in pendentes
+        ], ordered=False)
+
+    while True:
+        pendentes = await db.customers.find(
+            {"credito_loja": {"$gt": 0}, "data_ultimo_credito": None}, {"_id": 0, "id": 1}
+        ).limit(lote).to_list(lote)
+        if not pendentes:
+            break
+        ultimas = {
+            u["_id"]: u["data"]
+            for u in await db.store_credits.aggregate([
+                {"$match": {"customer_id": {"$in": [c["id"] for c in pendentes]}}},
+                {"$group": {"_id": "$customer_id", "data": {"$max": "$data"}}},
+            ]).to_list(None)
+        }
+        agora = datetime.now(timezone.utc).isoformat()
+        await db.customers.bulk_write([
+            UpdateOne({"id": c["id"], "data_ultimo_credito": None}, {"$set": {
+                "data_ultimo_credito": ultimas.get(c["id"]) if isinstance(ultimas.get(c["id"]), str) else agora
+            }})
+            for c in pendentes
+        ], ordered=False)
+
+async def rodar_expiracao_creditos(executado_por: str = "rotina automática") -> Optional[dict]:
+    """Uma rodada protegida pelo lease; None se outro worker já está executando."""
+    if not await adquirir_lease("expirar_creditos"):
+        return None
+    try:
+        resumo = await expirar_creditos_vencidos(executado_por=executado_por)
+    finally:
+        await liberar_lease("expirar_creditos")
+    if resumo["clientes"]:
+        logger.info("Créditos expirados: %d clientes, R$ %.2f", resumo["clientes"], resumo["valor_total"])
+    return resumo
+
+async def agendar_expiracao_creditos():
+    # Espera inicial curta e aleatória: workers que sobem juntos não disputam o lease no mesmo instante
+    await asyncio.sleep(30 + random.uniform(0, 30))
+    while True:
+        try:
+            await rodar_expiracao_creditos()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Falha na expiração automática de créditos")
+        await asyncio.sleep(CREDITO_EXPIRACAO_INTERVALO_MINUTOS * 60)
+
+@api_router.post("/admin/expirar-creditos")
+async def expirar_creditos_agora(current_user: User = Depends(get_current_active_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores podem executar a expiração")
+    resumo = await rodar_expiracao_creditos(executado_por=current_user.full_name)
+    if resumo is None:
+        raise HTTPException(status_code=409, detail="Expiração de créditos já em execução")
+    return {"validade_dias": CREDITO_VALIDADE_DIAS, **resumo}
+
 # ==================== REPORTS ROUTES ====================
 
 @api_router.get("/reports/dashboard")
@@ -1166,12 +2439,124 @@ async def get_inventory_value(filial_id: Optional[str] = None, current_user: Use
         }
     return {"valor_custo": 0, "valor_venda": 0, "lucro_potencial": 0}
 
+# ==================== PROGRESSO DE METAS ====================
+
+# Vendas do mês por vendedora (total, peças, quantidade) ficam acumuladas em
+# goal_progress, um documento por (vendedor_id, ano, mes) no mês local da loja. Vendas
+# novas somam com $inc e o estorno subtrai; trocas não contam. A chave é o id do
+# usuário, então renomear a vendedora não separa o histórico. O $inc e o recálculo
+# usam a mesma regra: o mês é o prefixo de `data` e, sem vendedor_id, vale o usuário
+# com o nome da venda.
+def dia_da_venda(data) -> str:
+    """Dia comercial de uma venda: o prefixo de `data`, gravada na hora local (montar_venda)."""
+    if isinstance(data, datetime):
+        return (data.astimezone(FUSO_LOJA) if data.tzinfo else data).date().isoformat()
+    return str(data)[:10]
+
+def chave_progresso(venda: dict, ids_por_nome: Optional[dict] = None):
+    if venda.get('is_troca'):
+        return None
+    vendedor_id = venda.get('vendedor_id') or (ids_por_nome or {}).get(venda.get('vendedor'))
+    if not vendedor_id:
+        return None
+    ano, mes, _ = (int(parte) for parte in dia_da_venda(venda.get('data')).split("-"))
+    return vendedor_id, ano, mes
+
+async def acumular_progresso_metas(vendas: List[dict], sinal: int = 1):
+    """Um $inc (upsert) por vendedora/mês das vendas informadas, num único bulk_write."""
+    ids_por_nome = None
+    if any(not v.get('vendedor_id') and not v.get('is_troca') for v in vendas):
+        ids_por_nome = {u["full_name"]: u["id"] for u in await listar_usuarios()}
+    incrementos = {}
+    for venda in vendas:
+        chave = chave_progresso(venda, ids_por_nome)
+        if chave is None:
+            continue
+        inc = incrementos.setdefault(chave, {"total_vendas": 0, "pecas_vendidas": 0, "num_vendas": 0})
+        inc["total_vendas"] += sinal * venda.get('total', 0)
+        inc["pecas_vendidas"] += sinal * sum(item.get('quantidade', 0) for item in venda.get('items', []))
+        inc["num_vendas"] += sinal
+    if not incrementos:
+        return
+
+    def operacoes(upsert: bool, chaves):
+        return [
+            UpdateOne(
+                {"vendedor_id": vendedor_id, "ano": ano, "mes": mes},
+                {"$inc": incrementos[(vendedor_id, ano, mes)]},
+                upsert=upsert
+            )
+            for vendedor_id, ano, mes in chaves
+        ]
+
+    chaves = list(incrementos)
+    try:
+        await db.goal_progress.bulk_write(operacoes(True, chaves), ordered=False)
+    except BulkWriteError as e:
+        erros = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in erros):
+            raise
+        # Upsert simultâneo criou o documento do mês; agora é só incrementar
+        await db.goal_progress.bulk_write(operacoes(False, [chaves[err["index"]] for err in erros]), ordered=False)
+
+async def recalcular_progresso_metas(mes: int, ano: int) -> int:
+    """
+    Refaz goal_progress do mês a partir das vendas (reparo e meses anteriores ao
+    acúmulo), com a mesma regra de chave_progresso: mês pelo prefixo de `data` e vendas
+    sem vendedor_id atribuídas pelo nome atual do usuário.
+    """
+    inicio = f"{ano:04d}-{mes:02d}-01"
+    fim = f"{ano + 1:04d}-01-01" if mes == 12 else f"{ano:04d}-{mes + 1:02d}-01"
+    grupos = await db.sales.aggregate([
+        {"$match": {
+            "data": {"$gte": inicio, "$lt": fim},
+            "estornada": {"$ne": True},
+            "is_troca": {"$ne": True},
+        }},
+        {"$group": {
+            "_id": {"vendedor_id": "$vendedor_id", "vendedor": "$vendedor"},
+            "total_vendas": {"$sum": "$total"},
+            "pecas_vendidas": {"$sum": {"$sum": "$items.quantidade"}},
+            "num_vendas": {"$sum": 1},
+        }},
+    ], allowDiskUse=True).to_list(None)
+
+    ids_por_nome = {u["full_name"]: u["id"] for u in await listar_usuarios()}
+    progresso = {}
+    for g in grupos:
+        vendedor_id = g["_id"].get("vendedor_id") or ids_por_nome.get(g["_id"].get("vendedor"))
+        if not vendedor_id:
+            continue
+        p = progresso.setdefault(vendedor_id, {"total_vendas": 0, "pecas_vendidas": 0, "num_vendas": 0})
+        for campo in p:
+            p[campo] += g[campo]
+
+    await db.goal_progress.delete_many({"ano": ano, "mes": mes, "vendedor_id": {"$nin": list(progresso)}})
+    if progresso:
+        await db.goal_progress.bulk_write([
+            UpdateOne({"vendedor_id": vendedor_id, "ano": ano, "mes": mes}, {"$set": totais}, upsert=True)
+            for vendedor_id, totais in progresso.items()
+        ], ordered=False)
+    return len(progresso)
+
+async def preencher_progresso_metas():
+    """No startup: monta o mês corrente se ainda não há nenhum progresso acumulado nele."""
+    ano, mes, _ = (int(parte) for parte in dia_comercial().split("-"))
+    if not await db.goal_progress.find_one({"ano": ano, "mes": mes}, {"_id": 1}):
+        await recalcular_progresso_metas(mes, ano)
+
+@api_router.post("/admin/metas/recalcular-progresso")
+async def recalcular_progresso_metas_endpoint(mes: int, ano: int, current_user: User = Depends(get_current_active_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores podem recalcular o progresso das metas")
+    if not 1 <= mes <= 12:
+        raise HTTPException(status_code=400, detail="mes deve estar entre 1 e 12")
+    return {"mes": mes, "ano": ano, "vendedoras": await recalcular_progresso_metas(mes, ano)}
+
 @api_router.get("/reports/my-performance")
 async def get_my_performance(current_user: User = Depends(get_current_active_user)):
-    # Get current month/year
-    now = datetime.now(timezone.utc)
-    mes = now.month
-    ano = now.year
+    # Mês corrente no fuso da loja
+    ano, mes, _ = (int(parte) for parte in dia_comercial().split("-"))
     
     # Get user's goal
     goal = await db.goals.find_one(
@@ -1193,80 +2578,26 @@ async def get_my_performance(current_user: User = Depends(get_current_active_use
             "percentual_atingido": 0
         }
     
-    # Calculate sales this month
-    start_date = datetime(ano, mes, 1, tzinfo=timezone.utc)
-    if mes == 12:
-        end_date = datetime(ano + 1, 1, 1, tzinfo=timezone.utc)
-    else:
-        end_date = datetime(ano, mes + 1, 1, tzinfo=timezone.utc)
-    
-    pipeline = [
-        {"$match": {
-            "vendedor": current_user.full_name,
-            "data": {"$gte": start_date.isoformat(), "$lt": end_date.isoformat()},
-            "estornada": {"$ne": True},
-            "is_troca": {"$ne": True}
-        }},
-        {"$group": {
-            "_id": None,
-            "total_vendas": {"$sum": "$total"},
-            "num_vendas": {"$sum": 1},
-            "total_pecas": {"$sum": {"$sum": "$items.quantidade"}}
-        }}
-    ]
-    
-    result = await db.sales.aggregate(pipeline).to_list(1)
-    
-    if result:
-        vendas_realizadas = result[0]['total_vendas']
-        pecas_vendidas = result[0].get('total_pecas', 0)
-        num_vendas = result[0]['num_vendas']
-    else:
-        vendas_realizadas = 0
-        pecas_vendidas = 0
-        num_vendas = 0
+    # Vendas do mês: acumuladas em goal_progress (create_sale/estornar_venda)
+    progresso = await db.goal_progress.find_one(
+        {"vendedor_id": current_user.id, "ano": ano, "mes": mes}, {"_id": 0}
+    ) or {}
+    vendas_realizadas = progresso.get('total_vendas', 0)
+    pecas_vendidas = progresso.get('pecas_vendidas', 0)
+    num_vendas = progresso.get('num_vendas', 0)
     
     meta = goal.get('meta_vendas', 0)
-    percentual = (vendas_realizadas / meta * 100) if meta > 0 else 0
-    
-    # New commission system: 1% of sales + bonus by tier
-    comissao_base = vendas_realizadas * 0.01  # 1% comissão
-    
-    # Calculate bonus tier based on percentage above meta
-    # Meta 1: 16% above base = bonus R$ 40
-    # Meta 2: 27% above base = bonus R$ 60
-    # Meta 3: 37% above base = bonus R$ 80
-    # Meta 4: 68% above base = bonus R$ 250
-    
-    tier = 1
-    bonus_valor = 0
-    meta_percentual_atingida = percentual - 100  # Quanto passou da meta base
-    
-    if meta_percentual_atingida >= 68:
-        tier = 4
-        bonus_valor = 40 + 60 + 80 + 250  # Acumula todos os bônus
-    elif meta_percentual_atingida >= 37:
-        tier = 3
-        bonus_valor = 40 + 60 + 80
-    elif meta_percentual_atingida >= 27:
-        tier = 2
-        bonus_valor = 40 + 60
-    elif meta_percentual_atingida >= 16:
-        tier = 1
-        bonus_valor = 40
-    else:
-        tier = 0
-        bonus_valor = 0
-    
+
+    # Mesma regra do relatório de pagamentos: configuração de comissão da filial
+    config = await config_comissao(current_user.filial_id)
+    folha = calcular_folha_por_config(
+        [{"total_vendas": vendas_realizadas, "meta_vendas": meta, "total_vales": 0}], {}, config_unica=config
+    )[0]
+    percentual = folha["percentual_atingido"]
+    comissao_base = folha["comissao_base"]
+    bonus_valor = folha["bonus_valor"]
     comissao_total = comissao_base + bonus_valor
     
-    # Calculate next tier target
-    next_tier_targets = [16, 27, 37, 68]
-    falta_percentual = 0
-    if tier < 4:
-        target_percent = next_tier_targets[tier] if tier < len(next_tier_targets) else 68
-        falta_percentual = target_percent - meta_percentual_atingida
-    
     return {
         "vendedor": current_user.full_name,
         "mes": mes,
@@ -1276,12 +2607,13 @@ async def get_my_performance(current_user: User = Depends(get_current_active_use
         "pecas_vendidas": pecas_vendidas,
         "num_vendas": num_vendas,
         "percentual_atingido": percentual,
-        "percentual_acima_meta": meta_percentual_atingida,
-        "tier_atual": tier,
+        "percentual_acima_meta": percentual - 100,
+        "percentual_comissao": config.get("percentual_comissao", 1.0),
+        "tier_atual": folha["faixa"],
         "bonus_valor": bonus_valor,
         "comissao_base": comissao_base,
         "comissao_total": comissao_total,
-        "falta_percentual_proxima_etapa": max(0, falta_percentual)
+        "falta_percentual_proxima_etapa": max(0, folha["falta_percentual_proxima_faixa"])
     }
 
 
@@ -1295,6 +2627,7 @@ async def get_pagamentos_detalhados(
     """
     Relatório detalhado de pagamentos para admins
     Mostra por vendedor: vendas, comissões, bônus, vales e total a pagar
+    Com filial_id: as vendedoras lotadas na filial, com todas as vendas delas (filtro_vendas_da_equipe)
     """
     # Only admin and gerente can access this report
     if current_user.role not in ["admin", "gerente"]:
@@ -1303,7 +2636,7 @@ async def get_pagamentos_detalhados(
     # Build query
     match_stage = {"estornada": {"$ne": True}, "is_troca": {"$ne": True}}  # Excluir vendas estornadas
     if filial_id:
-        match_stage["filial_id"] = filial_id
+        match_stage.update(await filtro_vendas_da_equipe(filial_id))
     
     # Date range filter
     match_stage["data"] = {"$gte": data_inicio, "$lte": data_fim}
@@ -1313,7 +2646,7 @@ async def get_pagamentos_detalhados(
         {"$match": match_stage},
         {"$group": {
             "_id": "$vendedor",
-            "vendedora_id": {"$first": "$vendedora_id"},
+            "vendedora_id": {"$max": "$vendedor_id"},  # vendas antigas podem não ter o id
             "total_vendas": {"$sum": "$total"},
             "num_vendas": {"$sum": 1},
             "total_pecas": {"$sum": {"$sum": "$items.quantidade"}}
@@ -1322,104 +2655,67 @@ async def get_pagamentos_detalhados(
     
     sales_by_vendor = await db.sales.aggregate(pipeline).to_list(100)
     
-    # Get commission config for the filial
-    if filial_id:
-        comissao_config = await db.comissao_config.find_one({"filial_id": filial_id}, {"_id": 0})
-    else:
-        comissao_config = None
-    
-    # Use default config if not found
-    if not comissao_config:
-        comissao_config = {
-            "percentual_comissao": 1.0,
-            "bonus_tiers": [
-                {"percentual_meta": 80, "valor_bonus": 100},
-                {"percentual_meta": 90, "valor_bonus": 150},
-                {"percentual_meta": 100, "valor_bonus": 200},
-                {"percentual_meta": 110, "valor_bonus": 300},
-            ]
-        }
+    # Get commission config for the filial (default config if not found)
+    comissao_config = await config_comissao(filial_id) if filial_id else CONFIG_PADRAO
     
-    # For each vendor, calculate commission, bonus, and vales
-    result = []
+    # Extract month/year from date range
+    try:
+        start_dt = datetime.fromisoformat(data_inicio.replace('Z', '+00:00'))
+        mes_inicio = start_dt.month
+        ano_inicio = start_dt.year
+        end_dt = datetime.fromisoformat(data_fim.replace('Z', '+00:00'))
+        mes_fim = end_dt.month
+        ano_fim = end_dt.year
+    except:
+        mes_inicio = mes_fim = datetime.now().month
+        ano_inicio = ano_fim = datetime.now().year
+
+    # Metas (mês inicial), usuários e vales de todas as vendedoras de uma vez
+    nomes = [v["_id"] for v in sales_by_vendor]
+    usuarios = {u["full_name"]: u for u in await listar_usuarios() if u.get("full_name") in nomes}
+    metas = {
+        g["vendedor"]: g.get("meta_vendas", 0)
+        for g in await db.goals.find(
+            {"vendedor": {"$in": nomes}, "mes": mes_inicio, "ano": ano_inicio}, {"_id": 0, "vendedor": 1, "meta_vendas": 1}
+        ).to_list(None)
+    }
+    for v in sales_by_vendor:
+        v["vendedora_id"] = v.get("vendedora_id") or usuarios.get(v["_id"], {}).get("id", "")
+    vales_por_vendedora = {}
+    for vale in await db.vales.find(
+        {"vendedora_id": {"$in": [v["vendedora_id"] for v in sales_by_vendor]},
+         **filtro_periodo_vales(mes_inicio, ano_inicio, mes_fim, ano_fim)},
+        {"_id": 0}
+    ).to_list(None):
+        vales_por_vendedora.setdefault(vale["vendedora_id"], []).append(vale)
+
+    linhas = []
     for vendor_data in sales_by_vendor:
         vendedor_nome = vendor_data["_id"]
-        vendedora_id = vendor_data.get("vendedora_id", "")
-        total_vendas = vendor_data["total_vendas"]
-        num_vendas = vendor_data["num_vendas"]
-        total_pecas = vendor_data.get("total_pecas", 0)
-        
-        # Extract month/year from date range first
-        try:
-            start_dt = datetime.fromisoformat(data_inicio.replace('Z', '+00:00'))
-            mes_inicio = start_dt.month
-            ano_inicio = start_dt.year
-            end_dt = datetime.fromisoformat(data_fim.replace('Z', '+00:00'))
-            mes_fim = end_dt.month
-            ano_fim = end_dt.year
-        except:
-            mes_inicio = mes_fim = datetime.now().month
-            ano_inicio = ano_fim = datetime.now().year
-        
-        # Calculate base commission
-        percentual_comissao = comissao_config.get("percentual_comissao", 1.0)
-        comissao_base = (total_vendas * percentual_comissao) / 100
-        
-        # Get vendor's goal (use start month/year)
-        goal_doc = await db.goals.find_one(
-            {"vendedor": vendedor_nome, "mes": mes_inicio, "ano": ano_inicio}, 
-            {"_id": 0}
-        )
-        
-        if goal_doc:
-            meta_vendas = goal_doc.get("meta_vendas", 0)
-        else:
-            # Try to get from user profile
-            user_doc = await db.users.find_one({"full_name": vendedor_nome}, {"_id": 0})
-            meta_vendas = user_doc.get("meta_mensal", 0) if user_doc else 0
-        
-        # Calculate bonus based on goal achievement
-        percentual_atingido = (total_vendas / meta_vendas * 100) if meta_vendas > 0 else 0
-        
-        # Find highest bonus tier achieved (non-cumulative)
-        bonus_valor = 0
-        bonus_tiers = comissao_config.get("bonus_tiers", [])
-        sorted_tiers = sorted(bonus_tiers, key=lambda x: x["percentual_meta"], reverse=True)
-        
-        for tier in sorted_tiers:
-            if percentual_atingido >= tier["percentual_meta"]:
-                bonus_valor = tier["valor_bonus"]
-                break
-        
-        # Filter vales by date range (same month/year range)
-        vale_query = {"vendedora_id": vendedora_id}
-        if mes_inicio == mes_fim and ano_inicio == ano_fim:
-            vale_query["mes"] = mes_inicio
-            vale_query["ano"] = ano_inicio
-        else:
-            # Multiple months - get all vales in the year range
-            vale_query["ano"] = {"$gte": ano_inicio, "$lte": ano_fim}
-        
-        vales = await db.vales.find(vale_query, {"_id": 0}).to_list(100)
-        
-        total_vales = sum(v.get("valor", 0) for v in vales)
-        
-        # Calculate total to pay
-        total_a_pagar = comissao_base + bonus_valor - total_vales
-        
-        result.append({
+        meta_vendas = metas.get(vendedor_nome)
+        if meta_vendas is None:
+            meta_vendas = usuarios.get(vendedor_nome, {}).get("meta_mensal", 0) or 0
+        vales = vales_por_vendedora.get(vendor_data["vendedora_id"], [])
+        linhas.append({
             "vendedor": vendedor_nome,
-            "vendedora_id": vendedora_id,
-            "total_vendas": total_vendas,
-            "num_vendas": num_vendas,
-            "total_pecas": total_pecas,
+            "vendedora_id": vendor_data["vendedora_id"],
+            "total_vendas": vendor_data["total_vendas"],
+            "num_vendas": vendor_data["num_vendas"],
+            "total_pecas": vendor_data.get("total_pecas", 0),
             "meta_vendas": meta_vendas,
-            "percentual_meta": percentual_atingido,
-            "comissao_base": comissao_base,
-            "bonus_valor": bonus_valor,
             "vales": vales,
-            "total_vales": total_vales,
-            "total_a_pagar": total_a_pagar
+            "total_vales": sum(v.get("valor", 0) for v in vales),
+        })
+
+    # Comissão, bônus (maior faixa atingida) e total a pagar de todas as vendedoras num só cálculo
+    result = []
+    for linha, folha in zip(linhas, calcular_folha_por_config(linhas, {}, config_unica=comissao_config)):
+        result.append({
+            **linha,
+            "percentual_meta": folha["percentual_atingido"],
+            "comissao_base": folha["comissao_base"],
+            "bonus_valor": folha["bonus_valor"],
+            "total_a_pagar": folha["total_a_pagar"]
         })
     
     return {
@@ -1474,23 +2770,212 @@ class FechamentoCaixaBase(BaseModel):
 
 class FechamentoCaixa(FechamentoCaixaBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    business_date: Optional[str] = None  # dia comercial da loja (YYYY-MM-DD)
+
+# O caixa de cada filial é um documento por dia comercial, na data local da loja (uma
+# venda às 22h em São Paulo já é o dia seguinte em UTC). O índice único
+# (filial_id, business_date) faz a busca do caixa do dia por igualdade e impede abrir
+# duas vezes o mesmo dia, mesmo com duas requisições simultâneas.
+try:
+    FUSO_LOJA = ZoneInfo(os.environ.get('LOJA_TIMEZONE', 'America/Sao_Paulo'))
+except Exception:
+    FUSO_LOJA = timezone(timedelta(hours=-3))
+
+def dia_comercial(momento: Optional[datetime] = None) -> str:
+    """Data local da loja (YYYY-MM-DD) do momento informado (padrão: agora)."""
+    momento = momento or datetime.now(timezone.utc)
+    if momento.tzinfo is None:
+        momento = momento.replace(tzinfo=timezone.utc)
+    return momento.astimezone(FUSO_LOJA).date().isoformat()
+
+def limites_dia_comercial(dia: str):
+    """Início e fim (exclusivo) do dia comercial em UTC ISO, para coleções gravadas em UTC."""
+    inicio, fim = (
+        datetime.combine(d, datetime.min.time(), tzinfo=FUSO_LOJA).astimezone(timezone.utc).isoformat()
+        for d in (date.fromisoformat(dia), date.fromisoformat(dia) + timedelta(days=1))
+    )
+    return inicio, fim
 
-@api_router.post("/caixa/abrir")
-async def abrir_caixa(dados: AberturaCaixa, current_user: User = Depends(get_current_active_user)):
-    today = datetime.now(timezone.utc).date()
-    start_dt = datetime.combine(today, datetime.min.time()).replace(tzinfo=timezone.utc)
-    end_dt = datetime.combine(today, datetime.max.time()).replace(tzinfo=timezone.utc)
+async def preencher_dia_comercial_caixas(lote: int = 500):
+    """
+    Grava business_date nos caixas anteriores ao campo, a partir de `data`. Se a filial
+    tem mais de um caixa no mesmo dia (aberturas duplicadas antigas), só o primeiro
+    entra no índice; os demais continuam no histórico com business_date=None.
+    """
+    ultimo = None
+    while True:
+        filtro = {"business_date": {"$exists": False}}
+        if ultimo is not None:
+            filtro["_id"] = {"$gt": ultimo}
+        pendentes = await db.fechamentos_caixa.find(filtro, {"_id": 1, "data": 1}) \
+            .sort("_id", 1).limit(lote).to_list(lote)
+        if not pendentes:
+            break
+        operacoes, ids = [], []
+        for c in pendentes:
+            data = c.get("data")
+            if isinstance(data, str):
+                data = datetime.fromisoformat(data.replace('Z', '+00:00'))
+            if isinstance(data, datetime):
+                operacoes.append(UpdateOne({"_id": c["_id"]}, {"$set": {"business_date": dia_comercial(data)}}))
+                ids.append(c["_id"])
+        try:
+            if operacoes:
+                await db.fechamentos_caixa.bulk_write(operacoes, ordered=False)
+        except BulkWriteError as e:
+            erros = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in erros):
+                raise
+            # business_date=None fica fora do índice parcial e não volta a ser processado
+            await db.fechamentos_caixa.update_many(
+                {"_id": {"$in": [ids[err["index"]] for err in erros]}},
+                {"$set": {"business_date": None}}
+            )
+            logger.warning("%d caixas repetidos no mesmo dia ficaram sem business_date", len(erros))
+        ultimo = pendentes[-1]["_id"]
 
-    # 1. Verifica se já existe caixa aberto hoje NA FILIAL (Independente do usuario)
-    existente = await db.fechamentos_caixa.find_one({
-        "filial_id": dados.filial_id,
-        "data": {"$gte": start_dt.isoformat(), "$lte": end_dt.isoformat()}
-    })
+async def corrigir_fuso_vendas_sincronizadas(lote: int = 500):
+    """
+    Vendas offline gravadas com o fuso enviado pelo caixa (UTC) antes da conversão em
+    sync_sales: regrava `data` na hora local da loja, para o prefixo voltar a ser o dia
+    comercial. O progresso de metas já contava essas vendas pelo dia local.
+    """
+    ultimo = None
+    while True:
+        # Cursor por _id: com LOJA_TIMEZONE em UTC+0 o valor regravado continua casando
+        filtro = {"client_id": {"$type": "string"}, "data": {"$regex": r"(Z|\+00:00)$"}}
+        if ultimo is not None:
+            filtro["_id"] = {"$gt": ultimo}
+        pendentes = await db.sales.find(filtro, {"_id": 1, "data": 1}).sort("_id", 1).limit(lote).to_list(lote)
+        if not pendentes:
+            break
+        operacoes = []
+        for v in pendentes:
+            local = datetime.fromisoformat(v["data"].replace('Z', '+00:00')).astimezone(FUSO_LOJA).isoformat()
+            if local != v["data"]:
+                operacoes.append(UpdateOne({"_id": v["_id"]}, {"$set": {"data": local}}))
+        if operacoes:
+            await db.sales.bulk_write(operacoes, ordered=False)
+        ultimo = pendentes[-1]["_id"]
+
+# Totais de movimentos (sangria/suprimento/retirada) e de pagamentos de dívida do dia
+# ficam acumulados no documento do caixa: cada escrita faz $inc no caixa do dia do
+# registro, e a tela de fechamento lê os totais prontos. totais_acumulados marca os
+# documentos em que os totais são mantidos assim; recalcular_totais_caixa refaz a soma
+# a partir dos registros (reparo e documentos anteriores aos totais).
+CAMPOS_TOTAL_MOVIMENTO = {
+    "sangria": "total_sangrias",
+    "suprimento": "total_suprimentos",
+    "retirada_gerencia": "total_retiradas_gerencia",
+}
+CAMPOS_PAGAMENTO_DIVIDA = ["pagamentos_divida_dinheiro", "pagamentos_divida_pix", "pagamentos_divida_cartao"]
+
+def campo_pagamento_divida(forma: Optional[str]) -> str:
+    if forma == "Cartao":
+        return "pagamentos_divida_cartao"
+    if forma in ["Pix", "Transferencia"]:
+        return "pagamentos_divida_pix"
+    return "pagamentos_divida_dinheiro"
+
+def dia_do_registro(data) -> str:
+    if isinstance(data, str):
+        data = datetime.fromisoformat(data.replace('Z', '+00:00'))
+    return dia_comercial(data)
+
+async def acumular_no_caixa(filial_id: str, dia: str, incrementos: dict):
+    """$inc nos totais do caixa do dia (cria o documento se o caixa ainda não foi aberto)."""
+    incrementos = {campo: valor for campo, valor in incrementos.items() if valor}
+    if not incrementos:
+        return
+    filtro = {"filial_id": filial_id, "business_date": dia}
+    try:
+        await db.fechamentos_caixa.update_one(
+            filtro, {"$inc": incrementos, "$setOnInsert": {"totais_acumulados": True}}, upsert=True
+        )
+    except DuplicateKeyError:
+        # Outra escrita criou o caixa do dia ao mesmo tempo; agora ele existe
+        await db.fechamentos_caixa.update_one(filtro, {"$inc": incrementos})
+
+async def acumular_movimento(movimento: dict, sinal: int = 1):
+    campo = CAMPOS_TOTAL_MOVIMENTO.get(movimento.get('tipo'))
+    if campo:
+        await acumular_no_caixa(
+            movimento.get('filial_id'), dia_do_registro(movimento.get('data')),
+            {campo: sinal * movimento.get('valor', 0)}
+        )
+
+async def recalcular_totais_caixa(filial_id: str, dia: str, criar: bool = True) -> dict:
+    """Refaz os totais do caixa do dia somando caixa_movimentos e pagamentos_saldo.
+    Com criar=False só atualiza o documento do caixa se ele já existir."""
+    inicio, fim = limites_dia_comercial(dia)
+    filtro = {"filial_id": filial_id, "data": {"$gte": inicio, "$lt": fim}}
+    movimentos = await db.caixa_movimentos.aggregate([
+        {"$match": filtro},
+        {"$group": {"_id": "$tipo", "total": {"$sum": "$valor"}}},
+    ]).to_list(None)
+    pagamentos = await db.pagamentos_saldo.aggregate([
+        {"$match": filtro},
+        {"$group": {"_id": "$forma_pagamento", "total": {"$sum": "$valor"}}},
+    ]).to_list(None)
+
+    totais = {campo: 0.0 for campo in [*CAMPOS_TOTAL_MOVIMENTO.values(), *CAMPOS_PAGAMENTO_DIVIDA]}
+    for m in movimentos:
+        if m["_id"] in CAMPOS_TOTAL_MOVIMENTO:
+            totais[CAMPOS_TOTAL_MOVIMENTO[m["_id"]]] += m["total"]
+    for p in pagamentos:
+        totais[campo_pagamento_divida(p["_id"])] += p["total"]
+
+    filtro_caixa = {"filial_id": filial_id, "business_date": dia}
+    atualizacao = {"$set": {**totais, "totais_acumulados": True}}
+    try:
+        await db.fechamentos_caixa.update_one(filtro_caixa, atualizacao, upsert=criar)
+    except DuplicateKeyError:
+        await db.fechamentos_caixa.update_one(filtro_caixa, atualizacao)
+    return totais
+
+async def preencher_totais_caixas_do_dia():
+    """
+    No startup: calcula os totais de hoje dos caixas que ainda não os acumulam. Não cria
+    caixa para toda filial (um documento sem status a cada boot); só para a que já tem
+    movimento ou pagamento hoje, como a primeira escrita do dia teria criado.
+    """
+    hoje = dia_comercial()
+    inicio, fim = limites_dia_comercial(hoje)
+    existentes = await db.fechamentos_caixa.find(
+        {"business_date": hoje}, {"_id": 0, "filial_id": 1, "totais_acumulados": 1}
+    ).to_list(None)
+    for caixa in existentes:
+        if not caixa.get("totais_acumulados"):
+            await recalcular_totais_caixa(caixa["filial_id"], hoje, criar=False)
+
+    do_dia = {"data": {"$gte": inicio, "$lt": fim}}
+    com_registros = set(await db.caixa_movimentos.distinct("filial_id", do_dia))
+    com_registros |= set(await db.pagamentos_saldo.distinct("filial_id", do_dia))
+    for filial_id in com_registros - {c["filial_id"] for c in existentes}:
+        if filial_id:
+            await recalcular_totais_caixa(filial_id, hoje)
+
+@api_router.post("/admin/caixa/recalcular-totais")
+async def recalcular_totais_caixa_endpoint(
+    filial_id: str,
+    dia: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    """Reparo: refaz os totais acumulados do caixa de um dia (padrão: hoje)."""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores podem recalcular o caixa")
+    dia = dia or dia_comercial()
+    try:
+        date.fromisoformat(dia)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="dia deve estar no formato AAAA-MM-DD")
+    return {"filial_id": filial_id, "business_date": dia, **await recalcular_totais_caixa(filial_id, dia)}
 
-    if existente:
-        raise HTTPException(status_code=400, detail="O caixa desta filial já foi aberto hoje.")
+@api_router.post("/caixa/abrir")
+async def abrir_caixa(dados: AberturaCaixa, current_user: User = Depends(get_current_active_user)):
+    hoje = dia_comercial()
 
-    # 2. Verifica inconsistência com o dia anterior
+    # 1. Verifica inconsistência com o dia anterior
     # Busca o último fechamento desta filial (excluindo hoje)
     ultimo_fechamento = await db.fechamentos_caixa.find_one(
         {"filial_id": dados.filial_id, "status": "fechado"},
@@ -1516,11 +3001,13 @@ async def abrir_caixa(dados: AberturaCaixa, current_user: User = Depends(get_cur
             inconsistencia = True
             diferenca = dados.valor_inicial - dinheiro_ontem
 
-    # 3. Cria o registro inicial do dia
+    # 2. Cria o registro inicial do dia; o índice único barra a segunda abertura
+    # da filial no mesmo dia (independente do usuário)
     novo_caixa = FechamentoCaixa(
         vendedora_id=current_user.id,
         vendedora_nome=dados.usuario,
         filial_id=dados.filial_id,
+        business_date=hoje,
         saldo_inicial=dados.valor_inicial,
         total_dinheiro=0, total_pix=0, total_cartao=0, total_credito=0, total_geral=0, num_vendas=0,
         status="aberto",
@@ -1528,18 +3015,47 @@ async def abrir_caixa(dados: AberturaCaixa, current_user: User = Depends(get_cur
         diferenca_abertura=diferenca
     )
     
-    doc = novo_caixa.model_dump()
+    # Os totais de movimentos podem já existir (movimento lançado antes da abertura): o
+    # documento do dia sem status é completado; um com status faz o upsert colidir no índice
+    doc = novo_caixa.model_dump(exclude=set(CAMPOS_TOTAL_MOVIMENTO.values()))
     doc['data'] = doc['data'].isoformat()
-    await db.fechamentos_caixa.insert_one(doc)
+    filtro = {"filial_id": dados.filial_id, "business_date": hoje}
+    for tentativa in range(2):
+        try:
+            await db.fechamentos_caixa.update_one(
+                {**filtro, "status": {"$exists": False}},
+                {"$set": doc, "$setOnInsert": {"totais_acumulados": True}},
+                upsert=True
+            )
+            break
+        except DuplicateKeyError:
+            # Um movimento ou pagamento pode ter criado o documento sem status ao mesmo
+            # tempo: ele agora existe e a segunda tentativa o completa
+            existente = await db.fechamentos_caixa.find_one(filtro, {"_id": 0, "status": 1})
+            if tentativa or existente is None or "status" in existente:
+                raise HTTPException(status_code=400, detail="O caixa desta filial já foi aberto hoje.")
     
     return {"message": "Caixa aberto com sucesso", "inconsistencia": inconsistencia}
 
 @api_router.post("/caixa/movimento")
-async def registrar_movimento(movimento: CaixaMovimentoBase, current_user: User = Depends(get_current_active_user)):
+async def registrar_movimento(
+    movimento: CaixaMovimentoBase,
+    current_user: User = Depends(get_current_active_user),
+    idempotency_key: Optional[str] = Header(None)
+):
+    return await executar_idempotente(
+        idempotency_key, "POST /caixa/movimento", current_user, movimento,
+        lambda: processar_movimento(movimento)
+    )
+
+async def processar_movimento(movimento: CaixaMovimentoBase):
     mov_obj = CaixaMovimento(**movimento.model_dump())
     doc = mov_obj.model_dump()
     doc['data'] = doc['data'].isoformat()
     await db.caixa_movimentos.insert_one(doc)
+    doc.pop('_id', None)
+    await acumular_movimento(doc)
+    publicar_evento(doc.get('filial_id'), "caixa_movimento", {"acao": "criado", "movimento": doc})
     return mov_obj
 
 
@@ -1554,52 +3070,64 @@ async def delete_movimento(movimento_id: str, current_user: User = Depends(get_c
     if current_user.role == "vendedora" and movimento["usuario"] != current_user.full_name:
         raise HTTPException(status_code=403, detail="Você não pode excluir um movimento criado por outro usuário")
 
-    await db.caixa_movimentos.delete_one({"id": movimento_id})
+    result = await db.caixa_movimentos.delete_one({"id": movimento_id})
+    if result.deleted_count:
+        await acumular_movimento(movimento, sinal=-1)
+    publicar_evento(movimento.get('filial_id'), "caixa_movimento", {"acao": "removido", "id": movimento_id})
     return {"message": "Movimento excluído com sucesso"}
 
 @api_router.post("/fechamento-caixa")
 async def salvar_fechamento(fechamento: FechamentoCaixaBase, current_user: User = Depends(get_current_active_user)):
-    # Lógica de UPSERT
-    today = datetime.now(timezone.utc).date()
-    start_dt = datetime.combine(today, datetime.min.time()).replace(tzinfo=timezone.utc)
-    end_dt = datetime.combine(today, datetime.max.time()).replace(tzinfo=timezone.utc)
-
-    query = {
-        "filial_id": fechamento.filial_id,
-        "data": {"$gte": start_dt.isoformat(), "$lte": end_dt.isoformat()}
-    }
+    # Lógica de UPSERT no caixa do dia comercial
+    query = {"filial_id": fechamento.filial_id, "business_date": dia_comercial()}
 
     # Atualiza apenas os campos financeiros, mantendo quem abriu e o saldo inicial
-    dados_atualizacao = fechamento.model_dump(exclude={'id', 'data', 'saldo_inicial', 'inconsistencia_abertura', 'diferenca_abertura'})
+    # (os totais de movimentos são acumulados pelo servidor, não vêm da tela)
+    dados_atualizacao = fechamento.model_dump(exclude={
+        'id', 'data', 'saldo_inicial', 'inconsistencia_abertura', 'diferenca_abertura',
+        *CAMPOS_TOTAL_MOVIMENTO.values()
+    })
     dados_atualizacao['status'] = 'fechado'
-    
-    result = await db.fechamentos_caixa.update_one(query, {"$set": dados_atualizacao})
+    # Fallback caso não tenha aberto (raro com a nova lógica): cria o caixa do dia
+    na_criacao = {
+        "id": str(uuid.uuid4()),
+        "data": fechamento.data.isoformat(),
+        "saldo_inicial": fechamento.saldo_inicial,
+        "inconsistencia_abertura": fechamento.inconsistencia_abertura,
+        "diferenca_abertura": fechamento.diferenca_abertura,
+        "totais_acumulados": True,
+    }
+
+    try:
+        result = await db.fechamentos_caixa.update_one(
+            query, {"$set": dados_atualizacao, "$setOnInsert": na_criacao}, upsert=True
+        )
+    except DuplicateKeyError:
+        # Outra requisição criou o caixa do dia entre a busca e o insert do upsert
+        result = await db.fechamentos_caixa.update_one(query, {"$set": dados_atualizacao})
 
-    if result.matched_count == 0:
-        # Fallback caso não tenha aberto (raro com a nova lógica)
-        fecha_obj = FechamentoCaixa(**fechamento.model_dump())
-        doc = fecha_obj.model_dump()
-        doc['data'] = doc['data'].isoformat()
-        await db.fechamentos_caixa.insert_one(doc)
+    if result.upserted_id is not None:
         return {"message": "Fechamento criado com sucesso"}
     
     return {"message": "Fechamento atualizado com sucesso"}
 
 @api_router.get("/fechamento-caixa/hoje")
 async def get_fechamento_hoje(filial_id: Optional[str] = None, current_user: User = Depends(get_current_active_user)):
-    today = datetime.now(timezone.utc).date()
+    hoje = dia_comercial()
+    inicio_dia, fim_dia = limites_dia_comercial(hoje)
+    amanha = (date.fromisoformat(hoje) + timedelta(days=1)).isoformat()
     
     target_filial_id = filial_id if filial_id else current_user.filial_id
     if not target_filial_id:
         target_filial_id = "default"
     
     # 1. Busca Vendas do Dia
-    users_same_filial = await db.users.find({"filial_id": target_filial_id}, {"_id": 0, "full_name": 1}).to_list(100)
-    vendedores_filial = [u['full_name'] for u in users_same_filial]
+    vendedores_filial = [u['full_name'] for u in await usuarios_da_filial(target_filial_id)]
     
     sales_query = {
         "vendedor": {"$in": vendedores_filial},
-        "data": {"$gte": today.isoformat()},
+        # Vendas gravam a data local da loja (montar_venda), então o prefixo é o dia comercial
+        "data": {"$gte": hoje, "$lt": amanha},
         # Trazemos tudo, inclusive estornadas, para conferência, 
         # mas o frontend pode decidir como mostrar visualmente (riscado, etc)
     }
@@ -1641,40 +3169,32 @@ async def get_fechamento_hoje(filial_id: Optional[str] = None, current_user: Use
                 summary[tipo] += valor_venda
 
     # 2. Busca Dados do Caixa do Dia
-    today_start = datetime.combine(today, datetime.min.time()).replace(tzinfo=timezone.utc)
-    today_end = datetime.combine(today, datetime.max.time()).replace(tzinfo=timezone.utc)
-    
-    caixa_dia = await db.fechamentos_caixa.find_one({
-        "filial_id": target_filial_id,
-        "data": {"$gte": today_start.isoformat(), "$lte": today_end.isoformat()}
-    })
+    caixa_dia = await db.fechamentos_caixa.find_one({"filial_id": target_filial_id, "business_date": hoje})
     
     saldo_inicial = caixa_dia.get('saldo_inicial', 0.0) if caixa_dia else 0.0
     status_caixa = caixa_dia.get('status', 'nao_iniciado') if caixa_dia else 'nao_iniciado'
     inconsistencia = caixa_dia.get('inconsistencia_abertura', False) if caixa_dia else False
     diferenca = caixa_dia.get('diferenca_abertura', 0.0) if caixa_dia else 0.0
 
-    # 3. Movimentos
-    movimentos = await db.caixa_movimentos.find({
-        "filial_id": target_filial_id,
-        "data": {"$gte": today_start.isoformat(), "$lte": today_end.isoformat()}
-    }, {"_id": 0}).to_list(100)
-    
-    total_sangrias = sum(m['valor'] for m in movimentos if m['tipo'] == 'sangria')
-    total_retiradas_gerencia = sum(m['valor'] for m in movimentos if m['tipo'] == 'retirada_gerencia')
-    total_suprimentos = sum(m['valor'] for m in movimentos if m['tipo'] == 'suprimento')
+    # 3. Movimentos: totais acumulados no caixa do dia; a lista é só para exibição
+    caixa_dia = caixa_dia or {}
+    total_sangrias = caixa_dia.get('total_sangrias', 0.0)
+    total_retiradas_gerencia = caixa_dia.get('total_retiradas_gerencia', 0.0)
+    total_suprimentos = caixa_dia.get('total_suprimentos', 0.0)
 
-    # 4. Pagamentos de Dívida
-    pagamentos_divida = await db.pagamentos_saldo.find({
+    movimentos = await db.caixa_movimentos.find({
         "filial_id": target_filial_id,
-        "data": {"$gte": today_start.isoformat(), "$lte": today_end.isoformat()}
-    }, {"_id": 0}).to_list(100)
-    
-    for pag in pagamentos_divida:
-        forma = pag.get('forma_pagamento', 'Dinheiro')
-        if forma == "Cartao": summary["Cartao"] += pag.get('valor', 0)
-        elif forma in ["Pix", "Transferencia"]: summary["Pix"] += pag.get('valor', 0)
-        else: summary["Dinheiro"] += pag.get('valor', 0)
+        "data": {"$gte": inicio_dia, "$lt": fim_dia}
+    }, {"_id": 0}).sort("data", -1).to_list(100)
+
+    # 4. Pagamentos de Dívida (também acumulados no caixa do dia)
+    pagamentos_divida = {
+        "Dinheiro": caixa_dia.get('pagamentos_divida_dinheiro', 0.0),
+        "Pix": caixa_dia.get('pagamentos_divida_pix', 0.0),
+        "Cartao": caixa_dia.get('pagamentos_divida_cartao', 0.0),
+    }
+    for forma, valor in pagamentos_divida.items():
+        summary[forma] += valor
 
     lista_vendedoras = [{"nome": k, "total": v["total"], "qtd": v["qtd"]} for k, v in vendas_por_vendedora.items()]
 
@@ -1695,8 +3215,9 @@ async def get_fechamento_hoje(filial_id: Optional[str] = None, current_user: Use
         "total_credito": summary["Credito"],
         "total_geral": sum(summary.values()),
         "num_vendas": sales_count,
-        "pagamentos_divida": pagamentos_divida,
-        "filial_id": target_filial_id
+        "pagamentos_divida": pagamentos_divida,  # totais por forma de pagamento
+        "filial_id": target_filial_id,
+        "business_date": hoje
     }
 @api_router.get("/fechamento-caixa/historico")
 async def get_historico_fechamentos(
@@ -1749,8 +3270,12 @@ class ComissionConfigUpdate(BaseModel):
     bonus_tiers: List[BonusTier]
 
 @api_router.get("/comissao-config/{filial_id}")
-async def get_comissao_config(filial_id: str, current_user: User = Depends(get_current_active_user)):
-    config = await db.comissao_config.find_one({"filial_id": filial_id}, {"_id": 0})
+async def get_comissao_config(filial_id: str, request: Request, response: Response, current_user: User = Depends(get_current_active_user)):
+    not_modified = await verificar_etag(request, response, ["comissao_config"], current_user)
+    if not_modified:
+        return not_modified
+
+    config = (await configs_comissao_por_filial()).get(filial_id)
     
     if not config:
         # Retornar configuração padrão
@@ -1798,8 +3323,148 @@ async def update_comissao_config(
         doc['updated_at'] = doc['updated_at'].isoformat()
         await db.comissao_config.insert_one(doc)
     
+    await incrementar_versao("comissao_config")
     return {"message": "Configuração atualizada com sucesso"}
 
+async def config_comissao(filial_id: Optional[str]) -> dict:
+    """Configuração de comissão da filial (ou a padrão)."""
+    return (await configs_comissao_por_filial()).get(filial_id) or CONFIG_PADRAO
+
+# ==================== FOLHA DE COMISSÕES ====================
+
+# Folha por (vendedora, mês): vendas agregadas no banco, metas, vales e configurações
+# carregados em poucas consultas, e o cálculo (comissoes.calcular_folha) feito em lote.
+# A simulação reaplica uma configuração candidata ao mesmo histórico.
+class PeriodoFolha(BaseModel):
+    mes_inicio: int
+    ano_inicio: int
+    mes_fim: int
+    ano_fim: int
+    filial_id: Optional[str] = None
+
+class SimulacaoComissao(PeriodoFolha):
+    config: ComissionConfigUpdate
+
+def validar_periodo_folha(periodo: PeriodoFolha):
+    if not (1 <= periodo.mes_inicio <= 12 and 1 <= periodo.mes_fim <= 12):
+        raise HTTPException(status_code=400, detail="Meses devem estar entre 1 e 12")
+    if (periodo.ano_inicio, periodo.mes_inicio) > (periodo.ano_fim, periodo.mes_fim):
+        raise HTTPException(status_code=400, detail="Início do período depois do fim")
+
+async def carregar_base_folha(periodo: PeriodoFolha) -> List[dict]:
+    """
+    Uma linha por (vendedora, ano, mês) do período com vendas ou vales: total de vendas,
+    peças, meta do mês (goals ou meta_mensal do usuário) e total de vales. A filial da
+    linha é a da vendedora, que define a configuração de comissão aplicada; com filial_id
+    entram as vendedoras da filial com todas as vendas delas (filtro_vendas_da_equipe).
+    """
+    inicio = f"{periodo.ano_inicio:04d}-{periodo.mes_inicio:02d}-01"
+    fim = f"{periodo.ano_fim + 1:04d}-01-01" if periodo.mes_fim == 12 else f"{periodo.ano_fim:04d}-{periodo.mes_fim + 1:02d}-01"
+    match = {"data": {"$gte": inicio, "$lt": fim}, "estornada": {"$ne": True}, "is_troca": {"$ne": True}}
+    if periodo.filial_id:
+        match.update(await filtro_vendas_da_equipe(periodo.filial_id))
+    vendas = await db.sales.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"vendedor_id": "$vendedor_id", "vendedor": "$vendedor", "mes": {"$substrBytes": ["$data", 0, 7]}},
+            "total_vendas": {"$sum": "$total"},
+            "num_vendas": {"$sum": 1},
+            "total_pecas": {"$sum": {"$sum": "$items.quantidade"}},
+        }},
+    ], allowDiskUse=True).to_list(None)
+
+    usuarios = await listar_usuarios()
+    por_id = {u["id"]: u for u in usuarios}
+    id_por_nome = {u["full_name"]: u["id"] for u in usuarios}
+    filtro_meses = filtro_periodo_vales(periodo.mes_inicio, periodo.ano_inicio, periodo.mes_fim, periodo.ano_fim)
+    metas = {
+        (g["vendedor"], g["ano"], g["mes"]): g.get("meta_vendas", 0)
+        for g in await db.goals.find(filtro_meses, {"_id": 0, "vendedor": 1, "ano": 1, "mes": 1, "meta_vendas": 1}).to_list(None)
+    }
+    vales = await db.vales.aggregate([
+        {"$match": filtro_meses},
+        {"$group": {"_id": {"vendedora_id": "$vendedora_id", "ano": "$ano", "mes": "$mes"}, "total": {"$sum": "$valor"}}},
+    ]).to_list(None)
+
+    linhas = {}
+    def linha(vendedora_id, ano, mes):
+        chave = (vendedora_id, ano, mes)
+        if chave not in linhas:
+            usuario = por_id.get(vendedora_id, {})
+            linhas[chave] = {
+                "vendedora_id": vendedora_id, "vendedor": usuario.get("full_name", ""),
+                "filial_id": usuario.get("filial_id"), "ano": ano, "mes": mes,
+                "total_vendas": 0.0, "num_vendas": 0, "total_pecas": 0, "total_vales": 0.0,
+            }
+        return linhas[chave]
+
+    for v in vendas:
+        vendedora_id = v["_id"].get("vendedor_id") or id_por_nome.get(v["_id"].get("vendedor"))
+        if not vendedora_id:
+            continue
+        ano, mes = (int(parte) for parte in v["_id"]["mes"].split("-"))
+        l = linha(vendedora_id, ano, mes)
+        l["vendedor"] = l["vendedor"] or v["_id"].get("vendedor", "")
+        for campo in ("total_vendas", "num_vendas", "total_pecas"):
+            l[campo] += v[campo]
+    for v in vales:
+        if v["_id"].get("vendedora_id") in por_id:
+            linha(v["_id"]["vendedora_id"], v["_id"]["ano"], v["_id"]["mes"])["total_vales"] += v["total"]
+
+    resultado = []
+    for (vendedora_id, ano, mes), l in sorted(linhas.items(), key=lambda item: (item[0][1], item[0][2], item[1]["vendedor"])):
+        if periodo.filial_id and l["filial_id"] != periodo.filial_id:
+            continue
+        meta = metas.get((l["vendedor"], ano, mes))
+        l["meta_vendas"] = meta if meta is not None else (por_id.get(vendedora_id, {}).get("meta_mensal") or 0)
+        resultado.append(l)
+    return resultado
+
+def resumir_folha(folha: List[dict]) -> dict:
+    return {
+        campo: round(sum(f[campo] for f in folha), 2)
+        for campo in ("comissao_base", "bonus_valor", "total_a_pagar")
+    }
+
+@api_router.post("/reports/folha")
+async def get_folha_comissoes(periodo: PeriodoFolha, current_user: User = Depends(get_current_active_user)):
+    """Folha de comissões por vendedora e mês com a configuração atual de cada filial."""
+    if current_user.role not in ["admin", "gerente"]:
+        raise HTTPException(status_code=403, detail="Apenas administradores e gerentes têm acesso à folha")
+    validar_periodo_folha(periodo)
+    linhas = await carregar_base_folha(periodo)
+    folha = calcular_folha_por_config(linhas, await configs_comissao_por_filial())
+    return {
+        "linhas": [{**l, **f} for l, f in zip(linhas, folha)],
+        "totais": resumir_folha(folha),
+    }
+
+@api_router.post("/comissao-config/simular")
+async def simular_comissao(simulacao: SimulacaoComissao, current_user: User = Depends(get_current_active_user)):
+    """
+    Reaplica uma configuração candidata aos meses do período e compara com a folha
+    calculada pela configuração atual de cada filial. Nada é gravado.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores podem simular configurações")
+    validar_periodo_folha(simulacao)
+    linhas = await carregar_base_folha(simulacao)
+    candidata = simulacao.config.model_dump()
+    atual = calcular_folha_por_config(linhas, await configs_comissao_por_filial())
+    simulado = calcular_folha_por_config(linhas, {}, config_unica=candidata)
+    totais_atual, totais_simulado = resumir_folha(atual), resumir_folha(simulado)
+    return {
+        "linhas": [
+            {**l, "percentual_meta": s["percentual_atingido"], "atual": a, "simulado": s}
+            for l, a, s in zip(linhas, atual, simulado)
+        ],
+        "totais": {
+            "atual": totais_atual,
+            "simulado": totais_simulado,
+            "diferenca": round(totais_simulado["total_a_pagar"] - totais_atual["total_a_pagar"], 2),
+        },
+    }
+
 # ==================== VALES ROUTES ====================
 
 class ValeBase(BaseModel):
@@ -1841,6 +3506,101 @@ async def get_vales_vendedora(vendedora_id: str, mes: Optional[int] = None, ano:
             v['data'] = datetime.fromisoformat(v['data'])
     return vales
 
+def filtro_periodo_vales(mes_inicio: Optional[int], ano_inicio: Optional[int], mes_fim: Optional[int], ano_fim: Optional[int]) -> dict:
+    """Filtro de (ano, mes) entre o início e o fim, inclusive; limites ausentes ficam em aberto."""
+    if ano_inicio and ano_fim and ano_inicio == ano_fim:
+        # Mesmo ano: igualdade em ano deixa o índice (vendedora_id, ano, mes) fazer o range em mes
+        filtro = {"ano": ano_inicio}
+        faixa_mes = {}
+        if mes_inicio:
+            faixa_mes["$gte"] = mes_inicio
+        if mes_fim:
+            faixa_mes["$lte"] = mes_fim
+        if faixa_mes:
+            filtro["mes"] = faixa_mes
+        return filtro
+
+    condicoes = []
+    if ano_inicio and mes_inicio:
+        condicoes.append({"$or": [{"ano": {"$gt": ano_inicio}}, {"ano": ano_inicio, "mes": {"$gte": mes_inicio}}]})
+    elif ano_inicio:
+        condicoes.append({"ano": {"$gte": ano_inicio}})
+    if ano_fim and mes_fim:
+        condicoes.append({"$or": [{"ano": {"$lt": ano_fim}}, {"ano": ano_fim, "mes": {"$lte": mes_fim}}]})
+    elif ano_fim:
+        condicoes.append({"ano": {"$lte": ano_fim}})
+
+    if not condicoes:
+        return {}
+    return condicoes[0] if len(condicoes) == 1 else {"$and": condicoes}
+
+@api_router.get("/vales")
+async def get_vales(
+    filial_id: str,
+    vendedora_ids: Optional[str] = None,
+    mes_inicio: Optional[int] = None,
+    ano_inicio: Optional[int] = None,
+    mes_fim: Optional[int] = None,
+    ano_fim: Optional[int] = None,
+    incluir_inativas: bool = False,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Vales da filial agrupados por vendedora, com total e quantidade calculados no banco.
+    vendedora_ids (separados por vírgula) restringe a algumas vendedoras; sem ele vêm
+    todas da filial, inclusive as que não têm vale no período (a tela usa a lista).
+    """
+    if current_user.role not in ["admin", "gerente"]:
+        raise HTTPException(status_code=403, detail="Apenas administradores e gerentes podem ver vales")
+    if current_user.role != "admin" and filial_id != current_user.filial_id and filial_id not in current_user.filiais_acesso:
+        raise HTTPException(status_code=403, detail="Sem acesso aos vales desta filial")
+
+    selecionadas = {v for v in vendedora_ids.split(",") if v} if vendedora_ids else None
+    vendedoras = sorted(
+        (
+            u for u in await usuarios_da_filial(filial_id)
+            if u.get("role") == "vendedora"
+            and (incluir_inativas or u.get("active") is True)
+            and (selecionadas is None or u["id"] in selecionadas)
+        ),
+        key=lambda u: u.get("full_name") or ""
+    )
+    ids = [v["id"] for v in vendedoras]
+
+    grupos = {}
+    if ids:
+        grupos = {
+            g["_id"]: g
+            async for g in db.vales.aggregate([
+                {"$match": {"vendedora_id": {"$in": ids}, **filtro_periodo_vales(mes_inicio, ano_inicio, mes_fim, ano_fim)}},
+                {"$project": {"_id": 0}},
+                {"$sort": {"data": -1}},
+                {"$group": {
+                    "_id": "$vendedora_id",
+                    "vales": {"$push": "$$ROOT"},
+                    "total": {"$sum": "$valor"},
+                    "quantidade": {"$sum": 1},
+                }},
+            ])
+        }
+
+    resultado = []
+    for v in vendedoras:
+        grupo = grupos.get(v["id"], {})
+        resultado.append({
+            "vendedora_id": v["id"],
+            "vendedora_nome": v.get("full_name") or v.get("username"),
+            "active": v.get("active", True),
+            "vales": grupo.get("vales", []),
+            "total": round(grupo.get("total", 0), 2),
+            "quantidade": grupo.get("quantidade", 0),
+        })
+    return {
+        "vendedoras": resultado,
+        "total_geral": round(sum(g["total"] for g in resultado), 2),
+        "quantidade": sum(g["quantidade"] for g in resultado),
+    }
+
 @api_router.put("/vales/{vale_id}")
 async def update_vale(vale_id: str, vale: ValeBase, current_user: User = Depends(get_current_active_user)):
     # Only admin and gerente can update vales
@@ -1944,14 +3704,15 @@ async def update_movimento(movimento_id: str, dados: CaixaMovimentoBase, current
     if current_user.role not in ["admin", "gerente"]:
         raise HTTPException(status_code=403, detail="Apenas admin/gerente podem editar")
 
-    # Verifica se existe na tabela de CAIXA
-    existing = await db.caixa_movimentos.find_one({"id": movimento_id})
+    update_dict = dados.model_dump(exclude={'filial_id', 'usuario', 'tipo'}) 
+
+    # Verifica se existe na tabela de CAIXA; o valor anterior (lido na mesma operação) dá a diferença do total
+    existing = await db.caixa_movimentos.find_one_and_update({"id": movimento_id}, {"$set": update_dict})
     if not existing:
         raise HTTPException(status_code=404, detail="Movimento não encontrado")
 
-    update_dict = dados.model_dump(exclude={'filial_id', 'usuario', 'tipo'}) 
-    
-    await db.caixa_movimentos.update_one({"id": movimento_id}, {"$set": update_dict})
+    await acumular_movimento({**existing, "valor": dados.valor - existing.get('valor', 0)})
+    publicar_evento(existing.get('filial_id'), "caixa_movimento", {"acao": "alterado", "id": movimento_id})
     return {"message": "Atualizado com sucesso"}
 
 # Nova Rota: Exclusão em Massa (Bulk Delete)
@@ -1963,7 +3724,27 @@ async def delete_movimentos_bulk(request: BulkDeleteRequest, current_user: User
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Apenas administradores podem excluir em massa")
     
+    removidos = await db.caixa_movimentos.find(
+        {"id": {"$in": request.ids}}, {"_id": 0, "filial_id": 1, "data": 1, "tipo": 1, "valor": 1}
+    ).to_list(None)
     result = await db.caixa_movimentos.delete_many({"id": {"$in": request.ids}})
+
+    # Um $inc por caixa/dia afetado
+    por_caixa = {}
+    for m in removidos:
+        campo = CAMPOS_TOTAL_MOVIMENTO.get(m.get('tipo'))
+        if campo:
+            totais = por_caixa.setdefault((m.get('filial_id'), dia_do_registro(m.get('data'))), {})
+            totais[campo] = totais.get(campo, 0) - m.get('valor', 0)
+    for (filial_id, dia), incrementos in por_caixa.items():
+        if result.deleted_count == len(removidos):
+            await acumular_no_caixa(filial_id, dia, incrementos)
+        else:
+            # Parte já tinha sido excluída por outra requisição: não dá para saber qual; refaz a soma
+            await recalcular_totais_caixa(filial_id, dia)
+
+    for filial_id in {m.get('filial_id') for m in removidos}:
+        publicar_evento(filial_id, "caixa_movimento", {"acao": "removido", "ids": request.ids})
     return {"message": f"{result.deleted_count} registros excluídos com sucesso"}
 # ==================== FILIAIS ROUTES ====================
 
@@ -1987,11 +3768,16 @@ async def create_filial(filial: FilialBase, current_user: User = Depends(get_cur
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.filiais.insert_one(doc)
+    await incrementar_versao("filiais")
     return filial_obj
 
 @api_router.get("/filiais")
-async def get_filiais(current_user: User = Depends(get_current_active_user)):
-    filiais = await db.filiais.find({}, {"_id": 0}).to_list(100)
+async def get_filiais(request: Request, response: Response, current_user: User = Depends(get_current_active_user)):
+    not_modified = await verificar_etag(request, response, ["filiais"], current_user)
+    if not_modified:
+        return not_modified
+
+    filiais = await listar_filiais()
     for f in filiais:
         if isinstance(f.get('created_at'), str):
             f['created_at'] = datetime.fromisoformat(f['created_at'])
@@ -2003,6 +3789,7 @@ async def update_filial(filial_id: str, filial: FilialBase, current_user: User =
         raise HTTPException(status_code=403, detail="Apenas administradores podem editar filiais")
     
     await db.filiais.update_one({"id": filial_id}, {"$set": filial.model_dump()})
+    await incrementar_versao("filiais")
     return {"message": "Filial atualizada com sucesso"}
 
 @api_router.delete("/filiais/{filial_id}")
@@ -2018,6 +3805,12 @@ async def delete_filial(filial_id: str, current_user: User = Depends(get_current
     # CASCADE DELETE: Delete all data related to this filial
     deleted_counts = {}
     
+    # Tombstones para os caixas que replicam o catálogo da filial
+    for colecao in ["products", "customers"]:
+        await registrar_remocoes(
+            colecao, await db[colecao].find({"filial_id": filial_id}, {"_id": 0, "id": 1, "filial_id": 1}).to_list(None)
+        )
+
     # Delete products
     products_result = await db.products.delete_many({"filial_id": filial_id})
     deleted_counts['products'] = products_result.deleted_count
@@ -2026,16 +3819,25 @@ async def delete_filial(filial_id: str, current_user: User = Depends(get_current
     customers_result = await db.customers.delete_many({"filial_id": filial_id})
     deleted_counts['customers'] = customers_result.deleted_count
     
-    # Delete sales
+    # Delete sales (e refaz o progresso de metas dos meses que tinham vendas da filial)
+    meses_com_vendas = [
+        m["_id"] for m in await db.sales.aggregate([
+            {"$match": {"filial_id": filial_id, "data": {"$type": "string"}}},
+            {"$group": {"_id": {"$substrBytes": ["$data", 0, 7]}}},
+        ]).to_list(None)
+    ]
     sales_result = await db.sales.delete_many({"filial_id": filial_id})
     deleted_counts['sales'] = sales_result.deleted_count
     
     # Delete users (only users exclusively from this filial)
-    users_result = await db.users.delete_many({
+    filtro_usuarios = {
         "filial_id": filial_id,
         "role": {"$ne": "admin"}  # Don't delete admins
-    })
+    }
+    ids_usuarios = [u["id"] for u in await db.users.find(filtro_usuarios, {"_id": 0, "id": 1}).to_list(None)]
+    users_result = await db.users.delete_many(filtro_usuarios)
     deleted_counts['users'] = users_result.deleted_count
+    await db.goal_progress.delete_many({"vendedor_id": {"$in": ids_usuarios}})
     
     # Delete vales
     vales_result = await db.vales.delete_many({"filial_id": filial_id})
@@ -2063,6 +3865,13 @@ async def delete_filial(filial_id: str, current_user: User = Depends(get_current
     
     # Finally, delete the filial itself
     await db.filiais.delete_one({"id": filial_id})
+
+    for colecao in ["filiais", "products", "users", "comissao_config"]:
+        await incrementar_versao(colecao)
+    # Depois da versão de users: o recálculo atribui vendas antigas pelo nome dos usuários
+    for mes_ano in meses_com_vendas:
+        ano, mes = (int(parte) for parte in mes_ano.split("-"))
+        await recalcular_progresso_metas(mes, ano)
     
     return {
         "message": "Filial e todos os dados relacionados foram excluídos com sucesso",
@@ -2209,15 +4018,23 @@ async def concluir_balanco(balanco_id: str, ajustar_estoque: bool = True, curren
     
     # If ajustar_estoque, update product quantities
     if ajustar_estoque:
+        carimbo = await carimbo_sync("products")
         for item in balanco['items']:
             if item['conferido'] and item.get('quantidade_contada') is not None:
                 await db.products.update_one(
                     {"id": item['product_id']},
                     {"$set": {
                         "quantidade": item['quantidade_contada'],
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }}
+                        **carimbo
+                    }, **GRAVADO_EM}
                 )
+        if eventos_broker.tem_assinantes():
+            # O balanço não guarda a filial: busca a de cada produto ajustado
+            ajustados = [i['product_id'] for i in balanco['items'] if i['conferido'] and i.get('quantidade_contada') is not None]
+            for p in await db.products.find(
+                {"id": {"$in": ajustados}}, {"_id": 0, "id": 1, "quantidade": 1, "filial_id": 1}
+            ).to_list(len(ajustados)):
+                publicar_estoque(p.get("filial_id"), p["id"], p["quantidade"])
     
     # Mark as concluido
     await db.balancos.update_one(
@@ -2245,6 +4062,72 @@ async def get_historico_balancos(current_user: User = Depends(get_current_active
     
     return balancos
 
+# ==================== ADMIN / DIAGNÓSTICO ====================
+
+@api_router.get("/admin/db-pool")
+async def get_db_pool_stats(current_user: User = Depends(get_current_active_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores podem ver diagnósticos")
+
+    pool = pool_monitor.snapshot()
+    max_pool_size = client.options.pool_options.max_pool_size
+    return {
+        "config": {
+            "max_pool_size": max_pool_size,
+            "min_pool_size": client.options.pool_options.min_pool_size,
+            "max_idle_time_ms": mongo_pool_options.get("maxIdleTimeMS"),
+            "wait_queue_timeout_ms": mongo_pool_options.get("waitQueueTimeoutMS"),
+        },
+        "pool": pool,
+        # Perto de 1.0 com aguardando_checkout > 0 indica pool saturado
+        "saturacao": pool["conexoes_em_uso"] / max_pool_size if max_pool_size else 0.0,
+        "comandos": command_monitor.snapshot()
+    }
+
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    limit: int = 20,
+    ordenar_por: str = "total_ms",
+    current_user: User = Depends(get_current_active_user)
+):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores podem ver diagnósticos")
+    if ordenar_por not in ["total_ms", "max_ms", "count"]:
+        raise HTTPException(status_code=400, detail="ordenar_por deve ser total_ms, max_ms ou count")
+
+    return {
+        "limite_ms": slow_query_recorder.limite_ms,
+        "ofensores": slow_query_recorder.top_ofensores(min(limit, 200), ordenar_por)
+    }
+
+@api_router.delete("/admin/slow-queries")
+async def limpar_slow_queries(current_user: User = Depends(get_current_active_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores podem ver diagnósticos")
+    slow_query_recorder.limpar()
+    return {"message": "Registro de operações lentas limpo"}
+
+@metrics_registry.coletor
+def coletar_pool_mongo():
+    pool = pool_monitor.snapshot()
+    mongodb_pool_connections.set(pool["conexoes_em_uso"], estado="em_uso")
+    mongodb_pool_connections.set(pool["conexoes_abertas"], estado="abertas")
+    mongodb_pool_connections.set(pool["aguardando_checkout"], estado="aguardando")
+    for quantil in ["p50", "p95", "p99"]:
+        mongodb_pool_checkout_wait.set(pool["espera_checkout_ms"][quantil] / 1000, quantil=quantil)
+
+@metrics_registry.coletor
+def coletar_eventos():
+    eventos_assinantes.set(eventos_broker.estatisticas()["assinantes"])
+
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    # Sem login para o scraper; se METRICS_TOKEN estiver definido exige "Authorization: Bearer <token>"
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 # ==================== ROOT ROUTE ====================
 
 @api_router.get("/")
@@ -2254,10 +4137,107 @@ async def root():
 # Include router
 app.include_router(api_router)
 
+# ==================== ÍNDICES ====================
+
+# (coleção, chaves, opções) garantidos no startup. create_index não faz nada se o
+# índice já existe com a mesma definição.
+INDICES = [
+    ("idempotency_keys", [("created_at", 1)], {
+        "name": "ttl_created_at", "expireAfterSeconds": IDEMPOTENCY_TTL_HOURS * 3600
+    }),
+    # Busca por id (venda, troca, estorno, cliente da venda): caminho quente do checkout
+    ("products", [("id", 1)], {"name": "id"}),
+    ("customers", [("id", 1)], {"name": "id"}),
+    ("products", [("gravado_em", 1), ("id", 1)], {"name": "sync_gravado_em"}),
+    ("products", [("filial_id", 1), ("gravado_em", 1), ("id", 1)], {"name": "sync_filial_gravado_em"}),
+    ("customers", [("gravado_em", 1), ("id", 1)], {"name": "sync_gravado_em"}),
+    ("customers", [("filial_id", 1), ("gravado_em", 1), ("id", 1)], {"name": "sync_filial_gravado_em"}),
+    ("sync_tombstones", [("colecao", 1), ("id", 1)], {"name": "colecao_id"}),
+    ("sync_tombstones", [("colecao", 1), ("gravado_em", 1), ("id", 1)], {"name": "colecao_gravado_em"}),
+    ("sync_tombstones", [("colecao", 1), ("filial_id", 1), ("gravado_em", 1), ("id", 1)], {"name": "colecao_filial_gravado_em"}),
+    # Shards do contador de versão dos catálogos (obter_versoes)
+    ("collection_versions", [("colecao", 1)], {"name": "colecao"}),
+    ("sales", [("client_id", 1)], {
+        "name": "client_id_unico", "unique": True,
+        "partialFilterExpression": {"client_id": {"$type": "string"}}
+    }),
+    ("vales", [("vendedora_id", 1), ("ano", 1), ("mes", 1)], {"name": "vendedora_ano_mes"}),
+    # Typeahead de clientes do PDV (prefixo nos campos normalizados)
+    ("customers", [("filial_id", 1), ("nome_busca", 1)], {"name": "busca_nome"}),
+    ("customers", [("filial_id", 1), ("cpf_digitos", 1)], {"name": "busca_cpf"}),
+    # CPF único entre todas as filiais; se falhar aqui (repetidos na base), é tentado de
+    # novo depois do backfill em garantir_cpf_unico
+    ("customers", [("cpf_digitos", 1)], {
+        "name": "cpf_unico", "unique": True,
+        "partialFilterExpression": {"cpf_digitos": {"$type": "string"}}
+    }),
+    ("customers", [("filial_id", 1), ("telefone_digitos", 1)], {"name": "busca_telefone"}),
+    # Ordenações das telas paginadas por cursor (products/pagina, customers/pagina)
+    ("products", [("filial_id", 1), ("descricao", 1), ("id", 1)], {"name": "pagina_descricao"}),
+    ("products", [("filial_id", 1), ("quantidade", 1), ("id", 1)], {"name": "pagina_quantidade"}),
+    ("products", [("filial_id", 1), ("preco_venda", 1), ("id", 1)], {"name": "pagina_preco_venda"}),
+    ("customers", [("filial_id", 1), ("nome", 1), ("id", 1)], {"name": "pagina_nome"}),
+    ("customers", [("filial_id", 1), ("saldo_devedor", 1), ("id", 1)], {"name": "pagina_saldo_devedor"}),
+    ("customers", [("filial_id", 1), ("credito_loja", 1), ("id", 1)], {"name": "pagina_credito_loja"}),
+    # Falha (e só gera aviso) se a base já tiver códigos repetidos na mesma filial
+    ("products", [("filial_id", 1), ("codigo", 1)], {"name": "filial_codigo_unico", "unique": True}),
+    # Um caixa por filial e dia comercial (abrir_caixa depende deste índice)
+    ("fechamentos_caixa", [("filial_id", 1), ("business_date", 1)], {
+        "name": "filial_dia_unico", "unique": True,
+        "partialFilterExpression": {"business_date": {"$type": "string"}}
+    }),
+    ("goal_progress", [("vendedor_id", 1), ("ano", 1), ("mes", 1)], {"name": "vendedor_ano_mes", "unique": True}),
+    ("customers", [("data_ultimo_credito", 1)], {
+        "name": "credito_a_expirar", "partialFilterExpression": {"credito_loja": {"$gt": 0}}
+    }),
+]
+
+# Índices substituídos: removidos no startup para não pesarem nas escritas
+INDICES_OBSOLETOS = [
+    ("products", "sync_versao"),
+    ("products", "sync_filial_versao"),
+    ("customers", "sync_versao"),
+    ("customers", "sync_filial_versao"),
+    ("sync_tombstones", "colecao_versao"),
+    ("sync_tombstones", "colecao_filial_versao"),
+]
+
+async def criar_indices():
+    for colecao, nome in INDICES_OBSOLETOS:
+        try:
+            await db[colecao].drop_index(nome)
+        except OperationFailure:
+            pass  # já removido (ou nunca criado)
+    for colecao, chaves, opcoes in INDICES:
+        try:
+            await db[colecao].create_index(chaves, **opcoes)
+        except OperationFailure as e:
+            # Ex.: índice com o mesmo nome e opções diferentes (TTL alterado); precisa de ajuste manual
+            logger.warning("Índice %s em %s não criado: %s", opcoes.get("name"), colecao, e)
+
 # Startup event - Seed database
 @app.on_event("startup")
 async def startup_event():
     await seed_database(db)
+    await criar_indices()
+    await preencher_versoes_sync()
+    await preencher_campos_busca_clientes()
+    await garantir_cpf_unico()
+    await normalizar_data_ultimo_credito()
+    await preencher_dia_comercial_caixas()
+    await corrigir_fuso_vendas_sincronizadas()
+    await preencher_totais_caixas_do_dia()
+    await preencher_progresso_metas()
+    app.state.lag_task = asyncio.create_task(
+        medir_lag_event_loop(event_loop_lag, event_loop_lag_histogram)
+    )
+    slow_query_recorder.iniciar(client)
+    if eventos_estado["change_streams"]:
+        app.state.eventos_task = asyncio.create_task(observar_change_streams())
+    if CREDITO_EXPIRACAO_AUTOMATICA and not CREDITO_VALIDADE_CONFIGURADA:
+        logger.warning("CREDITO_EXPIRACAO_AUTOMATICA=1 sem CREDITO_VALIDADE_DIAS: expiração automática não iniciada")
+    elif CREDITO_EXPIRACAO_AUTOMATICA:
+        app.state.expiracao_task = asyncio.create_task(agendar_expiracao_creditos())
 
 # CORS
 app.add_middleware(
@@ -2268,6 +4248,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Métricas por rota (middleware mais interno: mede o handler, sem o custo da compressão)
+app.add_middleware(
+    MetricsMiddleware,
+    requisicoes=http_requests_total,
+    latencia=http_request_duration,
+)
+
+# Compressão (gzip/brotli) para respostas grandes como /sales e /fechamento-caixa/hoje
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024')),
+    gzip_level=int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6')),
+    brotli_quality=int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4')),
+)
+
 # Logging
 logging.basicConfig(
     level=logging.INFO,
@@ -2277,4 +4272,12 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    lag_task = getattr(app.state, "lag_task", None)
+    if lag_task:
+        lag_task.cancel()
+    for nome in ["eventos_task", "expiracao_task"]:
+        task = getattr(app.state, nome, None)
+        if task:
+            task.cancel()
+    slow_query_recorder.parar()
     client.close()
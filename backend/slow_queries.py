@@ -0,0 +1,254 @@
+"""
+Registro de operações lentas no MongoDB com captura de explain("executionStats").
+
+O listener roda nas threads do Motor; quando um comando passa do limite ele é
+agregado por formato do filtro + handler, e (com amostragem e limite por minuto)
+enfileirado para um explain executado no event loop.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Nome do handler FastAPI que está executando (definido por uma dependência do router)
+handler_atual = contextvars.ContextVar("handler_atual", default="")
+
+COMANDOS_EXPLICAVEIS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+
+# Campos de sessão/transação que o explain não aceita
+CAMPOS_META = {
+    "lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit",
+    "startTransaction", "readConcern", "writeConcern", "$readConcern",
+}
+
+# Onde o filtro fica em cada comando
+CAMPOS_FILTRO = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+
+
+def formato_filtro(valor):
+    """Troca valores por tipos, mantendo campos e operadores: {"cpf": "str", "data": {"$gte": "str"}}"""
+    if isinstance(valor, dict):
+        return {k: formato_filtro(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        if not valor:
+            return []
+        # $and/$or/pipelines: mantém a estrutura; listas de valores ($in) viram um só tipo
+        if all(isinstance(v, dict) for v in valor):
+            return [formato_filtro(v) for v in valor]
+        return [formato_filtro(valor[0])]
+    return type(valor).__name__
+
+
+def extrair_filtro(comando_nome, comando):
+    if comando_nome in CAMPOS_FILTRO:
+        return comando.get(CAMPOS_FILTRO[comando_nome], {})
+    if comando_nome == "aggregate":
+        return comando.get("pipeline", [])
+    if comando_nome == "update":
+        return [u.get("q", {}) for u in comando.get("updates", [])][:1]
+    if comando_nome == "delete":
+        return [d.get("q", {}) for d in comando.get("deletes", [])][:1]
+    return {}
+
+
+def _coletar_estagios(plano, estagios, indices):
+    if isinstance(plano, dict):
+        if "stage" in plano:
+            estagios.append(plano["stage"])
+        if "indexName" in plano:
+            indices.append(plano["indexName"])
+        for v in plano.values():
+            _coletar_estagios(v, estagios, indices)
+    elif isinstance(plano, list):
+        for v in plano:
+            _coletar_estagios(v, estagios, indices)
+
+
+def _buscar_chave(doc, chave):
+    if isinstance(doc, dict):
+        if chave in doc:
+            return doc[chave]
+        for v in doc.values():
+            achado = _buscar_chave(v, chave)
+            if achado is not None:
+                return achado
+    elif isinstance(doc, list):
+        for v in doc:
+            achado = _buscar_chave(v, chave)
+            if achado is not None:
+                return achado
+    return None
+
+
+def resumir_explain(explain: dict) -> dict:
+    """Resume a saída do explain: estágios do plano vencedor, índices usados e contadores."""
+    estagios, indices = [], []
+    _coletar_estagios(_buscar_chave(explain, "winningPlan") or {}, estagios, indices)
+    stats = _buscar_chave(explain, "executionStats") or {}
+    return {
+        "estagios": estagios,
+        "indices": sorted(set(indices)),
+        "collscan": "COLLSCAN" in estagios,
+        "sort_em_memoria": "SORT" in estagios,
+        "n_retornados": stats.get("nReturned"),
+        "chaves_examinadas": stats.get("totalKeysExamined"),
+        "docs_examinados": stats.get("totalDocsExamined"),
+        "tempo_execucao_ms": stats.get("executionTimeMillis"),
+    }
+
+
+def comando_para_explain(comando: dict) -> dict:
+    return {k: v for k, v in comando.items() if k not in CAMPOS_META}
+
+
+class SlowQueryRecorder(monitoring.CommandListener):
+    def __init__(self, limite_ms: float = 200, amostragem: float = 1.0,
+                 explains_por_minuto: int = 10, max_ofensores: int = 500):
+        self.limite_ms = limite_ms
+        self.amostragem = amostragem
+        self.explains_por_minuto = explains_por_minuto
+        self.max_ofensores = max_ofensores
+        self._lock = threading.Lock()
+        self._pendentes = {}
+        self._ofensores = {}
+        self._explains_recentes = deque()
+        self._loop = None
+        self._fila = None
+        self._db_client = None
+        self._task = None
+
+    # ---- ciclo de vida (chamado no startup/shutdown do app) ----
+
+    def iniciar(self, motor_client):
+        self._db_client = motor_client
+        self._loop = asyncio.get_running_loop()
+        self._fila = asyncio.Queue(maxsize=100)
+        self._task = asyncio.create_task(self._processar_explains())
+
+    def parar(self):
+        if self._task:
+            self._task.cancel()
+
+    # ---- listener ----
+
+    def started(self, event):
+        if event.command_name not in COMANDOS_EXPLICAVEIS:
+            return
+        with self._lock:
+            self._pendentes[(event.connection_id, event.request_id)] = (
+                event.command, event.database_name, handler_atual.get()
+            )
+
+    def succeeded(self, event):
+        self._finalizar(event)
+
+    def failed(self, event):
+        self._finalizar(event)
+
+    def _finalizar(self, event):
+        with self._lock:
+            pendente = self._pendentes.pop((event.connection_id, event.request_id), None)
+        if pendente is None:
+            return
+        duracao_ms = event.duration_micros / 1000
+        if duracao_ms < self.limite_ms:
+            return
+
+        comando, database, handler = pendente
+        colecao = comando.get(event.command_name)
+        formato = json.dumps(formato_filtro(extrair_filtro(event.command_name, comando)), sort_keys=True)
+        chave = (event.command_name, colecao, formato, handler)
+
+        logger.warning(
+            "Operação lenta: %s %s.%s %.0fms handler=%s filtro=%s",
+            event.command_name, database, colecao, duracao_ms, handler or "-", formato
+        )
+
+        with self._lock:
+            ofensor = self._ofensores.get(chave)
+            if ofensor is None:
+                if len(self._ofensores) >= self.max_ofensores:
+                    return
+                ofensor = self._ofensores[chave] = {
+                    "comando": event.command_name,
+                    "colecao": colecao,
+                    "formato_filtro": formato,
+                    "handler": handler,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "ultimo_em": None,
+                    "explain": None,
+                }
+            ofensor["count"] += 1
+            ofensor["total_ms"] += duracao_ms
+            ofensor["max_ms"] = max(ofensor["max_ms"], duracao_ms)
+            ofensor["ultimo_em"] = time.time()
+            precisa_explain = ofensor["explain"] is None and self._reservar_explain()
+
+        if precisa_explain:
+            item = (chave, database, comando_para_explain(comando))
+            try:
+                self._loop.call_soon_threadsafe(self._fila.put_nowait, item)
+            except (AttributeError, RuntimeError):
+                pass  # recorder não iniciado ou loop encerrado
+
+    def _reservar_explain(self) -> bool:
+        # Chamado com o lock: amostragem + limite de explains por minuto
+        if self._fila is None or random.random() > self.amostragem:
+            return False
+        agora = time.monotonic()
+        while self._explains_recentes and agora - self._explains_recentes[0] > 60:
+            self._explains_recentes.popleft()
+        if len(self._explains_recentes) >= self.explains_por_minuto:
+            return False
+        self._explains_recentes.append(agora)
+        return True
+
+    async def _processar_explains(self):
+        while True:
+            chave, database, comando = await self._fila.get()
+            try:
+                explain = await self._db_client[database].command(
+                    {"explain": comando, "verbosity": "executionStats"}
+                )
+                resumo = resumir_explain(explain)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # explain é best-effort
+                resumo = {"erro": str(e)}
+            with self._lock:
+                if chave in self._ofensores:
+                    self._ofensores[chave]["explain"] = resumo
+            self._fila.task_done()
+
+    async def aguardar_explains(self):
+        """Espera os explains já enfileirados terminarem (usado pelos testes de plano de query)."""
+        if self._fila is not None:
+            await self._fila.join()
+
+    # ---- consulta ----
+
+    def top_ofensores(self, limite: int = 20, ordenar_por: str = "total_ms") -> list:
+        with self._lock:
+            itens = [dict(o) for o in self._ofensores.values()]
+        for o in itens:
+            o["media_ms"] = o["total_ms"] / o["count"] if o["count"] else 0.0
+        return sorted(itens, key=lambda o: o.get(ordenar_por) or 0, reverse=True)[:limite]
+
+    def limpar(self):
+        with self._lock:
+            self._ofensores.clear()
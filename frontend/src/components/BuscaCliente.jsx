@@ -0,0 +1,89 @@
+import { useEffect, useRef, useState } from 'react';
+import { Input } from '@/components/ui/input';
+import { Button } from '@/components/ui/button';
+import { customersAPI } from '@/lib/api';
+import { User, X } from 'lucide-react';
+
+// Seleção de cliente por busca no servidor (nome, CPF ou telefone), sem baixar a base.
+// `cliente` é o cliente escolhido ({ id, nome, cpf }) ou null.
+export default function BuscaCliente({ filialId, cliente, onChange, placeholder = 'Buscar cliente por nome, CPF ou telefone...' }) {
+  const [termo, setTermo] = useState('');
+  const [resultados, setResultados] = useState([]);
+  const [aberto, setAberto] = useState(false);
+  const [buscando, setBuscando] = useState(false);
+  const ultimaBusca = useRef(0);
+
+  useEffect(() => {
+    const q = termo.trim();
+    if (!filialId || q.length < 2) {
+      setResultados([]);
+      return undefined;
+    }
+    const minha = ++ultimaBusca.current;
+    const timer = setTimeout(async () => {
+      setBuscando(true);
+      try {
+        const encontrados = await customersAPI.search(q, filialId);
+        if (minha === ultimaBusca.current) setResultados(encontrados);
+      } catch (error) {
+        console.error('Erro ao buscar clientes:', error);
+      } finally {
+        if (minha === ultimaBusca.current) setBuscando(false);
+      }
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [termo, filialId]);
+
+  const escolher = (c) => {
+    onChange(c);
+    setTermo('');
+    setResultados([]);
+    setAberto(false);
+  };
+
+  if (cliente) {
+    return (
+      <div className="flex items-center justify-between gap-2 h-9 px-3 border rounded-md bg-gray-50">
+        <span className="flex items-center gap-2 text-sm truncate">
+          <User className="w-4 h-4 text-indigo-600" />
+          {cliente.nome} {cliente.cpf && <span className="text-gray-500">- {cliente.cpf}</span>}
+        </span>
+        <Button variant="ghost" size="icon" className="h-6 w-6" onClick={() => onChange(null)} title="Remover cliente">
+          <X className="w-4 h-4" />
+        </Button>
+      </div>
+    );
+  }
+
+  return (
+    <div className="relative">
+      <Input
+        value={termo}
+        placeholder={placeholder}
+        onChange={(e) => { setTermo(e.target.value); setAberto(true); }}
+        onFocus={() => setAberto(true)}
+        onBlur={() => setTimeout(() => setAberto(false), 150)}
+      />
+      {aberto && termo.trim().length >= 2 && (
+        <div className="absolute z-50 mt-1 w-full bg-white border rounded-md shadow-lg max-h-64 overflow-y-auto">
+          {resultados.map((c) => (
+            <button
+              key={c.id}
+              type="button"
+              className="w-full text-left px-3 py-2 text-sm hover:bg-gray-100"
+              onMouseDown={(e) => e.preventDefault()}
+              onClick={() => escolher(c)}
+            >
+              <span className="font-medium">{c.nome}</span>
+              {c.cpf && <span className="text-gray-500"> - {c.cpf}</span>}
+              {c.telefone && <span className="text-gray-400 text-xs ml-2">{c.telefone}</span>}
+            </button>
+          ))}
+          {resultados.length === 0 && (
+            <p className="px-3 py-2 text-sm text-gray-500">{buscando ? 'Buscando...' : 'Nenhum cliente encontrado'}</p>
+          )}
+        </div>
+      )}
+    </div>
+  );
+}
@@ -0,0 +1,52 @@
+import { useEffect, useRef } from 'react';
+import { eventosURL } from '@/lib/api';
+
+// Assina os eventos da filial (venda_criada, venda_estornada, estoque_alterado,
+// caixa_movimento, resync) e chama onEvento(tipo, dados) para cada um, na ordem de
+// chegada. Os eventos são entregues em lotes a cada `esperaMs` (uma renderização por
+// rajada); quem assina aplica o payload ao estado local. Um "resync" descarta o que
+// estava pendente, porque quem recebe recarrega tudo. O EventSource reconecta
+// sozinho; ao reconectar dispara um "resync".
+export function useEventosFilial(filialId, tipos, onEvento, esperaMs = 500) {
+  const callbackRef = useRef(onEvento);
+  callbackRef.current = onEvento;
+  const chaveTipos = tipos.join(',');
+
+  useEffect(() => {
+    if (!filialId || typeof EventSource === 'undefined') return undefined;
+
+    const fonte = new EventSource(eventosURL(filialId));
+    let pendentes = [];
+    let timer = null;
+    let conectouAntes = false;
+
+    const despachar = () => {
+      timer = null;
+      const lote = pendentes;
+      pendentes = [];
+      lote.forEach(([tipo, dados]) => callbackRef.current(tipo, dados));
+    };
+    const enfileirar = (tipo, dados) => {
+      if (tipo === 'resync') pendentes = [];
+      pendentes.push([tipo, dados]);
+      if (!timer) timer = setTimeout(despachar, esperaMs);
+    };
+
+    const ouvintes = [...chaveTipos.split(','), 'resync'].map((tipo) => {
+      const ouvinte = (e) => enfileirar(tipo, e.data ? JSON.parse(e.data) : {});
+      fonte.addEventListener(tipo, ouvinte);
+      return [tipo, ouvinte];
+    });
+    fonte.onopen = () => {
+      // Eventos perdidos enquanto a conexão esteve fora: recarrega tudo
+      if (conectouAntes) enfileirar('resync', {});
+      conectouAntes = true;
+    };
+
+    return () => {
+      ouvintes.forEach(([tipo, ouvinte]) => fonte.removeEventListener(tipo, ouvinte));
+      fonte.close();
+      if (timer) clearTimeout(timer);
+    };
+  }, [filialId, chaveTipos, esperaMs]);
+}
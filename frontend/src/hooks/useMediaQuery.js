@@ -0,0 +1,19 @@
+import { useEffect, useState } from 'react';
+
+// true enquanto a media query casa. Para telas que têm um layout por tamanho e não
+// devem montar os dois (escondendo um só com CSS).
+export function useMediaQuery(query) {
+  const [casa, setCasa] = useState(
+    () => typeof window !== 'undefined' && window.matchMedia(query).matches
+  );
+
+  useEffect(() => {
+    const mql = window.matchMedia(query);
+    const aoMudar = (e) => setCasa(e.matches);
+    setCasa(mql.matches);
+    mql.addEventListener('change', aoMudar);
+    return () => mql.removeEventListener('change', aoMudar);
+  }, [query]);
+
+  return casa;
+}
@@ -0,0 +1,57 @@
+import { useCallback, useEffect, useRef, useState } from 'react';
+import api from '@/lib/api';
+
+// Lista paginada por cursor no servidor (/products/pagina, /customers/pagina).
+// Mudanças em `params` (busca, filtros, ordenação) recomeçam da primeira página depois
+// de `esperaMs`; carregarMais() busca a próxima página e concatena. Respostas atrasadas
+// de uma busca anterior são descartadas.
+export function usePaginaServidor(url, params, { limite = 100, esperaMs = 300, ativo = true } = {}) {
+  const [itens, setItens] = useState([]);
+  const [primeira, setPrimeira] = useState({});
+  const [cursor, setCursor] = useState(null);
+  const [temMais, setTemMais] = useState(false);
+  const [carregando, setCarregando] = useState(true);
+  const [erro, setErro] = useState(null);
+  const geracao = useRef(0);
+  const chave = JSON.stringify(params);
+
+  const buscar = useCallback(async (cursorPagina) => {
+    const minha = geracao.current;
+    setCarregando(true);
+    setErro(null);
+    try {
+      const response = await api.get(url, {
+        params: { ...JSON.parse(chave), limit: limite, ...(cursorPagina ? { cursor: cursorPagina } : {}) },
+      });
+      if (minha !== geracao.current) return;
+      const { itens: pagina, cursor: proximo, tem_mais: mais, ...resto } = response.data;
+      setItens((atuais) => (cursorPagina ? [...atuais, ...pagina] : pagina));
+      if (!cursorPagina) setPrimeira(resto);
+      setCursor(proximo);
+      setTemMais(mais);
+    } catch (error) {
+      if (minha === geracao.current) setErro(error);
+    } finally {
+      if (minha === geracao.current) setCarregando(false);
+    }
+  }, [url, chave, limite]);
+
+  const recarregar = useCallback(() => {
+    geracao.current += 1;
+    return buscar(null);
+  }, [buscar]);
+
+  useEffect(() => {
+    if (!ativo) return undefined;
+    geracao.current += 1;
+    const timer = setTimeout(() => buscar(null), esperaMs);
+    return () => clearTimeout(timer);
+  }, [buscar, esperaMs, ativo]);
+
+  const carregarMais = useCallback(() => {
+    if (temMais && !carregando) buscar(cursor);
+  }, [temMais, carregando, cursor, buscar]);
+
+  // `primeira` traz os extras da primeira página (total, ultimo_codigo...)
+  return { itens, setItens, primeira, temMais, carregando, erro, carregarMais, recarregar };
+}
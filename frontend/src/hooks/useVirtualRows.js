@@ -0,0 +1,24 @@
+import { useCallback, useState } from 'react';
+
+// Janela de linhas visíveis para tabelas longas: só as linhas na área rolada (mais uma
+// margem) são montadas; espacoAntes/espacoDepois viram linhas vazias com a altura das
+// que ficaram de fora, mantendo a barra de rolagem proporcional. Supõe linhas de altura
+// fixa (alturaLinha). pertoDoFim avisa para buscar a próxima página.
+export function useVirtualRows(total, { alturaLinha = 53, alturaVisivel = 600, margem = 10 } = {}) {
+  const [scrollTop, setScrollTop] = useState(0);
+  const onScroll = useCallback((e) => setScrollTop(e.currentTarget.scrollTop), []);
+
+  const inicio = Math.max(0, Math.floor(scrollTop / alturaLinha) - margem);
+  const fim = Math.min(total, Math.ceil((scrollTop + alturaVisivel) / alturaLinha) + margem);
+
+  return {
+    inicio,
+    fim,
+    espacoAntes: inicio * alturaLinha,
+    espacoDepois: Math.max(0, (total - fim) * alturaLinha),
+    pertoDoFim: fim >= total - margem,
+    onScroll,
+    alturaLinha,
+    alturaVisivel,
+  };
+}
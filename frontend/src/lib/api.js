@@ -34,6 +34,25 @@ api.interceptors.response.use(
   }
 );
 
+// POST com Idempotency-Key: gera a chave uma vez e repete com a MESMA chave quando a
+// conexão cai sem resposta (ou o servidor ainda está processando). O backend devolve a
+// resposta gravada em vez de registrar a venda/pagamento de novo.
+const gerarChaveIdempotencia = () =>
+  window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+
+export const postIdempotente = async (url, data, tentativas = 3) => {
+  const headers = { 'Idempotency-Key': gerarChaveIdempotencia() };
+  for (let tentativa = 1; ; tentativa++) {
+    try {
+      return await api.post(url, data, { headers });
+    } catch (error) {
+      const repetir = !error.response || error.response.status === 409;
+      if (!repetir || tentativa >= tentativas) throw error;
+      await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** (tentativa - 1)));
+    }
+  }
+};
+
 // Auth API
 export const authAPI = {
   login: async (username, password) => {
@@ -81,10 +100,20 @@ export const productsAPI = {
     const response = await api.put(`/products/${id}`, product);
     return response.data;
   },
+  // Cria ou atualiza pelo código dentro da filial; a resposta traz `criado`
+  upsert: async (product) => {
+    const response = await api.put('/products/upsert', product);
+    return response.data;
+  },
   delete: async (id) => {
     const response = await api.delete(`/products/${id}`);
     return response.data;
   },
+  // Alterações desde o cursor (itens, removidos, cursor, tem_mais) para manter a réplica local
+  changes: async (since = '0', filialId) => {
+    const response = await api.get('/products/changes', { params: { since, filial_id: filialId } });
+    return response.data;
+  },
 };
 
 // Customers API
@@ -101,6 +130,11 @@ export const customersAPI = {
     const response = await api.get(`/customers/${id}/sales`);
     return response.data;
   },
+  // Typeahead: prefixo do nome (sem acento) ou dos dígitos do CPF/telefone
+  search: async (q, filialId, limit = 10) => {
+    const response = await api.get('/customers/busca', { params: { q, filial_id: filialId, limit } });
+    return response.data;
+  },
   create: async (customer) => {
     const response = await api.post('/customers', customer);
     return response.data;
@@ -113,6 +147,11 @@ export const customersAPI = {
     const response = await api.delete(`/customers/${id}`);
     return response.data;
   },
+  // Alterações desde o cursor (itens, removidos, cursor, tem_mais) para manter a réplica local
+  changes: async (since = '0', filialId) => {
+    const response = await api.get('/customers/changes', { params: { since, filial_id: filialId } });
+    return response.data;
+  },
 };
 
 // Sales API
@@ -126,7 +165,12 @@ export const salesAPI = {
     return response.data;
   },
   create: async (sale) => {
-    const response = await api.post('/sales', sale);
+    const response = await postIdempotente('/sales', sale);
+    return response.data;
+  },
+  // Envia em ordem as vendas feitas offline (cada uma com client_id gerado no caixa)
+  sync: async (vendas) => {
+    const response = await api.post('/sales/sync', { vendas });
     return response.data;
   },
 };
@@ -209,9 +253,15 @@ export const storeCreditsAPI = {
     return response.data;
   },
   create: async (credit) => {
-    const response = await api.post('/store-credits', credit);
+    const response = await postIdempotente('/store-credits', credit);
     return response.data;
   },
 };
 
+// URL do canal de eventos (SSE). O EventSource não envia headers, então o token vai na query.
+export const eventosURL = (filialId) => {
+  const token = localStorage.getItem('token') || '';
+  return `${API_BASE}/eventos?filial_id=${encodeURIComponent(filialId)}&token=${encodeURIComponent(token)}`;
+};
+
 export default api;
@@ -0,0 +1,89 @@
+// Aplica ao resumo de /fechamento-caixa/hoje os eventos da filial, com a mesma regra do
+// backend: estornadas e trocas ficam fora dos totais e a venda Misto soma por forma de
+// pagamento. Devolve null quando o evento não traz o suficiente (movimento alterado,
+// remoção de um movimento que não está na lista) e o resumo precisa ser recarregado.
+
+const CAMPO_FORMA = { Dinheiro: 'total_dinheiro', Pix: 'total_pix', Cartao: 'total_cartao', Credito: 'total_credito' };
+const CAMPO_MOVIMENTO = {
+  sangria: 'total_sangrias',
+  retirada_gerencia: 'total_retiradas_gerencia',
+  suprimento: 'total_suprimentos',
+};
+
+function somarVenda(resumo, venda, sinal) {
+  if (venda.is_troca) return resumo;
+  const novo = { ...resumo, num_vendas: (resumo.num_vendas || 0) + sinal };
+
+  const partes = venda.modalidade_pagamento === 'Misto'
+    ? (venda.pagamentos || []).map((p) => [p.modalidade, p.valor])
+    : [[venda.modalidade_pagamento, venda.total]];
+  partes.forEach(([forma, valor]) => {
+    const campo = CAMPO_FORMA[forma];
+    if (!campo) return;
+    novo[campo] = (novo[campo] || 0) + sinal * valor;
+    novo.total_geral = (novo.total_geral || 0) + sinal * valor;
+  });
+
+  const vendedoras = [...(resumo.vendas_por_vendedora || [])];
+  const idx = vendedoras.findIndex((v) => v.nome === venda.vendedor);
+  if (idx >= 0) {
+    const v = vendedoras[idx];
+    vendedoras[idx] = { ...v, total: v.total + sinal * venda.total, qtd: v.qtd + sinal };
+  } else if (sinal > 0) {
+    vendedoras.push({ nome: venda.vendedor, total: venda.total, qtd: 1 });
+  }
+  novo.vendas_por_vendedora = vendedoras;
+  return novo;
+}
+
+function aplicarVendaCriada(resumo, venda) {
+  const vendas = resumo.lista_vendas || [];
+  // Venda de outro dia (sincronização offline atrasada) ou já recebida
+  if (!String(venda.data || '').startsWith(resumo.business_date) || vendas.some((s) => s.id === venda.id)) {
+    return resumo;
+  }
+  const lista = [venda, ...vendas].sort((a, b) => String(b.data).localeCompare(String(a.data)));
+  return { ...somarVenda(resumo, venda, 1), lista_vendas: lista };
+}
+
+function aplicarVendaEstornada(resumo, venda) {
+  const atual = (resumo.lista_vendas || []).find((s) => s.id === venda.id);
+  if (!atual || atual.estornada) return resumo;
+  return {
+    ...somarVenda(resumo, atual, -1),
+    lista_vendas: resumo.lista_vendas.map((s) => (s.id === venda.id ? { ...s, estornada: true } : s)),
+  };
+}
+
+function aplicarMovimento(resumo, dados) {
+  const movimentos = resumo.lista_movimentos || [];
+  if (dados.acao === 'criado' && dados.movimento) {
+    const mov = dados.movimento;
+    if (movimentos.some((m) => m.id === mov.id)) return resumo;
+    const campo = CAMPO_MOVIMENTO[mov.tipo];
+    return {
+      ...resumo,
+      ...(campo ? { [campo]: (resumo[campo] || 0) + mov.valor } : {}),
+      lista_movimentos: [mov, ...movimentos],
+    };
+  }
+  if (dados.acao === 'removido' && (dados.id || dados.ids)) {
+    const ids = dados.ids || [dados.id];
+    const removidos = movimentos.filter((m) => ids.includes(m.id));
+    if (removidos.length !== ids.length) return null;
+    const novo = { ...resumo, lista_movimentos: movimentos.filter((m) => !ids.includes(m.id)) };
+    removidos.forEach((m) => {
+      const campo = CAMPO_MOVIMENTO[m.tipo];
+      if (campo) novo[campo] = (novo[campo] || 0) - m.valor;
+    });
+    return novo;
+  }
+  return null;
+}
+
+export function aplicarEventoResumo(resumo, tipo, dados) {
+  if (tipo === 'venda_criada') return aplicarVendaCriada(resumo, dados);
+  if (tipo === 'venda_estornada') return aplicarVendaEstornada(resumo, dados);
+  if (tipo === 'caixa_movimento') return aplicarMovimento(resumo, dados);
+  return null;
+}
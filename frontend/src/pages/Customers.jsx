@@ -10,13 +10,14 @@ import { formatCurrency } from '@/lib/utils';
 import { useToast } from '@/components/ui/use-toast';
 import { useFilial } from '@/context/FilialContext';
 import { Plus, Edit, Trash2, Search, User, History, DollarSign, ShoppingBag, AlertTriangle, Eraser } from 'lucide-react';
-import api from '@/lib/api';
+import api, { postIdempotente } from '@/lib/api';
+import { usePaginaServidor } from '@/hooks/usePaginaServidor';
+import { useVirtualRows } from '@/hooks/useVirtualRows';
+
+const ALTURA_LINHA = 69;
 
 export default function Customers() {
-  const [customers, setCustomers] = useState([]);
-  const [filteredCustomers, setFilteredCustomers] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
-  const [loading, setLoading] = useState(true);
   
   // Dialogs States
   const [dialogOpen, setDialogOpen] = useState(false);
@@ -54,39 +55,29 @@ export default function Customers() {
   // Configuração de dias para alerta
   const DIAS_PARA_EXPIRAR = 30;
 
+  // Busca e paginação no servidor: a tela só guarda as páginas já roladas
+  const {
+    itens: customers, primeira, carregando, erro, carregarMais, recarregar: loadCustomers,
+  } = usePaginaServidor(
+    '/customers/pagina',
+    { filial_id: selectedFilial?.id, q: searchTerm.trim() || undefined },
+    { ativo: !!selectedFilial }
+  );
+  const janela = useVirtualRows(customers.length, { alturaLinha: ALTURA_LINHA });
+
   useEffect(() => {
-    if (selectedFilial) {
-      loadCustomers();
-    }
-  }, [selectedFilial]);
+    if (janela.pertoDoFim) carregarMais();
+  }, [janela.pertoDoFim, carregarMais]);
 
   useEffect(() => {
-    const filtered = customers.filter(
-      (c) =>
-        c.nome.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        (c.telefone && c.telefone.includes(searchTerm)) ||
-        (c.cpf && c.cpf.includes(searchTerm))
-    );
-    setFilteredCustomers(filtered);
-  }, [searchTerm, customers]);
-
-  const loadCustomers = async () => {
-    if (!selectedFilial) return;
-    
-    try {
-      const response = await api.get(`/customers?filial_id=${selectedFilial.id}`);
-      setCustomers(response.data);
-      setFilteredCustomers(response.data);
-    } catch (error) {
+    if (erro) {
       toast({
         variant: 'destructive',
         title: 'Erro',
         description: 'Não foi possível carregar os clientes',
       });
-    } finally {
-      setLoading(false);
     }
-  };
+  }, [erro]);
 
   // Função para verificar se o crédito está "vencido" para alerta
   const checkCreditExpiration = (customer) => {
@@ -219,7 +210,7 @@ export default function Customers() {
 
     try {
       const user = JSON.parse(localStorage.getItem('user') || '{}');
-      await api.post(`/customers/${selectedCustomerPagamento.id}/pagar-saldo`, {
+      await postIdempotente(`/customers/${selectedCustomerPagamento.id}/pagar-saldo`, {
         customer_id: selectedCustomerPagamento.id,
         customer_nome: selectedCustomerPagamento.nome,
         valor: valor,
@@ -275,10 +266,6 @@ export default function Customers() {
     }
   };
 
-  if (loading) {
-    return <div className="flex justify-center items-center h-96">Carregando...</div>;
-  }
-
   return (
     <div className="space-y-6" data-testid="customers-page">
       {/* Header */}
@@ -312,9 +299,14 @@ export default function Customers() {
       {/* Customers Table */}
       <Card>
         <CardHeader>
-          <CardTitle>Lista de Clientes ({filteredCustomers.length})</CardTitle>
+          <CardTitle>Lista de Clientes ({primeira.total ?? customers.length})</CardTitle>
         </CardHeader>
         <CardContent>
+          <div
+            className="overflow-y-auto"
+            style={{ maxHeight: janela.alturaVisivel }}
+            onScroll={janela.onScroll}
+          >
           <Table>
             <TableHeader>
               <TableRow>
@@ -327,11 +319,12 @@ export default function Customers() {
               </TableRow>
             </TableHeader>
             <TableBody>
-              {filteredCustomers.map((customer) => {
+              {janela.espacoAntes > 0 && <tr style={{ height: janela.espacoAntes }} />}
+              {customers.slice(janela.inicio, janela.fim).map((customer) => {
                 const isCreditExpired = checkCreditExpiration(customer);
                 
                 return (
-                  <TableRow key={customer.id} data-testid={`customer-row-${customer.nome}`}>
+                  <TableRow key={customer.id} data-testid={`customer-row-${customer.nome}`} style={{ height: ALTURA_LINHA }}>
                     <TableCell>
                       <div className="flex items-center gap-2">
                         <div className="w-8 h-8 bg-indigo-100 rounded-full flex items-center justify-center">
@@ -424,11 +417,13 @@ export default function Customers() {
                   </TableRow>
                 );
               })}
+              {janela.espacoDepois > 0 && <tr style={{ height: janela.espacoDepois }} />}
             </TableBody>
           </Table>
-          {filteredCustomers.length === 0 && (
+          </div>
+          {customers.length === 0 && (
             <div className="text-center py-12 text-gray-500">
-              Nenhum cliente encontrado
+              {carregando ? 'Carregando...' : 'Nenhum cliente encontrado'}
             </div>
           )}
         </CardContent>
@@ -6,6 +6,7 @@ import { useFilial } from '@/context/FilialContext';
 import { Package, TrendingUp, Users, ShoppingCart, Target, Award } from 'lucide-react';
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, PieChart, Pie, Cell } from 'recharts';
 import api from '@/lib/api';
+import { useEventosFilial } from '@/hooks/useEventosFilial';
 
 const COLORS = ['#6366f1', '#8b5cf6', '#ec4899', '#f59e0b', '#10b981'];
 
@@ -25,6 +26,46 @@ export default function Dashboard() {
     }
   }, [selectedFilial]);
 
+  // Vendas e estornos da filial entram nos cards do dia e no ranking do mês a partir do
+  // próprio evento, sem recarregar os relatórios (trocas não contam, como no backend)
+  useEventosFilial(selectedFilial?.id, ['venda_criada', 'venda_estornada'], (tipo, dados) => {
+    if (tipo === 'resync') {
+      loadDashboardData();
+      return;
+    }
+    if (dados.is_troca) return;
+    const sinal = tipo === 'venda_criada' ? 1 : -1;
+    const dataVenda = String(dados.data || '');
+    const hoje = new Date().toLocaleDateString('sv-SE');
+    const mes = `${currentYear}-${String(currentMonth).padStart(2, '0')}`;
+
+    if (dataVenda.startsWith(hoje)) {
+      setStats((atual) => atual && {
+        ...atual,
+        sales_today: atual.sales_today + sinal,
+        revenue_today: atual.revenue_today + sinal * dados.total,
+      });
+    }
+    if (dataVenda.startsWith(mes)) {
+      setSalesByVendor((atual) => {
+        const pecas = (dados.items || []).length;
+        if (!atual.some((v) => v._id === dados.vendedor)) {
+          return sinal > 0
+            ? [...atual, { _id: dados.vendedor, total_vendas: dados.total, num_vendas: 1, total_pecas: pecas }]
+            : atual;
+        }
+        return atual
+          .map((v) => (v._id === dados.vendedor ? {
+            ...v,
+            total_vendas: v.total_vendas + sinal * dados.total,
+            num_vendas: v.num_vendas + sinal,
+            total_pecas: v.total_pecas + sinal * pecas,
+          } : v))
+          .sort((a, b) => b.total_vendas - a.total_vendas);
+      });
+    }
+  });
+
   const loadDashboardData = async () => {
     if (!selectedFilial) return;
     
@@ -1,4 +1,4 @@
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -8,7 +8,9 @@ import { useFilial } from '@/context/FilialContext';
 import { formatCurrency, formatDate } from '@/lib/utils';
 import { useToast } from '@/components/ui/use-toast';
 import { DollarSign, CreditCard, Smartphone, Wallet, Save, History, MinusCircle, PlusCircle, ArrowUpRight, AlertTriangle, Lock, Unlock, Trash2, ShoppingBag, XCircle, Layers, RefreshCw } from 'lucide-react';
-import api from '@/lib/api';
+import api, { postIdempotente } from '@/lib/api';
+import { useEventosFilial } from '@/hooks/useEventosFilial';
+import { aplicarEventoResumo } from '@/lib/resumoCaixa';
 
 export default function FechamentoCaixa() {
   const [statusCaixa, setStatusCaixa] = useState('nao_iniciado');
@@ -43,9 +45,28 @@ export default function FechamentoCaixa() {
     }
   }, [selectedFilial]);
 
-  const loadResumo = async () => {
+  // Vendas, estornos e movimentos de outros caixas da filial entram no resumo em tempo
+  // real a partir do próprio evento; só recarrega quando o evento não basta (ou no resync)
+  const resumoRef = useRef(null);
+  resumoRef.current = resumo;
+  useEventosFilial(
+    selectedFilial?.id,
+    ['venda_criada', 'venda_estornada', 'caixa_movimento'],
+    (tipo, dados) => {
+      if (!resumoRef.current) return;
+      const novo = tipo === 'resync' ? null : aplicarEventoResumo(resumoRef.current, tipo, dados);
+      if (novo === null) {
+        loadResumo(true);
+      } else if (novo !== resumoRef.current) {
+        resumoRef.current = novo;
+        setResumo(novo);
+      }
+    }
+  );
+
+  const loadResumo = async (silencioso = false) => {
     if (!selectedFilial) return;
-    setLoading(true);
+    if (!silencioso) setLoading(true);
     try {
       const response = await api.get(`/fechamento-caixa/hoje?filial_id=${selectedFilial.id}`);
       setResumo(response.data);
@@ -104,7 +125,7 @@ export default function FechamentoCaixa() {
     const obsFinal = movimentoData.observacao || (tipoMovimento === 'retirada_gerencia' ? 'Retirada Gerência' : '');
 
     try {
-      await api.post('/caixa/movimento', {
+      await postIdempotente('/caixa/movimento', {
         filial_id: selectedFilial.id,
         usuario: user.full_name,
         tipo: tipoMovimento,
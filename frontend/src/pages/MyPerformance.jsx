@@ -49,25 +49,10 @@ export default function MyPerformance() {
     );
   }
 
-  // Calcular comissão base
-  const totalVendas = performance.vendas_realizadas || performance.total_vendas || 0;
-  const comissaoBase = (totalVendas * comissaoConfig.percentual_comissao) / 100;
-
-  // Calcular bônus baseado na configuração (maior faixa atingida)
-  const meta = performance.meta_vendas || performance.goal || 0;
-  const percentualAtingido = meta > 0 ? (totalVendas / meta) * 100 : 0;
-  
-  let bonusAtingido = 0;
-  const sortedTiers = [...comissaoConfig.bonus_tiers].sort((a, b) => b.percentual_meta - a.percentual_meta);
-  
-  for (const tier of sortedTiers) {
-    if (percentualAtingido >= tier.percentual_meta) {
-      bonusAtingido = tier.valor_bonus;
-      break;
-    }
-  }
-
-  const totalGanhos = comissaoBase + bonusAtingido;
+  // Comissão e bônus (maior faixa atingida) calculados pelo servidor com a configuração da filial
+  const percentualAtingido = performance.percentual_atingido || 0;
+  const bonusAtingido = performance.bonus_valor || 0;
+  const totalGanhos = performance.comissao_total || 0;
 
   return (
     <div className="space-y-6" data-testid="performance-page">
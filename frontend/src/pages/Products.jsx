@@ -11,13 +11,15 @@ import { useToast } from '@/components/ui/use-toast';
 import { useFilial } from '@/context/FilialContext';
 import { Plus, Edit, Trash2, Search, Barcode, Upload, Download, CheckCircle, AlertCircle, Tag } from 'lucide-react'; // Adicionei Tag aqui
 import api from '@/lib/api';
+import { usePaginaServidor } from '@/hooks/usePaginaServidor';
+import { useVirtualRows } from '@/hooks/useVirtualRows';
+import { useMediaQuery } from '@/hooks/useMediaQuery';
 import * as XLSX from 'xlsx';
 
+const ALTURA_LINHA = 57;
+
 export default function Products() {
-  const [products, setProducts] = useState([]);
-  const [filteredProducts, setFilteredProducts] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
-  const [loading, setLoading] = useState(true);
   const [dialogOpen, setDialogOpen] = useState(false);
   const [importDialogOpen, setImportDialogOpen] = useState(false);
   const [importing, setImporting] = useState(false);
@@ -37,39 +39,31 @@ export default function Products() {
   const canEdit = user.role === 'admin' || user.role === 'gerente';
   const fileInputRef = useRef(null);
 
+  // Busca e paginação no servidor: a tela só guarda as páginas já roladas
+  const {
+    itens: products, primeira, temMais, carregando, erro, carregarMais, recarregar: loadProducts,
+  } = usePaginaServidor(
+    '/products/pagina',
+    { filial_id: selectedFilial?.id, q: searchTerm.trim() || undefined },
+    { ativo: !!selectedFilial }
+  );
+  const janela = useVirtualRows(products.length, { alturaLinha: ALTURA_LINHA });
+  // Um layout por vez: cards no celular, tabela virtualizada no desktop
+  const desktop = useMediaQuery('(min-width: 768px)');
+
   useEffect(() => {
-    if (selectedFilial) {
-      loadProducts();
-    }
-  }, [selectedFilial]);
+    if (desktop && janela.pertoDoFim) carregarMais();
+  }, [desktop, janela.pertoDoFim, carregarMais]);
 
   useEffect(() => {
-    const filtered = products.filter(
-      (p) =>
-        p.descricao.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        p.codigo.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        p.categoria.toLowerCase().includes(searchTerm.toLowerCase())
-    );
-    setFilteredProducts(filtered);
-  }, [searchTerm, products]);
-
-  const loadProducts = async () => {
-    if (!selectedFilial) return;
-    
-    try {
-      const response = await api.get(`/products?filial_id=${selectedFilial.id}&limit=10000`);
-      setProducts(response.data);
-      setFilteredProducts(response.data);
-    } catch (error) {
+    if (erro) {
       toast({
         variant: 'destructive',
         title: 'Erro',
         description: 'Não foi possível carregar os produtos',
       });
-    } finally {
-      setLoading(false);
     }
-  };
+  }, [erro]);
 
   const handleOpenDialog = (product = null) => {
     if (product) {
@@ -166,8 +160,16 @@ export default function Products() {
 
   const exportProducts = async () => {
     try {
-      const response = await api.get(`/products?filial_id=${selectedFilial.id}&limit=10000`);
-      const allProducts = response.data;
+      // Percorre todas as páginas (o catálogo inteiro não cabe numa resposta)
+      const allProducts = [];
+      let cursor = null;
+      do {
+        const response = await api.get('/products/pagina', {
+          params: { filial_id: selectedFilial.id, limit: 500, ...(cursor ? { cursor } : {}) },
+        });
+        allProducts.push(...response.data.itens);
+        cursor = response.data.cursor;
+      } while (cursor);
       
       if (allProducts.length === 0) {
         toast({
@@ -269,29 +271,21 @@ export default function Products() {
             filial_id: selectedFilial.id
           };
 
-          let existingProduct = null;
-          try {
-            const response = await api.get(`/products/barcode/${productData.codigo}?filial_id=${selectedFilial.id}`);
-            existingProduct = response.data;
-          } catch (error) {
-            existingProduct = null;
-          }
-
-          if (existingProduct) {
-            await api.put(`/products/${existingProduct.id}`, productData);
-            results.updated++;
+          // Um PUT por linha: o backend cria ou atualiza pelo código dentro da filial
+          const salvo = await productsAPI.upsert(productData);
+          if (salvo.criado) {
+            results.created++;
             results.details.push({
               codigo: productData.codigo,
-              status: 'atualizado',
-              message: 'Produto atualizado com sucesso'
+              status: 'criado',
+              message: 'Produto criado com sucesso'
             });
           } else {
-            await api.post('/products', productData);
-            results.created++;
+            results.updated++;
             results.details.push({
               codigo: productData.codigo,
-              status: 'criado',
-              message: 'Produto criado com sucesso'
+              status: 'atualizado',
+              message: 'Produto atualizado com sucesso'
             });
           }
 
@@ -327,18 +321,13 @@ export default function Products() {
     }
   };
 
-  if (loading) {
-    return <div className="flex justify-center items-center h-96">Carregando...</div>;
-  }
-
-  // --- NOVA FUNCIONALIDADE: CALCULAR ÚLTIMO CÓDIGO ---
-  const lastCode = products.reduce((max, p) => {
-    // Tenta converter o código para número
-    const num = parseInt(p.codigo, 10);
-    // Se for número válido e maior que o máximo atual, atualiza
-    return !isNaN(num) && num > max ? num : max;
-  }, 0);
-  // ---------------------------------------------------
+  // Maior código numérico da filial, calculado no servidor só na primeira página sem
+  // busca; durante a busca fica o último valor recebido
+  const [lastCode, setLastCode] = useState(0);
+  useEffect(() => {
+    if (primeira.ultimo_codigo !== undefined) setLastCode(primeira.ultimo_codigo || 0);
+  }, [primeira.ultimo_codigo]);
+  const totalProdutos = primeira.total ?? products.length;
 
   return (
     <div className="space-y-6" data-testid="products-page">
@@ -398,8 +387,9 @@ export default function Products() {
         </CardContent>
       </Card>
 
-      <div className="grid grid-cols-1 gap-4 md:hidden">
-        {filteredProducts.map((product) => (
+      {!desktop && (
+      <div className="grid grid-cols-1 gap-4">
+        {products.map((product) => (
           <Card key={product.id} className="shadow-sm">
             <CardContent className="pt-4 pb-4">
               <div className="flex justify-between items-start mb-2">
@@ -447,18 +437,30 @@ export default function Products() {
             </CardContent>
           </Card>
         ))}
-         {filteredProducts.length === 0 && (
+         {products.length === 0 && (
             <div className="text-center py-8 text-gray-500">
-              Nenhum produto encontrado
+              {carregando ? 'Carregando...' : 'Nenhum produto encontrado'}
             </div>
           )}
+          {temMais && (
+            <Button variant="outline" onClick={carregarMais} disabled={carregando}>
+              {carregando ? 'Carregando...' : `Carregar mais (${products.length} de ${totalProdutos})`}
+            </Button>
+          )}
       </div>
+      )}
 
-      <Card className="hidden md:block">
+      {desktop && (
+      <Card>
         <CardHeader>
-          <CardTitle>Lista de Produtos ({filteredProducts.length})</CardTitle>
+          <CardTitle>Lista de Produtos ({totalProdutos})</CardTitle>
         </CardHeader>
         <CardContent>
+          <div
+            className="overflow-y-auto"
+            style={{ maxHeight: janela.alturaVisivel }}
+            onScroll={janela.onScroll}
+          >
           <Table>
             <TableHeader>
               <TableRow>
@@ -472,8 +474,9 @@ export default function Products() {
               </TableRow>
             </TableHeader>
             <TableBody>
-              {filteredProducts.map((product) => (
-                <TableRow key={product.id} data-testid={`product-row-${product.codigo}`}>
+              {janela.espacoAntes > 0 && <tr style={{ height: janela.espacoAntes }} />}
+              {products.slice(janela.inicio, janela.fim).map((product) => (
+                <TableRow key={product.id} data-testid={`product-row-${product.codigo}`} style={{ height: ALTURA_LINHA }}>
                   <TableCell className="font-mono">
                     <div className="flex items-center gap-2">
                       <Barcode className="w-4 h-4 text-gray-400" />
@@ -523,15 +526,18 @@ export default function Products() {
                   </TableCell>
                 </TableRow>
               ))}
+              {janela.espacoDepois > 0 && <tr style={{ height: janela.espacoDepois }} />}
             </TableBody>
           </Table>
-          {filteredProducts.length === 0 && (
+          </div>
+          {products.length === 0 && (
             <div className="text-center py-12 text-gray-500">
-              Nenhum produto encontrado
+              {carregando ? 'Carregando...' : 'Nenhum produto encontrado'}
             </div>
           )}
         </CardContent>
       </Card>
+      )}
 
       <Dialog open={dialogOpen} onOpenChange={setDialogOpen}>
         <DialogContent className="sm:max-w-md w-[95vw] max-h-[90vh] overflow-y-auto">
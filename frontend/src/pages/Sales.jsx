@@ -6,14 +6,15 @@ import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogFooter } from '@/components/ui/dialog';
 import { customersAPI, salesAPI, storeCreditsAPI } from '@/lib/api';
+import BuscaCliente from '@/components/BuscaCliente';
 import { formatCurrency } from '@/lib/utils';
 import { useToast } from '@/components/ui/use-toast';
 import { useFilial } from '@/context/FilialContext';
 import { ShoppingCart, Plus, Minus, Trash2, DollarSign, CreditCard, Smartphone, Gift, RefreshCw, User, CalendarIcon } from 'lucide-react';
 import api from '@/lib/api';
+import { useEventosFilial } from '@/hooks/useEventosFilial';
 
 export default function SalesAdvanced() {
-  const [customers, setCustomers] = useState([]);
   const [vendedores, setVendedores] = useState([]);
   const [selectedVendedor, setSelectedVendedor] = useState('');
   const [cart, setCart] = useState([]);
@@ -38,6 +39,7 @@ export default function SalesAdvanced() {
   const [discount, setDiscount] = useState(0);
   const [selectedCustomer, setSelectedCustomer] = useState('none');
   const [customerData, setCustomerData] = useState(null);
+  const [clienteBusca, setClienteBusca] = useState(null);
   const [useStoreCredit, setUseStoreCredit] = useState(false);
   const [storeCreditAmount, setStoreCreditAmount] = useState(0);
   const [isOnline, setIsOnline] = useState(false);
@@ -53,7 +55,6 @@ export default function SalesAdvanced() {
 
   useEffect(() => {
     if (selectedFilial) {
-      loadCustomers();
       loadVendedores();
     }
   }, [selectedFilial]);
@@ -76,6 +77,19 @@ export default function SalesAdvanced() {
     }
   }, [selectedCustomer]);
 
+  // Estoque alterado por outras vendas, estornos e balanços da filial: atualiza a busca
+  // aberta e o carrinho. No resync não há o que reaplicar; a próxima busca traz o atual.
+  useEventosFilial(selectedFilial?.id, ['estoque_alterado'], (tipo, dados) => {
+    if (tipo !== 'estoque_alterado') return;
+    const { product_id: productId, quantidade } = dados;
+    setSearchResults((atual) => (atual.some((p) => p.id === productId)
+      ? atual.map((p) => (p.id === productId ? { ...p, quantidade } : p))
+      : atual));
+    setCart((atual) => (atual.some((item) => item.product_id === productId)
+      ? atual.map((item) => (item.product_id === productId ? { ...item, estoque: quantidade } : item))
+      : atual));
+  });
+
   const loadVendedores = async () => {
     try {
       const response = await api.get('/users');
@@ -89,16 +103,6 @@ export default function SalesAdvanced() {
     }
   };
 
-  const loadCustomers = async () => {
-    if (!selectedFilial) return;
-    try {
-      const response = await api.get(`/customers?filial_id=${selectedFilial.id}`);
-      setCustomers(response.data);
-    } catch (error) {
-      console.error('Erro ao carregar clientes:', error);
-    }
-  };
-
   const loadCustomerData = async () => {
     try {
       const data = await customersAPI.getById(selectedCustomer);
@@ -198,6 +202,7 @@ export default function SalesAdvanced() {
         codigo: product.codigo,
         descricao: product.descricao,
         quantidade: 1,
+        estoque: product.quantidade,
         preco_venda: product.preco_venda,
         preco_custo: product.preco_custo,
         subtotal: product.preco_venda,
@@ -389,7 +394,7 @@ export default function SalesAdvanced() {
                         {searchResults.map((product) => (
                           <div key={product.id} onMouseDown={(e) => { e.preventDefault(); handleSelectProduct(product); }} className="p-3 hover:bg-gray-100 cursor-pointer border-b last:border-b-0">
                             <div className="flex justify-between items-start">
-                              <div><p className="font-medium text-gray-900">{product.descricao}</p><p className="text-sm text-gray-500">{product.codigo}</p></div>
+                              <div><p className="font-medium text-gray-900">{product.descricao}</p><p className="text-sm text-gray-500">{product.codigo} · Estoque: {product.quantidade}</p></div>
                               <p className="font-bold text-indigo-600">{formatCurrency(product.preco_venda)}</p>
                             </div>
                           </div>
@@ -411,7 +416,7 @@ export default function SalesAdvanced() {
                 <div className="space-y-3">
                   {cart.map((item) => (
                     <div key={item.cart_item_id || item.product_id} className="flex items-center gap-4 p-4 bg-gray-50 rounded-lg">
-                      <div className="flex-1"><p className="font-medium text-gray-900">{item.descricao}</p><p className="text-sm text-gray-500">Código: {item.codigo}</p><p className="text-sm font-medium text-indigo-600">{formatCurrency(item.preco_venda)} cada</p></div>
+                      <div className="flex-1"><p className="font-medium text-gray-900">{item.descricao}</p><p className="text-sm text-gray-500">Código: {item.codigo}</p>{item.estoque !== undefined && !isTroca && <p className={`text-xs ${item.quantidade > item.estoque ? 'text-red-600 font-medium' : 'text-gray-500'}`}>Estoque: {item.estoque}</p>}<p className="text-sm font-medium text-indigo-600">{formatCurrency(item.preco_venda)} cada</p></div>
                       <div className="flex items-center gap-2">
                         <Button variant="outline" size="icon" onClick={() => updateQuantity(item.cart_item_id || item.product_id, item.quantidade - 1, !!item.cart_item_id)}><Minus className="w-4 h-4" /></Button>
                         <span className="w-12 text-center font-medium">{item.quantidade}</span>
@@ -452,13 +457,11 @@ export default function SalesAdvanced() {
 
               <div className="space-y-2">
                 <Label>Cliente (Opcional)</Label>
-                <Select value={selectedCustomer} onValueChange={setSelectedCustomer}>
-                  <SelectTrigger><SelectValue placeholder="Selecione um cliente" /></SelectTrigger>
-                  <SelectContent>
-                    <SelectItem value="none">Nenhum</SelectItem>
-                    {customers.map((customer) => (<SelectItem key={customer.id} value={customer.id}>{customer.nome} {customer.cpf && `- ${customer.cpf}`}</SelectItem>))}
-                  </SelectContent>
-                </Select>
+                <BuscaCliente
+                  filialId={selectedFilial?.id}
+                  cliente={selectedCustomer !== 'none' ? (customerData || clienteBusca) : null}
+                  onChange={(c) => { setClienteBusca(c); setSelectedCustomer(c ? c.id : 'none'); }}
+                />
               </div>
 
               {/* CHECKBOX DE TROCA MOVIDO PARA CÁ */}
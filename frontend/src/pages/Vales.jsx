@@ -12,6 +12,8 @@ import { formatCurrency, formatDate } from '@/lib/utils';
 import { Plus, DollarSign, Edit, Trash2, Filter, Calendar } from 'lucide-react';
 import api from '@/lib/api';
 
+const anos = Array.from({ length: 5 }, (_, i) => new Date().getFullYear() - i);
+
 export default function Vales() {
   const [vales, setVales] = useState([]);
   const [filteredVales, setFilteredVales] = useState([]);
@@ -64,24 +66,12 @@ export default function Vales() {
     if (!selectedFilial) return;
     
     try {
-      // Carregar vendedoras da filial atual
-      const usersResponse = await api.get('/users');
-      const vendedorasDaFilial = usersResponse.data.filter(
-        u => u.role === 'vendedora' && u.filial_id === selectedFilial.id && u.active
-      );
-      setVendedoras(vendedorasDaFilial);
-      
-      // Carregar todos os vales
-      const allVales = [];
-      for (const vendedora of vendedorasDaFilial) {
-        try {
-          const response = await api.get(`/vales/vendedora/${vendedora.id}`);
-          allVales.push(...response.data);
-        } catch (error) {
-          console.error(`Erro ao carregar vales de ${vendedora.full_name}:`, error);
-        }
-      }
-      setVales(allVales);
+      // Uma requisição: vendedoras da filial + vales agrupados (só os anos do filtro)
+      const response = await api.get('/vales', {
+        params: { filial_id: selectedFilial.id, ano_inicio: anos[anos.length - 1] },
+      });
+      setVendedoras(response.data.vendedoras.map(g => ({ id: g.vendedora_id, full_name: g.vendedora_nome })));
+      setVales(response.data.vendedoras.flatMap(g => g.vales));
     } catch (error) {
       toast({
         variant: 'destructive',
@@ -226,8 +216,6 @@ export default function Vales() {
     { value: 11, label: 'Novembro' }, { value: 12, label: 'Dezembro' },
   ];
 
-  const anos = Array.from({ length: 5 }, (_, i) => new Date().getFullYear() - i);
-
   return (
     <div className="space-y-6" data-testid="vales-page">
       <div className="flex justify-between items-center">
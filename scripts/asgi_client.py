@@ -0,0 +1,97 @@
+"""
+Cliente HTTP mínimo que chama um app ASGI em processo (sem rede, sem httpx).
+Usado pelo teste de carga e pelos testes de performance.
+"""
+import asyncio
+import json
+from urllib.parse import unquote, urlencode
+
+
+class ASGIResponse:
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = body
+
+    def json(self):
+        return json.loads(self.content) if self.content else None
+
+
+class ASGIClient:
+    def __init__(self, app, headers=None):
+        self.app = app
+        self.headers = dict(headers or {})
+
+    async def startup(self):
+        await self.app.router.startup()
+
+    async def shutdown(self):
+        await self.app.router.shutdown()
+
+    async def request(self, method, url, json_body=None, form=None, headers=None):
+        body = b""
+        todos_headers = {"host": "asgi-client", **self.headers, **(headers or {})}
+        if json_body is not None:
+            body = json.dumps(json_body, default=str).encode()
+            todos_headers["content-type"] = "application/json"
+        elif form is not None:
+            body = urlencode(form).encode()
+            todos_headers["content-type"] = "application/x-www-form-urlencoded"
+        if body:
+            todos_headers["content-length"] = str(len(body))
+
+        path, _, query = url.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method.upper(),
+            "scheme": "http",
+            "path": unquote(path),
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(k.lower().encode(), str(v).encode()) for k, v in todos_headers.items()],
+            "client": ("127.0.0.1", 0),
+            "server": ("asgi-client", 80),
+        }
+
+        corpo_enviado = False
+        resposta_completa = asyncio.Event()
+        status_code = 500
+        resp_headers = {}
+        partes = []
+
+        async def receive():
+            nonlocal corpo_enviado
+            if not corpo_enviado:
+                corpo_enviado = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await resposta_completa.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                for k, v in message.get("headers", []):
+                    resp_headers[k.decode().lower()] = v.decode()
+            elif message["type"] == "http.response.body":
+                partes.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    resposta_completa.set()
+
+        await self.app(scope, receive, send)
+        return ASGIResponse(status_code, resp_headers, b"".join(partes))
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, json_body=None, **kwargs):
+        return await self.request("POST", url, json_body=json_body, **kwargs)
+
+    async def put(self, url, json_body=None, **kwargs):
+        return await self.request("PUT", url, json_body=json_body, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
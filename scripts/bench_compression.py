@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Mede o ganho de banda/latência da compressão em payloads representativos
+(/fechamento-caixa/hoje com a lista do dia e /sales com filtro de data).
+
+Uso: python scripts/bench_compression.py [--vendas-dia 800] [--vendas-periodo 20000]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'backend'))
+
+from compression import brotli
+
+LINKS_MBPS = [2, 10, 50]
+
+
+def fake_sale(rng, dia):
+    n_items = rng.randint(1, 5)
+    items = []
+    for _ in range(n_items):
+        preco = round(rng.uniform(19.9, 299.9), 2)
+        qtd = rng.randint(1, 3)
+        codigo = str(rng.randint(10**11, 10**12))
+        items.append({
+            "product_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "codigo": codigo,
+            "descricao": rng.choice(["BLUSA", "CALCA", "VESTIDO", "SAIA", "SHORT"]) + f" {rng.choice(['P', 'M', 'G'])} {codigo[-4:]}",
+            "quantidade": qtd,
+            "preco_venda": preco,
+            "preco_custo": round(preco * 0.45, 2),
+            "subtotal": round(preco * qtd, 2),
+        })
+    total = round(sum(i["subtotal"] for i in items), 2)
+    modalidade = rng.choice(["Dinheiro", "Pix", "Cartao", "Credito", "Misto"])
+    pagamentos = []
+    if modalidade == "Misto":
+        parte = round(total * 0.4, 2)
+        pagamentos = [
+            {"modalidade": "Dinheiro", "valor": parte, "parcelas": 1},
+            {"modalidade": "Cartao", "valor": round(total - parte, 2), "parcelas": 2},
+        ]
+    data = dia + timedelta(seconds=rng.randint(9 * 3600, 21 * 3600))
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "items": items,
+        "total": total,
+        "modalidade_pagamento": modalidade,
+        "pagamentos": pagamentos,
+        "parcelas": 1,
+        "desconto": 0.0,
+        "vendedor": rng.choice(["Ana Paula", "Bruna", "Carla", "Daniela"]),
+        "vendedor_id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "customer_id": None,
+        "observacoes": None,
+        "online": False,
+        "encomenda": False,
+        "is_troca": False,
+        "filial_id": "filial-benchmark",
+        "data": data.isoformat(),
+        "hora": data.strftime("%H:%M:%S"),
+        "estornada": False,
+        "estornada_em": None,
+        "estornada_por": None,
+    }
+
+
+def payload_fechamento(rng, n):
+    dia = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    vendas = [fake_sale(rng, dia) for _ in range(n)]
+    return {
+        "status_caixa": "aberto",
+        "saldo_inicial": 200.0,
+        "lista_movimentos": [],
+        "lista_vendas": vendas,
+        "total_geral": sum(v["total"] for v in vendas),
+        "num_vendas": n,
+        "pagamentos_divida": [],
+    }
+
+
+def payload_sales(rng, n):
+    inicio = datetime.now(timezone.utc) - timedelta(days=30)
+    return [fake_sale(rng, inicio + timedelta(days=rng.randint(0, 29))) for _ in range(n)]
+
+
+def encode(payload):
+    # Mesmo formato do JSONResponse do Starlette
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def gzip_bytes(data, level):
+    obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return obj.compress(data) + obj.flush()
+
+
+def measure(nome, data):
+    codecs = [("identity", lambda d: d), ("gzip-1", lambda d: gzip_bytes(d, 1)), ("gzip-6", lambda d: gzip_bytes(d, 6))]
+    if brotli is not None:
+        codecs.append(("br-4", lambda d: brotli.compress(d, quality=4)))
+
+    print(f"\n{nome}: {len(data) / 1024:.0f} KiB sem compressão")
+    header = f"  {'codec':<9} {'KiB':>8} {'razão':>6} {'cpu ms':>7}"
+    header += "".join(f" {f'{m} Mbps ms':>12}" for m in LINKS_MBPS)
+    print(header)
+    for codec, fn in codecs:
+        t0 = time.perf_counter()
+        out = fn(data)
+        cpu_ms = (time.perf_counter() - t0) * 1000
+        linha = f"  {codec:<9} {len(out) / 1024:>8.0f} {len(data) / len(out):>6.1f} {cpu_ms:>7.1f}"
+        for mbps in LINKS_MBPS:
+            transfer_ms = len(out) * 8 / (mbps * 1_000_000) * 1000
+            linha += f" {cpu_ms + transfer_ms:>12.0f}"
+        print(linha)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vendas-dia", type=int, default=800)
+    parser.add_argument("--vendas-periodo", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    measure(f"/fechamento-caixa/hoje ({args.vendas_dia} vendas)", encode(payload_fechamento(rng, args.vendas_dia)))
+    measure(f"/sales com filtro de data ({args.vendas_periodo} vendas)", encode(payload_sales(rng, args.vendas_periodo)))
+    if brotli is None:
+        print("\n(brotli não instalado: pip install brotli para incluir 'br' na comparação)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Gerador determinístico de dados sintéticos para testes de escala multi-filial.
+
+Cria filiais, usuários por papel, produtos, clientes com saldo no fiado e
+crédito de loja, vendas (com Misto, trocas e estornos), aberturas/fechamentos
+de caixa, movimentos de caixa, pagamentos de saldo, vales e metas.
+Mesma --seed = mesmos dados. Escreve com insert_many em lotes, vários lotes
+em paralelo.
+
+Uso:
+  MONGO_URL=mongodb://localhost:27017 python scripts/generate_dataset.py \\
+      --db-name explotrack_scale --drop --filiais 5 --vendas 2000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from passlib.context import CryptContext
+
+load_dotenv(Path(__file__).parent.parent / 'backend' / '.env')
+
+BR_TZ = ZoneInfo("America/Sao_Paulo")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+CATEGORIAS = ["Blusas", "Calças", "Vestidos", "Saias", "Shorts", "Acessórios", "Calçados", "Moda Praia"]
+TAMANHOS = ["PP", "P", "M", "G", "GG", "U"]
+CORES = ["PRETO", "BRANCO", "AZUL", "VERDE", "ROSA", "BEGE", "VERMELHO", "ESTAMPADO"]
+NOMES = ["Ana", "Beatriz", "Camila", "Daniela", "Eduarda", "Fernanda", "Gabriela", "Helena", "Isabela",
+         "Juliana", "Larissa", "Mariana", "Natália", "Patrícia", "Renata", "Sabrina", "Tatiane", "Vanessa"]
+SOBRENOMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Costa", "Ferreira", "Almeida",
+              "Ribeiro", "Carvalho", "Gomes", "Martins", "Rocha", "Barbosa", "Araújo"]
+MODALIDADES = ["Dinheiro", "Pix", "Cartao", "Credito", "Misto"]
+PESOS_MODALIDADES = [25, 30, 30, 5, 10]
+
+
+class Gerador:
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def nome(self) -> str:
+        return f"{self.rng.choice(NOMES)} {self.rng.choice(SOBRENOMES)} {self.rng.choice(SOBRENOMES)}"
+
+    def cpf(self) -> str:
+        d = f"{self.rng.randint(0, 10**11 - 1):011d}"
+        return f"{d[:3]}.{d[3:6]}.{d[6:9]}-{d[9:]}"
+
+    def telefone(self) -> str:
+        return f"({self.rng.randint(11, 99)}) 9{self.rng.randint(1000, 9999)}-{self.rng.randint(1000, 9999)}"
+
+
+class Escritor:
+    """Agrupa documentos por coleção e grava lotes com até `paralelo` insert_many simultâneos."""
+
+    def __init__(self, db, tamanho_lote: int, paralelo: int):
+        self.db = db
+        self.tamanho_lote = tamanho_lote
+        self.semaforo = asyncio.Semaphore(paralelo)
+        self.buffers = {}
+        self.tarefas = set()
+        self.contagem = {}
+
+    async def adicionar(self, colecao: str, doc: dict):
+        buffer = self.buffers.setdefault(colecao, [])
+        buffer.append(doc)
+        if len(buffer) >= self.tamanho_lote:
+            self.buffers[colecao] = []
+            await self._enviar(colecao, buffer)
+
+    async def _enviar(self, colecao, docs):
+        # Espera uma vaga antes de criar a tarefa: limita também a memória em uso
+        await self.semaforo.acquire()
+        tarefa = asyncio.create_task(self._gravar(colecao, docs))
+        self.tarefas.add(tarefa)
+        tarefa.add_done_callback(self.tarefas.discard)
+
+    async def _gravar(self, colecao, docs):
+        try:
+            await self.db[colecao].insert_many(docs, ordered=False, bypass_document_validation=True)
+            self.contagem[colecao] = self.contagem.get(colecao, 0) + len(docs)
+        finally:
+            self.semaforo.release()
+
+    async def finalizar(self):
+        for colecao, buffer in self.buffers.items():
+            if buffer:
+                await self._enviar(colecao, buffer)
+        self.buffers = {}
+        if self.tarefas:
+            await asyncio.gather(*list(self.tarefas))
+
+
+def gerar_filiais(g: Gerador, n: int):
+    agora = datetime.now(timezone.utc)
+    return [{
+        "id": g.uuid(),
+        "nome": f"Loja {i + 1:02d}",
+        "endereco": f"Rua {g.rng.choice(SOBRENOMES)}, {g.rng.randint(1, 2000)} - Centro",
+        "telefone": g.telefone(),
+        "ativa": True,
+        "created_at": (agora - timedelta(days=720)).isoformat(),
+    } for i in range(n)]
+
+
+def gerar_usuarios(g: Gerador, filial: dict, idx: int, gerentes: int, vendedoras: int, senha_hash: str):
+    usuarios = []
+    for papel, quantidade in [("gerente", gerentes), ("vendedora", vendedoras)]:
+        for i in range(quantidade):
+            usuarios.append({
+                "id": g.uuid(),
+                "username": f"{papel}_{idx + 1:02d}_{i + 1:02d}",
+                "full_name": f"{g.nome()} ({papel[0].upper()}{idx + 1}{i + 1})",
+                "role": papel,
+                "active": True,
+                "hashed_password": senha_hash,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "meta_mensal": float(g.rng.choice([15000, 20000, 25000, 30000])) if papel == "vendedora" else 0.0,
+                "filial_id": filial["id"],
+                "filiais_acesso": [filial["id"]] if papel == "gerente" else [],
+            })
+    return usuarios
+
+
+def gerar_produto(g: Gerador, filial: dict, i: int):
+    preco = round(g.rng.uniform(19.9, 399.9), 2)
+    agora = datetime.now(timezone.utc).isoformat()
+    categoria = g.rng.choice(CATEGORIAS)
+    return {
+        "id": g.uuid(),
+        "codigo": f"789{g.rng.randint(0, 9)}{i:09d}",
+        "descricao": f"{categoria.upper()} {g.rng.choice(CORES)} {g.rng.choice(TAMANHOS)}",
+        "quantidade": g.rng.randint(0, 60),
+        "preco_custo": round(preco * g.rng.uniform(0.35, 0.55), 2),
+        "preco_venda": preco,
+        "categoria": categoria,
+        "filial_id": filial["id"],
+        "created_at": agora,
+        "updated_at": agora,
+    }
+
+
+def gerar_cliente(g: Gerador, filial: dict):
+    fiado = g.rng.random() < 0.3
+    credito = g.rng.random() < 0.15
+    ultimo_credito = datetime.now(timezone.utc) - timedelta(days=g.rng.randint(0, 365))
+    return {
+        "id": g.uuid(),
+        "nome": g.nome(),
+        "telefone": g.telefone(),
+        "cpf": g.cpf(),
+        "endereco": None,
+        "limite_credito": float(g.rng.choice([0, 300, 500, 1000])),
+        "saldo_devedor": round(g.rng.uniform(20, 900), 2) if fiado else 0.0,
+        "credito_loja": round(g.rng.uniform(10, 300), 2) if credito else 0.0,
+        "data_ultimo_credito": ultimo_credito.isoformat() if credito else None,
+        "filial_id": filial["id"],
+        "created_at": (datetime.now(timezone.utc) - timedelta(days=g.rng.randint(1, 720))).isoformat(),
+    }
+
+
+def gerar_venda(g: Gerador, filial: dict, vendedora: dict, produtos: list, clientes: list, dia: datetime):
+    itens = []
+    for produto in g.rng.sample(produtos, min(len(produtos), g.rng.choices([1, 2, 3, 4, 5], [40, 30, 15, 10, 5])[0])):
+        qtd = g.rng.choices([1, 2, 3], [80, 15, 5])[0]
+        itens.append({
+            "product_id": produto["id"],
+            "codigo": produto["codigo"],
+            "descricao": produto["descricao"],
+            "quantidade": qtd,
+            "preco_venda": produto["preco_venda"],
+            "preco_custo": produto["preco_custo"],
+            "subtotal": round(produto["preco_venda"] * qtd, 2),
+        })
+    total = round(sum(i["subtotal"] for i in itens), 2)
+    is_troca = g.rng.random() < 0.03
+    modalidade = "Dinheiro" if is_troca else g.rng.choices(MODALIDADES, PESOS_MODALIDADES)[0]
+
+    pagamentos = []
+    if modalidade == "Misto":
+        formas = g.rng.sample(["Dinheiro", "Pix", "Cartao", "Credito"], 2)
+        parte = round(total * g.rng.uniform(0.2, 0.8), 2)
+        pagamentos = [
+            {"modalidade": formas[0], "valor": parte, "parcelas": 1},
+            {"modalidade": formas[1], "valor": round(total - parte, 2), "parcelas": g.rng.choice([1, 2, 3])},
+        ]
+
+    customer_id = None
+    if clientes and (modalidade == "Credito" or g.rng.random() < 0.2):
+        customer_id = g.rng.choice(clientes)["id"]
+
+    data = dia.replace(hour=g.rng.randint(9, 20), minute=g.rng.randint(0, 59), second=g.rng.randint(0, 59))
+    venda = {
+        "id": g.uuid(),
+        "items": itens,
+        "total": total,
+        "modalidade_pagamento": modalidade,
+        "pagamentos": pagamentos,
+        "parcelas": pagamentos[1]["parcelas"] if pagamentos else 1,
+        "desconto": 0.0,
+        "vendedor": vendedora["full_name"],
+        "vendedor_id": vendedora["id"],
+        "customer_id": customer_id,
+        "observacoes": None,
+        "online": g.rng.random() < 0.05,
+        "encomenda": g.rng.random() < 0.02,
+        "is_troca": is_troca,
+        "filial_id": filial["id"],
+        "data": data.isoformat(),
+        "hora": data.strftime("%H:%M:%S"),
+        "estornada": False,
+        "estornada_em": None,
+        "estornada_por": None,
+    }
+    if not is_troca and g.rng.random() < 0.01:
+        estornada_em = (data + timedelta(minutes=g.rng.randint(5, 240))).astimezone(timezone.utc).isoformat()
+        venda.update({
+            "estornada": True,
+            "estornada_em": estornada_em,
+            "estornada_por": "gerente",
+            "motivo_estorno": "Cancelamento de venda",
+        })
+    return venda
+
+
+def gerar_log_estorno(g: Gerador, venda: dict):
+    return {
+        "id": g.uuid(),
+        "sale_id": venda["id"],
+        "vendedor": venda["vendedor"],
+        "vendedor_id": venda["vendedor_id"],
+        "valor_total": venda["total"],
+        "filial_id": venda["filial_id"],
+        "estornada_por": venda["estornada_por"],
+        "estornada_em": venda["estornada_em"],
+        "produtos_devolvidos": [{"produto": i["descricao"], "quantidade": i["quantidade"]} for i in venda["items"]],
+        "cliente_id": venda["customer_id"],
+        "cliente_atualizado": venda["modalidade_pagamento"] == "Credito",
+    }
+
+
+def gerar_dia_caixa(g: Gerador, filial: dict, gerente: dict, vendedoras: list, clientes: list, dia: datetime):
+    """Abertura/fechamento, movimentos e pagamentos de saldo de um dia de uma filial."""
+    docs = []
+    abertura = dia.replace(hour=9, minute=0, second=0).astimezone(timezone.utc)
+    movimentos = []
+    for _ in range(g.rng.randint(0, 4)):
+        tipo = g.rng.choices(["sangria", "suprimento", "retirada_gerencia"], [50, 20, 30])[0]
+        movimentos.append({
+            "id": g.uuid(),
+            "filial_id": filial["id"],
+            "usuario": g.rng.choice(vendedoras + [gerente])["full_name"],
+            "tipo": tipo,
+            "valor": round(g.rng.uniform(10, 800 if tipo == "retirada_gerencia" else 150), 2),
+            "observacao": {"sangria": "Lanche/limpeza", "suprimento": "Troco", "retirada_gerencia": "Recolhimento"}[tipo],
+            "data": (abertura + timedelta(minutes=g.rng.randint(30, 600))).isoformat(),
+        })
+    docs.extend(("caixa_movimentos", m) for m in movimentos)
+
+    if clientes:
+        for _ in range(g.rng.randint(0, 3)):
+            cliente = g.rng.choice(clientes)
+            vendedora = g.rng.choice(vendedoras)
+            docs.append(("pagamentos_saldo", {
+                "id": g.uuid(),
+                "customer_id": cliente["id"],
+                "customer_nome": cliente["nome"],
+                "valor": round(g.rng.uniform(20, 300), 2),
+                "forma_pagamento": g.rng.choice(["Dinheiro", "Pix", "Cartao"]),
+                "vendedora_id": vendedora["id"],
+                "vendedora_nome": vendedora["full_name"],
+                "observacoes": None,
+                "data": (abertura + timedelta(minutes=g.rng.randint(30, 600))).isoformat(),
+                "filial_id": filial["id"],
+            }))
+
+    def soma(tipo):
+        return round(sum(m["valor"] for m in movimentos if m["tipo"] == tipo), 2)
+
+    docs.append(("fechamentos_caixa", {
+        "id": g.uuid(),
+        "vendedora_id": gerente["id"],
+        "vendedora_nome": gerente["full_name"],
+        "filial_id": filial["id"],
+        "data": abertura.isoformat(),
+        "saldo_inicial": 200.0,
+        "total_suprimentos": soma("suprimento"),
+        "total_sangrias": soma("sangria"),
+        "total_retiradas_gerencia": soma("retirada_gerencia"),
+        "total_dinheiro": 0.0, "total_pix": 0.0, "total_cartao": 0.0, "total_credito": 0.0,
+        "total_geral": 0.0, "num_vendas": 0,
+        "observacoes": None,
+        "status": "fechado",
+        "inconsistencia_abertura": False,
+        "diferenca_abertura": 0.0,
+    }))
+    return docs
+
+
+async def gerar(args):
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[args.db_name]
+    if args.drop:
+        await client.drop_database(args.db_name)
+
+    g = Gerador(args.seed)
+    escritor = Escritor(db, args.lote, args.paralelo)
+    inicio = time.perf_counter()
+    senha_hash = pwd_context.hash(args.senha)
+
+    hoje = datetime.now(BR_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    dias = [hoje - timedelta(days=d) for d in range(args.dias - 1, -1, -1)]
+
+    filiais = gerar_filiais(g, args.filiais)
+    lojas = []
+    for idx, filial in enumerate(filiais):
+        await escritor.adicionar("filiais", filial)
+        usuarios = gerar_usuarios(g, filial, idx, args.gerentes_por_filial, args.vendedoras_por_filial, senha_hash)
+        for u in usuarios:
+            await escritor.adicionar("users", u)
+        produtos = [gerar_produto(g, filial, i) for i in range(args.produtos_por_filial)]
+        for p in produtos:
+            await escritor.adicionar("products", p)
+        clientes = [gerar_cliente(g, filial) for _ in range(args.clientes_por_filial)]
+        for c in clientes:
+            await escritor.adicionar("customers", c)
+        lojas.append({
+            "filial": filial,
+            "gerentes": [u for u in usuarios if u["role"] == "gerente"],
+            "vendedoras": [u for u in usuarios if u["role"] == "vendedora"],
+            # Só o necessário para referenciar nas vendas (libera o resto da memória)
+            "produtos": [{k: p[k] for k in ("id", "codigo", "descricao", "preco_venda", "preco_custo")} for p in produtos],
+            "clientes": [{"id": c["id"], "nome": c["nome"]} for c in clientes],
+        })
+    print(f"Cadastros gerados em {time.perf_counter() - inicio:.1f}s")
+
+    # Vales e metas por vendedora/mês
+    meses = sorted({(d.year, d.month) for d in dias})
+    for loja in lojas:
+        for vendedora in loja["vendedoras"]:
+            for ano, mes in meses:
+                await escritor.adicionar("goals", {
+                    "id": g.uuid(), "vendedor": vendedora["full_name"], "mes": mes, "ano": ano,
+                    "meta_vendas": vendedora["meta_mensal"], "meta_pecas": 0,
+                    "vendas_realizadas": 0.0, "pecas_vendidas": 0, "percentual_atingido": 0.0,
+                })
+                for _ in range(g.rng.randint(0, 3)):
+                    await escritor.adicionar("vales", {
+                        "id": g.uuid(), "vendedora_id": vendedora["id"], "vendedora_nome": vendedora["full_name"],
+                        "valor": round(g.rng.uniform(50, 400), 2), "mes": mes, "ano": ano,
+                        "observacoes": None, "data": datetime(ano, mes, g.rng.randint(1, 28), tzinfo=timezone.utc).isoformat(),
+                    })
+
+    # Vendas distribuídas pelos dias e filiais, com o movimento de caixa de cada dia
+    vendas_por_dia_loja = max(1, args.vendas // (len(dias) * max(1, len(lojas))))
+    total_vendas = 0
+    for dia in dias:
+        for loja in lojas:
+            if not loja["vendedoras"] or not loja["produtos"]:
+                continue
+            gerente = loja["gerentes"][0] if loja["gerentes"] else loja["vendedoras"][0]
+            for colecao, doc in gerar_dia_caixa(g, loja["filial"], gerente, loja["vendedoras"], loja["clientes"], dia):
+                await escritor.adicionar(colecao, doc)
+            n = max(0, int(g.rng.gauss(vendas_por_dia_loja, vendas_por_dia_loja * 0.2)))
+            for _ in range(n):
+                venda = gerar_venda(g, loja["filial"], g.rng.choice(loja["vendedoras"]), loja["produtos"], loja["clientes"], dia)
+                await escritor.adicionar("sales", venda)
+                if venda["estornada"]:
+                    await escritor.adicionar("estornos_log", gerar_log_estorno(g, venda))
+                total_vendas += 1
+        if args.progresso and dia.day == 1:
+            print(f"  {dia.date()}: {total_vendas} vendas ({time.perf_counter() - inicio:.0f}s)")
+
+    await escritor.finalizar()
+    duracao = time.perf_counter() - inicio
+    total = sum(escritor.contagem.values())
+    print(f"\nConcluído em {duracao:.1f}s ({total / duracao:,.0f} docs/s)")
+    for colecao, n in sorted(escritor.contagem.items()):
+        print(f"  {colecao:<20} {n:>10,}")
+    print(f"\nSenha de todos os usuários gerados: {args.senha}")
+    client.close()
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-name", default="explotrack_scale", help="Nunca usa o DB_NAME do .env por padrão")
+    parser.add_argument("--drop", action="store_true", help="Apaga o banco antes de gerar")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--filiais", type=int, default=3)
+    parser.add_argument("--gerentes-por-filial", type=int, default=1)
+    parser.add_argument("--vendedoras-por-filial", type=int, default=6)
+    parser.add_argument("--produtos-por-filial", type=int, default=10000)
+    parser.add_argument("--clientes-por-filial", type=int, default=3000)
+    parser.add_argument("--vendas", type=int, default=200000, help="Total aproximado de vendas")
+    parser.add_argument("--dias", type=int, default=365, help="Dias de histórico até hoje")
+    parser.add_argument("--lote", type=int, default=5000, help="Documentos por insert_many")
+    parser.add_argument("--paralelo", type=int, default=8, help="insert_many simultâneos")
+    parser.add_argument("--senha", default="senha123")
+    parser.add_argument("--progresso", action="store_true", help="Mostra o avanço mês a mês")
+    return parser
+
+
+def main():
+    args = criar_parser().parse_args()
+    asyncio.run(gerar(args))
+
+
+if __name__ == "__main__":
+    main()
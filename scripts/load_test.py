@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Teste de carga do ExploTrack com cenários de loja.
+
+Por padrão sobe o app FastAPI em processo (sem uvicorn) apontando para um mongod
+local e um banco descartável. Com --base-url testa um servidor já rodando.
+
+Cenários:
+  - caixas: N vendedoras bipando códigos de barras e fechando vendas (POST /sales)
+  - gerentes: M gerentes atualizando dashboard e relatórios
+  - fim do dia: um fechamento-caixa/hoje + POST /fechamento-caixa ao final
+
+Uso:
+  MONGO_URL=mongodb://localhost:27017 python scripts/load_test.py --caixas 8 --gerentes 2 --duracao 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parent.parent / 'backend'))
+
+from asgi_client import ASGIClient, ASGIResponse
+
+
+class HTTPClient:
+    """Mesma interface do ASGIClient, mas contra um servidor real (requests em threads)."""
+
+    def __init__(self, base_url, headers=None):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.headers = dict(headers or {})
+        self.session = requests.Session()
+
+    async def startup(self):
+        pass
+
+    async def shutdown(self):
+        self.session.close()
+
+    async def request(self, method, url, json_body=None, form=None, headers=None):
+        def _do():
+            r = self.session.request(
+                method, self.base_url + url, json=json_body, data=form,
+                headers={**self.headers, **(headers or {})}
+            )
+            return ASGIResponse(r.status_code, {k.lower(): v for k, v in r.headers.items()}, r.content)
+        return await asyncio.to_thread(_do)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, json_body=None, **kwargs):
+        return await self.request("POST", url, json_body=json_body, **kwargs)
+
+
+class Estatisticas:
+    def __init__(self):
+        self.latencias = defaultdict(list)
+        self.erros = defaultdict(int)
+        self.inicio = time.perf_counter()
+        self.fim = None
+
+    async def medir(self, nome, coro):
+        t0 = time.perf_counter()
+        resposta = await coro
+        self.latencias[nome].append((time.perf_counter() - t0) * 1000)
+        if resposta.status_code >= 400:
+            self.erros[nome] += 1
+        return resposta
+
+    @staticmethod
+    def percentil(valores, p):
+        if not valores:
+            return 0.0
+        ordenados = sorted(valores)
+        return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+    def relatorio(self):
+        duracao = (self.fim or time.perf_counter()) - self.inicio
+        linhas = []
+        for nome in sorted(self.latencias):
+            v = self.latencias[nome]
+            linhas.append({
+                "endpoint": nome,
+                "requisicoes": len(v),
+                "erros": self.erros[nome],
+                "req_s": len(v) / duracao if duracao else 0.0,
+                "p50_ms": self.percentil(v, 50),
+                "p90_ms": self.percentil(v, 90),
+                "p95_ms": self.percentil(v, 95),
+                "p99_ms": self.percentil(v, 99),
+                "max_ms": max(v) if v else 0.0,
+            })
+        return {"duracao_s": duracao, "endpoints": linhas}
+
+
+def imprimir(relatorio):
+    print(f"\nDuração: {relatorio['duracao_s']:.1f}s")
+    print(f"{'endpoint':<42} {'req':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    total = 0
+    for e in relatorio["endpoints"]:
+        total += e["requisicoes"]
+        print(
+            f"{e['endpoint']:<42} {e['requisicoes']:>7} {e['erros']:>5} {e['req_s']:>8.1f} "
+            f"{e['p50_ms']:>8.1f} {e['p90_ms']:>8.1f} {e['p95_ms']:>8.1f} {e['p99_ms']:>8.1f} {e['max_ms']:>8.1f}"
+        )
+    print(f"\nTotal: {total} requisições, {total / relatorio['duracao_s']:.1f} req/s (latências em ms)")
+
+
+async def login(cliente, username, password):
+    r = await cliente.request("POST", "/api/auth/login", form={"username": username, "password": password})
+    if r.status_code != 200:
+        raise RuntimeError(f"Login falhou para {username}: {r.status_code} {r.content[:200]}")
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+async def preparar_dados(cliente, args, rng):
+    """Cria filial, usuários e produtos do teste; retorna o contexto usado pelos cenários."""
+    admin = await login(cliente, args.admin_user, args.admin_password)
+    sufixo = f"{rng.randint(0, 10**6):06d}"
+
+    filial = (await cliente.post("/api/filiais", {"nome": f"Carga {sufixo}"}, headers=admin)).json()
+
+    usuarios = []
+    for i in range(args.caixas + args.gerentes):
+        role = "vendedora" if i < args.caixas else "gerente"
+        username = f"carga_{sufixo}_{role}_{i}"
+        await cliente.post("/api/auth/register", {
+            "username": username, "full_name": f"Carga {role.title()} {i}", "role": role,
+            "password": "carga123", "filial_id": filial["id"], "meta_mensal": 10000.0
+        }, headers=admin)
+        usuarios.append((username, role))
+
+    produtos = []
+    for i in range(args.produtos):
+        preco = round(rng.uniform(19.9, 199.9), 2)
+        produto = {
+            "codigo": f"{sufixo}{i:06d}",
+            "descricao": f"PRODUTO CARGA {i}",
+            "quantidade": 1_000_000,
+            "preco_custo": round(preco * 0.45, 2),
+            "preco_venda": preco,
+            "filial_id": filial["id"],
+        }
+        r = await cliente.post("/api/products", produto, headers=admin)
+        produtos.append(r.json())
+
+    caixas, gerentes = [], []
+    for username, role in usuarios:
+        headers = await login(cliente, username, "carga123")
+        me = (await cliente.get("/api/auth/me", headers=headers)).json()
+        (caixas if role == "vendedora" else gerentes).append((headers, me))
+
+    await cliente.post("/api/caixa/abrir", {
+        "filial_id": filial["id"], "valor_inicial": 200.0, "usuario": caixas[0][1]["full_name"] if caixas else "carga"
+    }, headers=admin)
+
+    return {"admin": admin, "filial": filial, "produtos": produtos, "caixas": caixas, "gerentes": gerentes}
+
+
+async def cenario_caixa(cliente, ctx, headers, me, stats, rng, fim, pausa):
+    filial_id = ctx["filial"]["id"]
+    while time.perf_counter() < fim:
+        itens = []
+        for produto in rng.sample(ctx["produtos"], rng.randint(1, min(4, len(ctx["produtos"])))):
+            r = await stats.medir(
+                "GET /products/barcode/{codigo}",
+                cliente.get(f"/api/products/barcode/{produto['codigo']}?filial_id={filial_id}", headers=headers)
+            )
+            if r.status_code != 200:
+                continue
+            p = r.json()
+            qtd = rng.randint(1, 2)
+            itens.append({
+                "product_id": p["id"], "codigo": p["codigo"], "descricao": p["descricao"],
+                "quantidade": qtd, "preco_venda": p["preco_venda"], "preco_custo": p["preco_custo"],
+                "subtotal": round(p["preco_venda"] * qtd, 2),
+            })
+            await asyncio.sleep(pausa / 4)
+        if not itens:
+            continue
+
+        total = round(sum(i["subtotal"] for i in itens), 2)
+        modalidade = rng.choice(["Dinheiro", "Pix", "Cartao", "Misto"])
+        pagamentos = []
+        if modalidade == "Misto":
+            parte = round(total / 2, 2)
+            pagamentos = [{"modalidade": "Dinheiro", "valor": parte}, {"modalidade": "Pix", "valor": round(total - parte, 2)}]
+        await stats.medir("POST /sales", cliente.post("/api/sales", {
+            "items": itens, "total": total, "modalidade_pagamento": modalidade, "pagamentos": pagamentos,
+            "vendedor": me["full_name"], "vendedor_id": me["id"], "filial_id": filial_id,
+        }, headers=headers))
+        await asyncio.sleep(pausa)
+
+
+async def cenario_gerente(cliente, ctx, headers, stats, fim, pausa):
+    filial_id = ctx["filial"]["id"]
+    hoje = datetime.now(timezone.utc).date()
+    inicio_mes = hoje.replace(day=1).isoformat()
+    while time.perf_counter() < fim:
+        await stats.medir("GET /reports/dashboard", cliente.get(f"/api/reports/dashboard?filial_id={filial_id}", headers=headers))
+        await stats.medir(
+            "GET /reports/sales-by-vendor",
+            cliente.get(f"/api/reports/sales-by-vendor?data_inicio={inicio_mes}&data_fim={hoje.isoformat()}&filial_id={filial_id}", headers=headers)
+        )
+        await stats.medir(
+            "GET /sales?view=summary",
+            cliente.get(f"/api/sales?filial_id={filial_id}&data_inicio={hoje.isoformat()}&data_fim={hoje.isoformat()}T23:59:59&view=summary", headers=headers)
+        )
+        await stats.medir("GET /fechamento-caixa/hoje", cliente.get(f"/api/fechamento-caixa/hoje?filial_id={filial_id}", headers=headers))
+        await asyncio.sleep(pausa)
+
+
+async def fechamento_fim_do_dia(cliente, ctx, stats):
+    filial_id = ctx["filial"]["id"]
+    headers, me = ctx["gerentes"][0] if ctx["gerentes"] else (ctx["admin"], {"id": "admin", "full_name": "Administrador"})
+    r = await stats.medir("GET /fechamento-caixa/hoje (fim do dia)", cliente.get(f"/api/fechamento-caixa/hoje?filial_id={filial_id}", headers=headers))
+    resumo = r.json() or {}
+    await stats.medir("POST /fechamento-caixa", cliente.post("/api/fechamento-caixa", {
+        "vendedora_id": me["id"], "vendedora_nome": me["full_name"], "filial_id": filial_id,
+        "total_dinheiro": resumo.get("total_dinheiro", 0), "total_pix": resumo.get("total_pix", 0),
+        "total_cartao": resumo.get("total_cartao", 0), "total_credito": resumo.get("total_credito", 0),
+        "total_geral": resumo.get("total_geral", 0), "num_vendas": resumo.get("num_vendas", 0),
+    }, headers=headers))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="Testa um servidor rodando (ex: http://localhost:8001) em vez do app em processo")
+    parser.add_argument("--db-name", default="explotrack_loadtest", help="Banco usado no modo em processo")
+    parser.add_argument("--drop", action="store_true", help="Apaga o banco de teste antes de começar")
+    parser.add_argument("--caixas", type=int, default=8)
+    parser.add_argument("--gerentes", type=int, default=2)
+    parser.add_argument("--produtos", type=int, default=200)
+    parser.add_argument("--duracao", type=float, default=30.0, help="Segundos de carga")
+    parser.add_argument("--pausa-caixa", type=float, default=0.2, help="Pausa entre vendas (s)")
+    parser.add_argument("--pausa-gerente", type=float, default=2.0, help="Pausa entre atualizações (s)")
+    parser.add_argument("--admin-user", default="admin")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Grava o relatório em JSON neste arquivo")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    if args.base_url:
+        cliente = HTTPClient(args.base_url)
+    else:
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        os.environ["DB_NAME"] = args.db_name
+        import server
+        if args.drop:
+            await server.client.drop_database(args.db_name)
+        cliente = ASGIClient(server.app)
+
+    await cliente.startup()
+    try:
+        print("Preparando dados...")
+        ctx = await preparar_dados(cliente, args, rng)
+
+        stats = Estatisticas()
+        fim = time.perf_counter() + args.duracao
+        print(f"Rodando {args.caixas} caixas e {args.gerentes} gerentes por {args.duracao:.0f}s...")
+        tarefas = [
+            cenario_caixa(cliente, ctx, headers, me, stats, random.Random(args.seed + i), fim, args.pausa_caixa)
+            for i, (headers, me) in enumerate(ctx["caixas"])
+        ]
+        tarefas += [cenario_gerente(cliente, ctx, headers, stats, fim, args.pausa_gerente) for headers, _ in ctx["gerentes"]]
+        await asyncio.gather(*tarefas)
+        await fechamento_fim_do_dia(cliente, ctx, stats)
+        stats.fim = time.perf_counter()
+    finally:
+        await cliente.shutdown()
+
+    relatorio = stats.relatorio()
+    imprimir(relatorio)
+    if args.json:
+        Path(args.json).write_text(json.dumps(relatorio, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Normaliza o CPF dos clientes (cpf_digitos, só dígitos) em lotes e lista os CPFs
+repetidos, que impedem a criação do índice único cpf_unico no startup do backend.
+
+Sem --corrigir só relata. Com --corrigir, em cada grupo de repetidos o cliente mais
+antigo fica com o CPF no índice e os demais recebem cpf_digitos=None e
+cpf_duplicado=True (o CPF digitado é mantido para a revisão manual).
+
+Uso:
+  MONGO_URL=mongodb://localhost:27017 python scripts/normalizar_cpfs.py --db-name explotrack
+  MONGO_URL=mongodb://localhost:27017 python scripts/normalizar_cpfs.py --db-name explotrack --corrigir
+"""
+import argparse
+import asyncio
+import os
+import re
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+load_dotenv(Path(__file__).parent.parent / 'backend' / '.env')
+
+
+def somente_digitos(texto) -> str:
+    return re.sub(r"\D", "", texto or "")
+
+
+async def normalizar(db, lote: int) -> int:
+    """Preenche cpf_digitos de quem ainda não tem, paginando por _id."""
+    total = 0
+    ultimo = None
+    while True:
+        filtro = {"cpf_digitos": {"$exists": False}, "cpf_duplicado": {"$ne": True}}
+        if ultimo is not None:
+            filtro["_id"] = {"$gt": ultimo}
+        pendentes = await db.customers.find(filtro, {"_id": 1, "cpf": 1}).sort("_id", 1).limit(lote).to_list(lote)
+        if not pendentes:
+            break
+        try:
+            await db.customers.bulk_write([
+                UpdateOne({"_id": c["_id"]}, {"$set": {"cpf_digitos": somente_digitos(c.get("cpf")) or None}})
+                for c in pendentes
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Índice cpf_unico já existe e o CPF é de outro cliente
+            await db.customers.update_many(
+                {"_id": {"$in": [pendentes[err["index"]]["_id"] for err in e.details.get("writeErrors", [])]}},
+                {"$set": {"cpf_digitos": None, "cpf_duplicado": True}}
+            )
+        total += len(pendentes)
+        ultimo = pendentes[-1]["_id"]
+    return total
+
+
+async def repetidos(db) -> list:
+    return await db.customers.aggregate([
+        {"$match": {"cpf_digitos": {"$type": "string"}}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": "$cpf_digitos",
+            "clientes": {"$push": {"id": "$id", "nome": "$nome", "filial_id": "$filial_id", "created_at": "$created_at"}},
+            "quantidade": {"$sum": 1},
+        }},
+        {"$match": {"quantidade": {"$gt": 1}}},
+    ], allowDiskUse=True).to_list(None)
+
+
+async def executar(args):
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[args.db_name]
+    try:
+        print(f"CPFs normalizados: {await normalizar(db, args.lote)}")
+        grupos = await repetidos(db)
+        print(f"CPFs repetidos: {len(grupos)}")
+        for g in grupos:
+            print(f"  {g['_id']}: " + "; ".join(f"{c['nome']} ({c['filial_id']}, {c['id']})" for c in g["clientes"]))
+
+        if args.corrigir and grupos:
+            # O primeiro de cada grupo (mais antigo) mantém o CPF no índice
+            ids = [c["id"] for g in grupos for c in g["clientes"][1:]]
+            for i in range(0, len(ids), args.lote):
+                await db.customers.update_many(
+                    {"id": {"$in": ids[i:i + args.lote]}},
+                    {"$set": {"cpf_digitos": None, "cpf_duplicado": True}}
+                )
+            print(f"{len(ids)} clientes marcados com cpf_duplicado; reinicie o backend para criar o índice cpf_unico")
+    finally:
+        client.close()
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-name", default=os.environ.get("DB_NAME"), required=not os.environ.get("DB_NAME"))
+    parser.add_argument("--lote", type=int, default=1000, help="Clientes por bulk_write")
+    parser.add_argument("--corrigir", action="store_true", help="Tira do índice os CPFs repetidos (exceto o mais antigo)")
+    return parser
+
+
+def main():
+    asyncio.run(executar(criar_parser().parse_args()))
+
+
+if __name__ == "__main__":
+    main()
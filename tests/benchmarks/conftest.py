@@ -0,0 +1,163 @@
+"""
+Benchmarks dos handlers quentes com baselines versionadas (baselines.json).
+
+Cada benchmark mede o número de idas ao banco e a mediana/p95 do tempo por
+chamada. Sempre falha se o handler passou a fazer mais queries que a baseline
+versionada (baselines.json).
+
+O tempo varia demais entre máquinas para ir no repositório: --update-baselines
+grava mediana/p95 num arquivo local (BENCH_TEMPOS, fora do git), e com
+BENCH_TOLERANCIA definida o benchmark também falha se ficou mais lento que essa
+baseline local. Sem BENCH_TOLERANCIA (o padrão, e o da CI) o tempo só aparece no
+resumo da sessão.
+
+  python -m pytest tests/benchmarks -q --update-baselines            # grava as baselines
+  BENCH_TOLERANCIA=0.30 python -m pytest tests/benchmarks -q         # compara, tempo +30%
+
+Variáveis: BENCH_ITERACOES (30), BENCH_AQUECIMENTO (5), BENCH_TOLERANCIA (relativa, ex. 0.30),
+BENCH_FOLGA_MS (2.0, absorve ruído em handlers de poucos ms), BENCH_TEMPOS
+(tests/benchmarks/tempos_locais.json).
+"""
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+
+import pytest
+
+BASELINES_PATH = Path(__file__).parent / "baselines.json"
+
+TEMPOS_PATH = Path(os.environ.get("BENCH_TEMPOS", Path(__file__).parent / "tempos_locais.json"))
+
+ITERACOES = int(os.environ.get("BENCH_ITERACOES", "30"))
+AQUECIMENTO = int(os.environ.get("BENCH_AQUECIMENTO", "5"))
+# Gate de tempo opcional: None = desligado
+TOLERANCIA = float(os.environ["BENCH_TOLERANCIA"]) if os.environ.get("BENCH_TOLERANCIA") else None
+FOLGA_MS = float(os.environ.get("BENCH_FOLGA_MS", "2.0"))
+
+_resultados = {}
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--update-baselines", action="store_true", default=False,
+        help="Regrava tests/benchmarks/baselines.json com as medições desta execução",
+    )
+
+
+def _percentil(amostras, p):
+    ordenadas = sorted(amostras)
+    idx = min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))
+    return ordenadas[idx]
+
+
+def _carregar_baselines():
+    if BASELINES_PATH.exists():
+        return json.loads(BASELINES_PATH.read_text())
+    return {"handlers": {}}
+
+
+def _carregar_tempos():
+    if TEMPOS_PATH.exists():
+        return json.loads(TEMPOS_PATH.read_text())
+    return {"handlers": {}}
+
+
+@pytest.fixture
+def medir(app_semeado):
+    """medir(chamada) -> {"mediana_ms", "p95_ms", "idas_ao_banco", "por_comando"}.
+
+    `chamada` é uma função async sem argumentos que retorna a resposta do ASGIClient.
+    """
+    contador = app_semeado.contador
+
+    async def _medir(chamada):
+        for _ in range(AQUECIMENTO):
+            r = await chamada()
+            assert r.status_code == 200, r.content[:300]
+        tempos, idas = [], []
+        por_comando = {}
+        for _ in range(ITERACOES):
+            contador.zerar()
+            inicio = time.perf_counter()
+            r = await chamada()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+            assert r.status_code == 200, r.content[:300]
+            idas.append(contador.total)
+            por_comando = dict(contador.por_comando)
+        return {
+            "mediana_ms": round(statistics.median(tempos), 3),
+            "p95_ms": round(_percentil(tempos, 95), 3),
+            "idas_ao_banco": max(idas),
+            "por_comando": por_comando,
+        }
+
+    return lambda chamada: app_semeado.rodar(_medir(chamada))
+
+
+@pytest.fixture
+def comparar_baseline(request):
+    """Compara a medição com a baseline do handler (ou a registra com --update-baselines)."""
+    atualizar = request.config.getoption("--update-baselines")
+    baselines = _carregar_baselines()["handlers"]
+    tempos = _carregar_tempos()["handlers"]
+
+    def _comparar(nome, medicao):
+        _resultados[nome] = medicao
+        if atualizar:
+            return
+        base = baselines.get(nome)
+        if base is None:
+            pytest.fail(f"{nome}: sem baseline em {BASELINES_PATH.name}; rode com --update-baselines")
+
+        falhas = []
+        if medicao["idas_ao_banco"] > base["idas_ao_banco"]:
+            falhas.append(
+                f"idas ao banco: {medicao['idas_ao_banco']} > baseline {base['idas_ao_banco']} "
+                f"({medicao['por_comando']})"
+            )
+        if TOLERANCIA is not None:
+            tempo = tempos.get(nome)
+            if tempo is None:
+                pytest.fail(f"{nome}: sem tempo em {TEMPOS_PATH}; rode com --update-baselines nesta máquina")
+            for campo in ("mediana_ms", "p95_ms"):
+                limite = tempo[campo] * (1 + TOLERANCIA) + FOLGA_MS
+                if medicao[campo] > limite:
+                    falhas.append(
+                        f"{campo} {medicao[campo]:.2f}ms > limite {limite:.2f}ms "
+                        f"(baseline {tempo[campo]:.2f}ms +{TOLERANCIA:.0%} +{FOLGA_MS}ms)"
+                    )
+        if falhas:
+            pytest.fail(f"{nome}: regressão de performance\n  " + "\n  ".join(falhas))
+
+    return _comparar
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if not _resultados or not session.config.getoption("--update-baselines"):
+        return
+    dados, tempos = _carregar_baselines(), _carregar_tempos()
+    for nome, medicao in _resultados.items():
+        dados["handlers"][nome] = {"idas_ao_banco": medicao["idas_ao_banco"]}
+        tempos["handlers"][nome] = {"mediana_ms": medicao["mediana_ms"], "p95_ms": medicao["p95_ms"]}
+    BASELINES_PATH.write_text(json.dumps(dados, indent=2, ensure_ascii=False, sort_keys=True) + "\n")
+    TEMPOS_PATH.write_text(json.dumps(tempos, indent=2, ensure_ascii=False, sort_keys=True) + "\n")
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _resultados:
+        return
+    baselines = _carregar_baselines()["handlers"]
+    tempos = _carregar_tempos()["handlers"]
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(
+        f"{'handler':<28} {'mediana':>10} {'p95':>10} {'idas':>6} {'baseline':>8} {'mediana local':>14}"
+    )
+    for nome, m in sorted(_resultados.items()):
+        base = baselines.get(nome, {}).get("idas_ao_banco")
+        local = tempos.get(nome, {}).get("mediana_ms")
+        terminalreporter.write_line(
+            f"{nome:<28} {m['mediana_ms']:>8.2f}ms {m['p95_ms']:>8.2f}ms {m['idas_ao_banco']:>6} "
+            f"{(base if base is not None else '-'):>8} {(f'{local:.2f}ms' if local is not None else '-'):>14}"
+        )
@@ -0,0 +1,72 @@
+"""
+Benchmarks de create_sale, get_product_by_barcode, search_products,
+get_fechamento_hoje e get_pagamentos_detalhados.
+
+create_sale fica por último: as vendas que ele grava entram no fechamento do dia.
+"""
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def produtos_bench(app_semeado):
+    """Dois produtos da filial com estoque de sobra para as vendas do benchmark."""
+    db = app_semeado.db
+    produtos = app_semeado.rodar(
+        db.products.find({"filial_id": app_semeado.filial_id}, {"_id": 0}).sort("codigo", 1).to_list(2)
+    )
+    for p in produtos:
+        app_semeado.rodar(db.products.update_one({"id": p["id"]}, {"$set": {"quantidade": 1_000_000}}))
+    return produtos
+
+
+def test_get_product_by_barcode(app_semeado, produtos_bench, medir, comparar_baseline):
+    url = f"/api/products/barcode/{produtos_bench[0]['codigo']}?filial_id={app_semeado.filial_id}"
+    medicao = medir(lambda: app_semeado.cliente.get(url, headers=app_semeado.admin))
+    comparar_baseline("get_product_by_barcode", medicao)
+
+
+def test_search_products(app_semeado, medir, comparar_baseline):
+    url = f"/api/products/search/VESTIDO?filial_id={app_semeado.filial_id}"
+    medicao = medir(lambda: app_semeado.cliente.get(url, headers=app_semeado.admin))
+    comparar_baseline("search_products", medicao)
+
+
+def test_get_fechamento_hoje(app_semeado, medir, comparar_baseline):
+    url = f"/api/fechamento-caixa/hoje?filial_id={app_semeado.filial_id}"
+    medicao = medir(lambda: app_semeado.cliente.get(url, headers=app_semeado.admin))
+    comparar_baseline("get_fechamento_hoje", medicao)
+
+
+def test_get_pagamentos_detalhados(app_semeado, medir, comparar_baseline):
+    # Mês anterior inteiro: todas as vendedoras do dataset têm vendas e meta nele
+    fim = date.today().replace(day=1) - timedelta(days=1)
+    inicio = fim.replace(day=1)
+    url = (
+        f"/api/reports/pagamentos-detalhados?data_inicio={inicio.isoformat()}"
+        f"&data_fim={fim.isoformat()}T23:59:59&filial_id={app_semeado.filial_id}"
+    )
+    medicao = medir(lambda: app_semeado.cliente.get(url, headers=app_semeado.admin))
+    comparar_baseline("get_pagamentos_detalhados", medicao)
+
+
+def test_create_sale(app_semeado, produtos_bench, medir, comparar_baseline):
+    itens = [{
+        "product_id": p["id"],
+        "codigo": p["codigo"],
+        "descricao": p["descricao"],
+        "quantidade": 1,
+        "preco_venda": p["preco_venda"],
+        "preco_custo": p["preco_custo"],
+        "subtotal": p["preco_venda"],
+    } for p in produtos_bench]
+    venda = {
+        "items": itens,
+        "total": round(sum(i["subtotal"] for i in itens), 2),
+        "modalidade_pagamento": "Dinheiro",
+        "vendedor": "Benchmark",
+        "filial_id": app_semeado.filial_id,
+    }
+    medicao = medir(lambda: app_semeado.cliente.post("/api/sales", venda, headers=app_semeado.admin))
+    comparar_baseline("create_sale", medicao)
@@ -0,0 +1,108 @@
+"""
+Fixtures compartilhadas pelos testes de performance (tests/benchmarks, ...).
+
+Sobe o app FastAPI em processo contra um mongod local, num banco descartável
+populado pelo scripts/generate_dataset.py em escala pequena. Sem mongod
+acessível em MONGO_URL, os testes que dependem dessas fixtures são pulados.
+
+  MONGO_URL=mongodb://localhost:27017 python -m pytest tests -q
+"""
+import asyncio
+import os
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "backend"))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+from asgi_client import ASGIClient  # noqa: E402
+
+TEST_DB_NAME = os.environ.get("TEST_DB_NAME", "explotrack_perf_tests")
+
+# Escala pequena: rápido de gerar e com menos de 101 vendas por dia (um único batch do find)
+DATASET_ARGS = [
+    "--db-name", TEST_DB_NAME, "--drop", "--seed", "42",
+    "--filiais", "1", "--vendedoras-por-filial", "6",
+    "--produtos-por-filial", "2000", "--clientes-por-filial", "500",
+    "--vendas", "3000", "--dias", "60", "--lote", "1000", "--paralelo", "4",
+]
+
+
+class ContadorComandos:
+    """Observador do CommandMonitor: conta as idas ao banco (comandos concluídos)."""
+
+    # explain é disparado pelo SlowQueryRecorder em segundo plano, não pelo handler
+    IGNORADOS = {"explain", "endSessions"}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.por_comando = {}
+
+    def __call__(self, comando, colecao, duracao_ms, falhou):
+        if comando in self.IGNORADOS:
+            return
+        with self._lock:
+            self.total += 1
+            chave = f"{comando} {colecao}".strip()
+            self.por_comando[chave] = self.por_comando.get(chave, 0) + 1
+
+    def zerar(self):
+        with self._lock:
+            self.total = 0
+            self.por_comando = {}
+
+
+class AppSemeado:
+    def __init__(self, server, cliente, admin, filial_id, contador, rodar):
+        self.server = server
+        self.db = server.db
+        self.cliente = cliente
+        self.admin = admin
+        self.filial_id = filial_id
+        self.contador = contador
+        self.rodar = rodar
+
+
+@pytest.fixture(scope="session")
+def rodar():
+    """Um único event loop para a sessão inteira (o cliente do Motor fica preso a ele)."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def app_semeado(rodar):
+    mongo_url = os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+    try:
+        MongoClient(mongo_url, serverSelectionTimeoutMS=1500).admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"MongoDB indisponível em {mongo_url}: {e}")
+
+    os.environ["DB_NAME"] = TEST_DB_NAME
+    import generate_dataset
+    rodar(generate_dataset.gerar(generate_dataset.criar_parser().parse_args(DATASET_ARGS)))
+
+    import server
+    contador = ContadorComandos()
+    server.command_monitor.observadores.append(contador)
+
+    cliente = ASGIClient(server.app)
+    rodar(cliente.startup())
+    r = rodar(cliente.request("POST", "/api/auth/login", form={"username": "admin", "password": "admin123"}))
+    assert r.status_code == 200, r.content
+    admin = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    filial = rodar(server.db.filiais.find_one({}, {"_id": 0, "id": 1}))
+
+    yield AppSemeado(server, cliente, admin, filial["id"], contador, rodar)
+
+    server.command_monitor.observadores.remove(contador)
+    rodar(server.client.drop_database(TEST_DB_NAME))
+    rodar(cliente.shutdown())
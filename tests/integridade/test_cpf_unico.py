@@ -0,0 +1,49 @@
+"""
+CPF único entre clientes: o backfill resolve os repetidos que entraram sem o índice
+cpf_unico e o recria; sem o índice, o cadastro recusa o CPF repetido por consulta.
+"""
+import uuid
+
+
+def _cliente(nome, cpf, created_at, **extra):
+    return {
+        "id": str(uuid.uuid4()), "nome": nome, "cpf": cpf, "filial_id": "cpf-teste",
+        "saldo_devedor": 0.0, "credito_loja": 0.0, "created_at": created_at, **extra,
+    }
+
+
+def test_backfill_resolve_repetidos_e_recria_indice(app_semeado):
+    server, rodar, db = app_semeado.server, app_semeado.rodar, app_semeado.db
+    cpf = str(uuid.uuid4().int)[:11]
+    rodar(db.customers.drop_index("cpf_unico"))
+    antigo = _cliente("Antigo", cpf, "2020-01-01T00:00:00+00:00", cpf_digitos=cpf, nome_busca="antigo")
+    novo = _cliente("Novo", cpf, "2021-01-01T00:00:00+00:00", cpf_digitos=cpf, nome_busca="novo")
+    sem_campos = _cliente("Sem campos", cpf, "2022-01-01T00:00:00+00:00")
+    rodar(db.customers.insert_many([dict(antigo), dict(novo), dict(sem_campos)]))
+
+    rodar(server.preencher_campos_busca_clientes())
+    rodar(server.garantir_cpf_unico())
+
+    assert server.cpf_unico_estado["ativo"]
+    docs = {d["id"]: d for d in rodar(db.customers.find({"filial_id": "cpf-teste", "cpf": cpf}).to_list(None))}
+    assert docs[antigo["id"]]["cpf_digitos"] == cpf
+    for c in (novo, sem_campos):
+        assert docs[c["id"]]["cpf_digitos"] is None
+        assert docs[c["id"]]["cpf_duplicado"] is True
+
+
+def test_sem_indice_cadastro_recusa_cpf_repetido(app_semeado):
+    server, rodar = app_semeado.server, app_semeado.rodar
+    cpf = str(uuid.uuid4().int)[:11]
+    corpo = {"nome": "Primeiro", "cpf": cpf, "filial_id": "cpf-teste"}
+    r = rodar(app_semeado.cliente.request("POST", "/api/customers", json_body=corpo, headers=app_semeado.admin))
+    assert r.status_code == 200, r.content
+
+    server.cpf_unico_estado["ativo"] = False
+    try:
+        corpo = {"nome": "Segundo", "cpf": cpf, "filial_id": "cpf-teste", "credito_loja": 0.0}
+        r = rodar(app_semeado.cliente.request("POST", "/api/customers", json_body=corpo, headers=app_semeado.admin))
+        assert r.status_code == 400
+        assert "Primeiro" in r.json()["detail"]
+    finally:
+        rodar(server.garantir_cpf_unico())
@@ -0,0 +1,76 @@
+"""
+Expiração de crédito da loja: data_ultimo_credito tem um único tipo (texto ISO UTC),
+venha o cliente de base antiga, da edição do cadastro ou de uma troca.
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+
+def _cliente(app_semeado, **campos):
+    doc = {
+        "id": str(uuid.uuid4()), "nome": "Crédito Teste", "filial_id": app_semeado.filial_id,
+        "saldo_devedor": 0.0, "limite_credito": 0.0, "created_at": datetime.now(timezone.utc).isoformat(),
+        **campos,
+    }
+    app_semeado.rodar(app_semeado.db.customers.insert_one(dict(doc)))
+    return doc
+
+
+def _credito(app_semeado, customer_id):
+    return app_semeado.rodar(app_semeado.db.customers.find_one({"id": customer_id}, {"_id": 0}))
+
+
+def test_data_em_date_e_sem_data_expiram(app_semeado):
+    server, rodar = app_semeado.server, app_semeado.rodar
+    antigo = datetime.now(timezone.utc) - timedelta(days=server.CREDITO_VALIDADE_DIAS + 10)
+
+    # Date gravado pela edição do cadastro antes da correção
+    com_date = _cliente(app_semeado, credito_loja=50.0, data_ultimo_credito=antigo.replace(tzinfo=None))
+    # Crédito sem data: vale a última movimentação em store_credits
+    sem_data = _cliente(app_semeado, credito_loja=30.0, data_ultimo_credito=None)
+    rodar(app_semeado.db.store_credits.insert_one({
+        "id": str(uuid.uuid4()), "customer_id": sem_data["id"], "valor": 30.0, "origem": "troca",
+        "data": antigo.isoformat(), "usado": False,
+    }))
+    # Sem data e sem histórico: o prazo começa agora
+    sem_historico = _cliente(app_semeado, credito_loja=20.0)
+
+    rodar(server.normalizar_data_ultimo_credito())
+    for c in (com_date, sem_data, sem_historico):
+        assert isinstance(_credito(app_semeado, c["id"])["data_ultimo_credito"], str)
+
+    rodar(server.expirar_creditos_vencidos())
+    assert _credito(app_semeado, com_date["id"])["credito_loja"] == 0
+    assert _credito(app_semeado, sem_data["id"])["credito_loja"] == 0
+    assert _credito(app_semeado, sem_historico["id"])["credito_loja"] == 20.0
+
+
+def test_edicao_do_cadastro_nao_troca_o_tipo_da_data(app_semeado):
+    rodar = app_semeado.rodar
+    antigo = (datetime.now(timezone.utc) - timedelta(days=app_semeado.server.CREDITO_VALIDADE_DIAS + 10)).isoformat()
+    cliente = _cliente(app_semeado, credito_loja=40.0, data_ultimo_credito=antigo)
+
+    # A tela reenvia o cliente inteiro, inclusive a data
+    corpo = {k: v for k, v in cliente.items() if k not in ("id", "created_at")}
+    corpo["telefone"] = "11999990000"
+    r = rodar(app_semeado.cliente.request(
+        "PUT", f"/api/customers/{cliente['id']}", json_body=corpo, headers=app_semeado.admin
+    ))
+    assert r.status_code == 200, r.content
+    assert _credito(app_semeado, cliente["id"])["data_ultimo_credito"] == antigo
+
+    rodar(app_semeado.server.expirar_creditos_vencidos())
+    assert _credito(app_semeado, cliente["id"])["credito_loja"] == 0
+
+
+def test_credito_lancado_no_cadastro_comeca_o_prazo(app_semeado):
+    rodar = app_semeado.rodar
+    cliente = _cliente(app_semeado, credito_loja=0.0, data_ultimo_credito=None)
+    corpo = {"nome": cliente["nome"], "filial_id": cliente["filial_id"], "credito_loja": 25.0}
+    r = rodar(app_semeado.cliente.request(
+        "PUT", f"/api/customers/{cliente['id']}", json_body=corpo, headers=app_semeado.admin
+    ))
+    assert r.status_code == 200, r.content
+    data = _credito(app_semeado, cliente["id"])["data_ultimo_credito"]
+    assert isinstance(data, str)
+    assert datetime.fromisoformat(data) > datetime.now(timezone.utc) - timedelta(minutes=1)
@@ -0,0 +1,48 @@
+"""
+Atribuição da folha por filial: a vendedora entra na folha da filial em que está
+lotada, com as vendas feitas em qualquer filial, no relatório de pagamentos e na folha.
+"""
+import uuid
+
+
+def test_venda_em_outra_filial_conta_na_filial_da_vendedora(app_semeado):
+    rodar = app_semeado.rodar
+
+    def chamar(metodo, url, corpo=None):
+        r = rodar(app_semeado.cliente.request(metodo, url, json_body=corpo, headers=app_semeado.admin))
+        assert r.status_code == 200, r.content
+        return r.json()
+
+    casa = chamar("POST", "/api/filiais", {"nome": f"Casa {uuid.uuid4().hex[:6]}"})
+    outra = chamar("POST", "/api/filiais", {"nome": f"Outra {uuid.uuid4().hex[:6]}"})
+    vendedora = chamar("POST", "/api/auth/register", {
+        "username": f"folha-{uuid.uuid4().hex[:8]}", "full_name": f"Folha {uuid.uuid4().hex[:6]}",
+        "role": "vendedora", "password": "x", "filial_id": casa["id"], "filiais_acesso": [outra["id"]],
+        "meta_mensal": 1000,
+    })
+    produto = chamar("POST", "/api/products", {
+        "codigo": "FOLHA-1", "descricao": "Peça", "quantidade": 10, "preco_custo": 1, "preco_venda": 300,
+        "filial_id": outra["id"],
+    })
+    chamar("POST", "/api/sales", {
+        "items": [{
+            "product_id": produto["id"], "codigo": "FOLHA-1", "descricao": "Peça", "quantidade": 1,
+            "preco_venda": 300.0, "preco_custo": 1.0, "subtotal": 300.0,
+        }],
+        "total": 300.0, "modalidade_pagamento": "Dinheiro", "vendedor": vendedora["full_name"],
+        "vendedor_id": vendedora["id"], "filial_id": outra["id"], "data": "2019-06-10T15:00:00-03:00",
+    })
+
+    periodo = {"mes_inicio": 6, "ano_inicio": 2019, "mes_fim": 6, "ano_fim": 2019}
+    def folha(filial_id):
+        linhas = chamar("POST", "/api/reports/folha", {**periodo, "filial_id": filial_id})["linhas"]
+        return {l["vendedora_id"]: l["total_vendas"] for l in linhas}
+
+    def pagamentos(filial_id):
+        url = f"/api/reports/pagamentos-detalhados?data_inicio=2019-06-01&data_fim=2019-06-30T23:59:59&filial_id={filial_id}"
+        return {v["vendedora_id"]: v["total_vendas"] for v in chamar("GET", url)["vendedores"]}
+
+    assert folha(casa["id"]) == {vendedora["id"]: 300.0}
+    assert pagamentos(casa["id"]) == {vendedora["id"]: 300.0}
+    assert vendedora["id"] not in folha(outra["id"])
+    assert vendedora["id"] not in pagamentos(outra["id"])
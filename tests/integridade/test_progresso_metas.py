@@ -0,0 +1,88 @@
+"""
+Progresso de metas: o acumulado por $inc (create_sale, estornar_venda) é igual ao
+que recalcular_progresso_metas monta a partir das mesmas vendas.
+"""
+import uuid
+
+import pytest
+
+CAMPOS = ("total_vendas", "pecas_vendidas", "num_vendas")
+
+
+def _progresso(app_semeado, vendedor_id, ano, mes):
+    doc = app_semeado.rodar(app_semeado.db.goal_progress.find_one(
+        {"vendedor_id": vendedor_id, "ano": ano, "mes": mes}, {"_id": 0}
+    )) or {}
+    return {campo: doc.get(campo, 0) for campo in CAMPOS}
+
+
+def test_acumulado_igual_ao_recalculo(app_semeado):
+    rodar, db = app_semeado.rodar, app_semeado.db
+    filial_id = app_semeado.filial_id
+    vendedora = rodar(db.users.find_one({"filial_id": filial_id, "role": "vendedora"}, {"_id": 0}))
+    produto = rodar(db.products.find_one({"filial_id": filial_id}, {"_id": 0}))
+    rodar(db.products.update_one({"id": produto["id"]}, {"$inc": {"quantidade": 1000}}))
+
+    def vender(data, quantidade=1, **campos):
+        corpo = {
+            "items": [{
+                "product_id": produto["id"], "codigo": produto["codigo"], "descricao": produto["descricao"],
+                "quantidade": quantidade, "preco_venda": 10.0, "preco_custo": 4.0, "subtotal": 10.0 * quantidade,
+            }],
+            "total": 10.0 * quantidade, "modalidade_pagamento": "Dinheiro",
+            "vendedor": vendedora["full_name"], "filial_id": filial_id, "data": data, **campos,
+        }
+        r = rodar(app_semeado.cliente.request("POST", "/api/sales", json_body=corpo, headers=app_semeado.admin))
+        assert r.status_code == 200, r.content
+        return r.json()["id"]
+
+    # Mês sem vendas no dataset, para o recálculo ver só as vendas do teste
+    vender("2019-03-10T15:00:00-03:00", 2, vendedor_id=vendedora["id"])
+    vender("2019-03-12T12:00:00", 1)  # venda antiga sem vendedor_id: vale o nome
+    # 01/04 01:30 em UTC ainda é 31/03 na loja
+    vender("2019-04-01T01:30:00Z", 3, vendedor_id=vendedora["id"])
+    vender("2019-04-15T10:00:00-03:00", 1, vendedor_id=vendedora["id"])
+    vender("2019-03-20T10:00:00-03:00", 5, vendedor_id=vendedora["id"], is_troca=True)
+    estornada = vender("2019-03-25T18:00:00-03:00", 4, vendedor_id=vendedora["id"])
+    r = rodar(app_semeado.cliente.request("DELETE", f"/api/sales/{estornada}/estornar", headers=app_semeado.admin))
+    assert r.status_code == 200, r.content
+
+    acumulado = {mes: _progresso(app_semeado, vendedora["id"], 2019, mes) for mes in (3, 4)}
+    assert acumulado[3] == pytest.approx({"total_vendas": 60.0, "pecas_vendidas": 6, "num_vendas": 3})
+    assert acumulado[4] == pytest.approx({"total_vendas": 10.0, "pecas_vendidas": 1, "num_vendas": 1})
+
+    for mes in (3, 4):
+        rodar(app_semeado.server.recalcular_progresso_metas(mes, 2019))
+        assert _progresso(app_semeado, vendedora["id"], 2019, mes) == pytest.approx(acumulado[mes])
+
+
+def test_excluir_filial_remove_o_progresso(app_semeado):
+    rodar, db = app_semeado.rodar, app_semeado.db
+    admin = app_semeado.admin
+
+    def chamar(metodo, url, corpo=None):
+        r = rodar(app_semeado.cliente.request(metodo, url, json_body=corpo, headers=admin))
+        assert r.status_code == 200, r.content
+        return r.json()
+
+    filial = chamar("POST", "/api/filiais", {"nome": f"Temporária {uuid.uuid4().hex[:6]}"})
+    usuario = chamar("POST", "/api/auth/register", {
+        "username": f"temp-{uuid.uuid4().hex[:8]}", "full_name": f"Temporária {uuid.uuid4().hex[:6]}",
+        "role": "vendedora", "password": "x", "filial_id": filial["id"],
+    })
+    produto = chamar("POST", "/api/products", {
+        "codigo": "TEMP-1", "descricao": "Peça", "quantidade": 10, "preco_custo": 1, "preco_venda": 10,
+        "filial_id": filial["id"],
+    })
+    chamar("POST", "/api/sales", {
+        "items": [{
+            "product_id": produto["id"], "codigo": "TEMP-1", "descricao": "Peça", "quantidade": 1,
+            "preco_venda": 10.0, "preco_custo": 1.0, "subtotal": 10.0,
+        }],
+        "total": 10.0, "modalidade_pagamento": "Dinheiro", "vendedor": usuario["full_name"],
+        "vendedor_id": usuario["id"], "filial_id": filial["id"],
+    })
+    assert rodar(db.goal_progress.count_documents({"vendedor_id": usuario["id"]})) == 1
+
+    chamar("DELETE", f"/api/filiais/{filial['id']}")
+    assert rodar(db.goal_progress.count_documents({"vendedor_id": usuario["id"]})) == 0
@@ -0,0 +1,85 @@
+"""
+Totais acumulados do caixa do dia: depois de qualquer sequência de escritas, o que
+está no documento do caixa é igual à soma refeita por recalcular_totais_caixa.
+"""
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+
+def _totais(server, caixa):
+    campos = [*server.CAMPOS_TOTAL_MOVIMENTO.values(), *server.CAMPOS_PAGAMENTO_DIVIDA]
+    return {campo: (caixa or {}).get(campo, 0.0) for campo in campos}
+
+
+def test_totais_acumulados_iguais_ao_recalculo(app_semeado):
+    server, rodar, db = app_semeado.server, app_semeado.rodar, app_semeado.db
+    admin = app_semeado.admin
+    filial_id = f"caixa-{uuid.uuid4().hex[:8]}"
+    hoje = server.dia_comercial()
+
+    def chamar(metodo, url, corpo=None):
+        r = rodar(app_semeado.cliente.request(metodo, url, json_body=corpo, headers=admin))
+        assert r.status_code == 200, r.content
+        return r.json()
+
+    def movimento(tipo, valor):
+        return chamar("POST", "/api/caixa/movimento", {
+            "filial_id": filial_id, "usuario": "Teste", "tipo": tipo, "valor": valor, "observacao": "invariante",
+        })["id"]
+
+    sangria = movimento("sangria", 40.0)
+    suprimento = movimento("suprimento", 100.0)
+    movimento("retirada_gerencia", 250.0)
+    extras = [movimento("sangria", 10.0), movimento("suprimento", 5.5), movimento("sangria", 7.25)]
+
+    chamar("PUT", f"/api/caixa/movimento/{sangria}", {
+        "filial_id": filial_id, "usuario": "Teste", "tipo": "sangria", "valor": 55.0, "observacao": "corrigido",
+    })
+    chamar("DELETE", f"/api/caixa/movimento/{suprimento}")
+    # Um id já excluído no lote força o caminho de recálculo parcial
+    chamar("POST", "/api/caixa/movimentos/bulk-delete", {"ids": extras[:2]})
+    chamar("POST", "/api/caixa/movimentos/bulk-delete", {"ids": [extras[1], extras[2]]})
+
+    cliente = {
+        "id": str(uuid.uuid4()), "nome": "Devedor", "filial_id": filial_id, "saldo_devedor": 300.0,
+        "credito_loja": 0.0, "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    rodar(db.customers.insert_one(dict(cliente)))
+    for forma, valor in (("Dinheiro", 50.0), ("Pix", 30.0), ("Cartao", 20.0)):
+        chamar("POST", f"/api/customers/{cliente['id']}/pagar-saldo", {
+            "customer_id": cliente["id"], "customer_nome": cliente["nome"], "valor": valor,
+            "forma_pagamento": forma, "vendedora_id": "v", "vendedora_nome": "Vendedora",
+        })
+
+    acumulados = _totais(server, rodar(db.fechamentos_caixa.find_one({"filial_id": filial_id, "business_date": hoje})))
+    recalculados = rodar(server.recalcular_totais_caixa(filial_id, hoje))
+
+    assert acumulados == pytest.approx(_totais(server, recalculados))
+    assert acumulados["total_sangrias"] == pytest.approx(55.0)
+    assert acumulados["total_retiradas_gerencia"] == pytest.approx(250.0)
+    assert acumulados["total_suprimentos"] == pytest.approx(0.0)
+    assert acumulados["pagamentos_divida_dinheiro"] == pytest.approx(50.0)
+    assert acumulados["pagamentos_divida_pix"] == pytest.approx(30.0)
+    assert acumulados["pagamentos_divida_cartao"] == pytest.approx(20.0)
+
+
+def test_startup_so_cria_caixa_de_filial_com_registros(app_semeado):
+    server, rodar, db = app_semeado.server, app_semeado.rodar, app_semeado.db
+    hoje = server.dia_comercial()
+    inicio, _ = server.limites_dia_comercial(hoje)
+    sem_registros = f"boot-{uuid.uuid4().hex[:8]}"
+    com_registros = f"boot-{uuid.uuid4().hex[:8]}"
+    rodar(db.filiais.insert_many([{"id": sem_registros, "nome": "Vazia"}, {"id": com_registros, "nome": "Ativa"}]))
+    rodar(db.caixa_movimentos.insert_one({
+        "id": str(uuid.uuid4()), "filial_id": com_registros, "usuario": "Teste", "tipo": "sangria",
+        "valor": 12.0, "observacao": "antes dos totais", "data": inicio,
+    }))
+
+    rodar(server.preencher_totais_caixas_do_dia())
+
+    assert rodar(db.fechamentos_caixa.find_one({"filial_id": sem_registros, "business_date": hoje})) is None
+    caixa = rodar(db.fechamentos_caixa.find_one({"filial_id": com_registros, "business_date": hoje}))
+    assert caixa["total_sangrias"] == pytest.approx(12.0)
+    assert "status" not in caixa
@@ -0,0 +1,34 @@
+"""
+Relatório de cobertura de índices por rota, impresso no fim da sessão do pytest.
+
+Com QUERY_PLAN_REPORT=caminho.json o relatório também é gravado em JSON.
+"""
+import json
+import os
+from pathlib import Path
+
+# Preenchido pela fixture `planos` de test_index_coverage.py
+relatorio = {}
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not relatorio:
+        return
+    terminalreporter.section("cobertura de índices por rota")
+    for rota, info in sorted(relatorio.items()):
+        terminalreporter.write_line(
+            f"{rota}  ({info['handler']}): {info['consultas']} consultas, {info['com_indice']} com índice, "
+            f"{len(info['alertas'])} alertas"
+        )
+        for q in info["detalhes"]:
+            marca = "!!" if q["alerta"] else "  "
+            plano = ", ".join(q["indices"]) or ("COLLSCAN" if q["collscan"] else "-")
+            sort = " +SORT em memória" if q["sort_em_memoria"] else ""
+            terminalreporter.write_line(
+                f"   {marca} {q['comando']:<14} {q['colecao']:<20} [{plano}]{sort}  {q['formato_filtro']}"
+            )
+
+    destino = os.environ.get("QUERY_PLAN_REPORT")
+    if destino:
+        Path(destino).write_text(json.dumps(relatorio, indent=2, ensure_ascii=False, sort_keys=True))
+        terminalreporter.write_line(f"Relatório gravado em {destino}")
@@ -0,0 +1,196 @@
+"""
+Asserções de plano de query: falham quando uma rota passa a fazer COLLSCAN ou
+SORT em memória numa coleção grande.
+
+Um roteiro de chamadas à API roda uma vez contra o banco semeado, com o
+SlowQueryRecorder do server em limite 0: todo comando fica registrado com o
+handler que o emitiu e ganha um explain("executionStats") por formato de filtro.
+O resumo do explain (resumir_explain) alimenta as asserções e o relatório de
+cobertura por rota impresso no fim da sessão.
+
+Rotas em PENDENTES ainda não têm índice para as consultas que fazem; ficam como
+xfail estrito: quando o índice é criado o teste passa a falhar (XPASS) até a rota
+sair da lista.
+"""
+import json
+import os
+from datetime import date, timedelta
+
+import pytest
+
+from .conftest import relatorio
+
+# Coleções com menos documentos que isso não geram alerta (COLLSCAN em 7 usuários é ok)
+MIN_DOCS = int(os.environ.get("QUERY_PLAN_MIN_DOCS", "200"))
+
+PENDENTES = {
+    "search_products": "regex sem âncora em codigo/descricao (só filial_id pode usar índice)",
+    "get_customer_sales": "sales.customer_id sem índice",
+    "get_compras_fiado": "sales.customer_id sem índice",
+    "get_historico_pagamentos": "pagamentos_saldo.customer_id sem índice",
+    "get_customer_credits": "store_credits.customer_id sem índice",
+    "get_sales": "sales.filial_id/data sem índice (sort por data em memória)",
+    "get_sale": "sales.id sem índice",
+    "get_dashboard_stats": "sales.filial_id/data sem índice",
+    "get_sales_by_vendor": "sales.data sem índice",
+    "get_pagamentos_detalhados": "sales.filial_id/data sem índice",
+    "get_fechamento_hoje": "sales.vendedor/data sem índice",
+    "get_historico_fechamentos": "fechamentos_caixa.filial_id/data sem índice",
+}
+
+
+def _roteiro(ctx):
+    """(método, url, corpo, status esperado) de cada chamada do roteiro."""
+    f = ctx["filial_id"]
+    venda = {
+        "items": [{
+            "product_id": ctx["produto"]["id"], "codigo": ctx["produto"]["codigo"],
+            "descricao": ctx["produto"]["descricao"], "quantidade": 1,
+            "preco_venda": ctx["produto"]["preco_venda"], "preco_custo": ctx["produto"]["preco_custo"],
+            "subtotal": ctx["produto"]["preco_venda"],
+        }],
+        "total": ctx["produto"]["preco_venda"],
+        "modalidade_pagamento": "Dinheiro",
+        "vendedor": "Roteiro",
+        "filial_id": f,
+    }
+    periodo = f"data_inicio={ctx['inicio']}&data_fim={ctx['fim']}T23:59:59&filial_id={f}"
+    return [
+        ("GET", f"/api/products?filial_id={f}", None, 200),
+        ("GET", f"/api/products/pagina?filial_id={f}&ordenar=descricao&limit=50", None, 200),
+        ("GET", f"/api/products/barcode/{ctx['produto']['codigo']}?filial_id={f}", None, 200),
+        ("GET", f"/api/products/search/VESTIDO?filial_id={f}", None, 200),
+        ("GET", f"/api/customers?filial_id={f}", None, 200),
+        ("GET", f"/api/customers/busca?filial_id={f}&q={ctx['cliente']['nome'][:3]}", None, 200),
+        ("GET", f"/api/customers/busca?filial_id={f}&q={ctx['cliente']['cpf'][:5]}", None, 200),
+        ("GET", f"/api/customers/pagina?filial_id={f}&ordenar=saldo_devedor&direcao=desc&limit=50", None, 200),
+        ("POST", "/api/customers", {"nome": "Duplicado", "cpf": ctx["cliente"]["cpf"], "filial_id": f}, 400),
+        ("GET", f"/api/customers/{ctx['cliente']['id']}/sales?view=summary", None, 200),
+        ("GET", f"/api/customers/{ctx['cliente']['id']}/compras-fiado", None, 200),
+        ("GET", f"/api/customers/{ctx['cliente']['id']}/historico-pagamentos", None, 200),
+        ("GET", f"/api/store-credits/customer/{ctx['cliente']['id']}", None, 200),
+        ("GET", f"/api/sales?{periodo}&view=summary", None, 200),
+        ("GET", f"/api/sales/{ctx['venda_id']}", None, 200),
+        ("GET", f"/api/reports/dashboard?filial_id={f}", None, 200),
+        ("GET", f"/api/reports/sales-by-vendor?{periodo}", None, 200),
+        ("GET", f"/api/reports/pagamentos-detalhados?{periodo}", None, 200),
+        ("GET", f"/api/fechamento-caixa/hoje?filial_id={f}", None, 200),
+        ("GET", f"/api/fechamento-caixa/historico?{periodo}", None, 200),
+        ("GET", f"/api/vales?filial_id={f}&ano_inicio={ctx['fim'][:4]}", None, 200),
+        ("GET", "/api/reports/my-performance", None, 200),
+        ("POST", "/api/sales", venda, 200),
+    ]
+
+
+def _rotas_por_handler(app):
+    return {
+        getattr(r, "endpoint", None).__name__: f"{sorted(r.methods)[0]} {r.path}"
+        for r in app.routes if getattr(r, "endpoint", None) and getattr(r, "methods", None)
+    }
+
+
+@pytest.fixture(scope="module")
+def planos(app_semeado):
+    """Roda o roteiro capturando os comandos por handler; retorna (status por chamada, consultas)."""
+    server, db, rodar = app_semeado.server, app_semeado.db, app_semeado.rodar
+    recorder = server.slow_query_recorder
+
+    fim = date.today().replace(day=1) - timedelta(days=1)
+    produto = rodar(db.products.find_one({"filial_id": app_semeado.filial_id, "quantidade": {"$gt": 0}}, {"_id": 0}))
+    cliente = rodar(db.customers.find_one({"filial_id": app_semeado.filial_id, "cpf": {"$ne": None}}, {"_id": 0}))
+    venda = rodar(db.sales.find_one({"customer_id": cliente["id"]}, {"_id": 0, "id": 1})) \
+        or rodar(db.sales.find_one({}, {"_id": 0, "id": 1}))
+    ctx = {
+        "filial_id": app_semeado.filial_id, "produto": produto, "cliente": cliente,
+        "venda_id": venda["id"], "inicio": fim.replace(day=1).isoformat(), "fim": fim.isoformat(),
+    }
+
+    original = (recorder.limite_ms, recorder.amostragem, recorder.explains_por_minuto)
+    recorder.limite_ms, recorder.amostragem, recorder.explains_por_minuto = 0, 1.0, 10_000
+    recorder.limpar()
+    try:
+        chamadas = []
+        for metodo, url, corpo, esperado in _roteiro(ctx):
+            r = rodar(app_semeado.cliente.request(metodo, url, json_body=corpo, headers=app_semeado.admin))
+            chamadas.append((metodo, url, esperado, r.status_code))
+        rodar(recorder.aguardar_explains())
+        consultas = recorder.top_ofensores(limite=10_000)
+    finally:
+        recorder.limite_ms, recorder.amostragem, recorder.explains_por_minuto = original
+        recorder.limpar()
+
+    colecoes = {c["colecao"] for c in consultas}
+    tamanhos = {c: rodar(db[c].estimated_document_count()) for c in colecoes if c}
+    for c in consultas:
+        explain = c["explain"] or {}
+        c["indices"] = explain.get("indices", [])
+        c["collscan"] = bool(explain.get("collscan"))
+        c["sort_em_memoria"] = bool(explain.get("sort_em_memoria"))
+        c["docs_colecao"] = tamanhos.get(c["colecao"], 0)
+        c["alerta"] = c["docs_colecao"] >= MIN_DOCS and (c["collscan"] or c["sort_em_memoria"])
+
+    rotas = _rotas_por_handler(server.app)
+    for c in consultas:
+        if not c["handler"]:
+            continue
+        rota = rotas.get(c["handler"], c["handler"])
+        info = relatorio.setdefault(rota, {
+            "handler": c["handler"], "consultas": 0, "com_indice": 0, "alertas": [], "detalhes": [],
+        })
+        info["consultas"] += 1
+        info["com_indice"] += 1 if c["indices"] else 0
+        info["detalhes"].append({k: c[k] for k in (
+            "comando", "colecao", "formato_filtro", "indices", "collscan", "sort_em_memoria", "docs_colecao", "alerta"
+        )})
+        if c["alerta"]:
+            info["alertas"].append(f"{c['comando']} {c['colecao']} {c['formato_filtro']}")
+
+    return chamadas, consultas
+
+
+def test_roteiro_executa(planos):
+    chamadas, _ = planos
+    erradas = [f"{m} {u}: {s} (esperado {e})" for m, u, e, s in chamadas if s != e]
+    assert not erradas, "\n".join(erradas)
+
+
+def _exigir_consultas(consultas):
+    # Sem comandos capturados (cliente sem CommandMonitor) as asserções passariam à toa
+    if not consultas:
+        pytest.skip("nenhum comando registrado pelo SlowQueryRecorder")
+
+
+def test_todas_as_consultas_tem_explain(planos):
+    _, consultas = planos
+    _exigir_consultas(consultas)
+    sem_explain = [
+        f"{c['handler']}: {c['comando']} {c['colecao']} -> {json.dumps(c['explain'])}"
+        for c in consultas
+        if c["handler"] and (c["explain"] is None or "erro" in c["explain"])
+    ]
+    assert not sem_explain, "\n".join(sem_explain)
+
+
+HANDLERS_DO_ROTEIRO = [
+    "get_products", "get_products_pagina", "get_product_by_barcode", "search_products",
+    "get_customers", "get_customers_pagina", "buscar_clientes", "create_customer",
+    "get_customer_sales", "get_compras_fiado", "get_historico_pagamentos", "get_customer_credits",
+    "get_sales", "get_sale", "get_dashboard_stats", "get_sales_by_vendor", "get_pagamentos_detalhados",
+    "get_fechamento_hoje", "get_historico_fechamentos", "get_vales", "get_my_performance", "create_sale",
+]
+
+
+@pytest.mark.parametrize("handler", [
+    pytest.param(h, marks=pytest.mark.xfail(reason=PENDENTES[h], strict=True)) if h in PENDENTES else h
+    for h in HANDLERS_DO_ROTEIRO
+])
+def test_sem_collscan_em_colecoes_grandes(planos, handler):
+    _, consultas = planos
+    _exigir_consultas(consultas)
+    alertas = [
+        f"{c['comando']} {c['colecao']} ({c['docs_colecao']} docs) "
+        f"{'COLLSCAN' if c['collscan'] else ''}{' SORT em memória' if c['sort_em_memoria'] else ''}: "
+        f"{c['formato_filtro']}"
+        for c in consultas if c["handler"] == handler and c["alerta"]
+    ]
+    assert not alertas, f"{handler} sem índice adequado:\n  " + "\n  ".join(alertas)
@@ -0,0 +1,76 @@
+"""Regra de comissão (backend/comissoes.py): faixas, meta zero, vales e grupos por filial."""
+import pytest
+
+from comissoes import CONFIG_PADRAO, calcular_folha, calcular_folha_por_config
+
+CONFIG = {
+    "percentual_comissao": 2.0,
+    "bonus_tiers": [
+        {"percentual_meta": 80, "valor_bonus": 100},
+        {"percentual_meta": 100, "valor_bonus": 200},
+    ],
+}
+
+
+def _linha(vendas, meta=1000.0, vales=0.0, filial_id=None):
+    return {"total_vendas": vendas, "meta_vendas": meta, "total_vales": vales, "filial_id": filial_id}
+
+
+def test_faixa_atingida_no_limiar_exato():
+    folha = calcular_folha([799.99, 800, 999.99, 1000, 1500], [1000] * 5, [0] * 5, CONFIG)
+    assert folha["faixa"].tolist() == [0, 1, 1, 2, 2]
+    assert folha["bonus_valor"].tolist() == [0, 100, 100, 200, 200]
+
+
+def test_bonus_da_maior_faixa_nao_acumula():
+    folha = calcular_folha([1000], [1000], [0], CONFIG)
+    assert folha["bonus_valor"][0] == 200
+    assert folha["total_a_pagar"][0] == pytest.approx(1000 * 0.02 + 200)
+
+
+def test_falta_para_proxima_faixa():
+    folha = calcular_folha([500, 900, 1200], [1000] * 3, [0] * 3, CONFIG)
+    assert folha["falta_percentual_proxima_faixa"].tolist() == pytest.approx([30, 10, 0])
+
+
+def test_meta_zero_nao_divide_nem_paga_bonus():
+    folha = calcular_folha([500], [0], [0], CONFIG)
+    assert folha["percentual_atingido"][0] == 0
+    assert folha["bonus_valor"][0] == 0
+    assert folha["comissao_base"][0] == pytest.approx(10)
+
+
+def test_sem_faixas_so_comissao_base():
+    config = {"percentual_comissao": 1.5, "bonus_tiers": []}
+    folha = calcular_folha([2000], [1000], [0], config)
+    assert folha["faixa"][0] == 0
+    assert folha["bonus_valor"][0] == 0
+    assert folha["falta_percentual_proxima_faixa"][0] == 0
+    assert folha["total_a_pagar"][0] == pytest.approx(30)
+
+
+def test_faixas_fora_de_ordem():
+    config = {"percentual_comissao": 2.0, "bonus_tiers": list(reversed(CONFIG["bonus_tiers"]))}
+    desordenada = calcular_folha([850, 1000], [1000] * 2, [0] * 2, config)
+    ordenada = calcular_folha([850, 1000], [1000] * 2, [0] * 2, CONFIG)
+    assert desordenada["bonus_valor"].tolist() == ordenada["bonus_valor"].tolist() == [100, 200]
+
+
+def test_vales_descontados_do_total():
+    folha = calcular_folha([1000, 100], [1000, 1000], [150, 50], CONFIG)
+    assert folha["total_a_pagar"].tolist() == pytest.approx([20 + 200 - 150, 2 - 50])
+
+
+def test_cada_filial_usa_a_sua_configuracao():
+    linhas = [_linha(1000, filial_id="a"), _linha(1000, filial_id="b"), _linha(800, filial_id="a")]
+    resultados = calcular_folha_por_config(linhas, {"a": CONFIG})
+    # "b" sem configuração: CONFIG_PADRAO (1%, faixa de 100% paga 200)
+    assert [r["bonus_valor"] for r in resultados] == [200, 200, 100]
+    assert [r["comissao_base"] for r in resultados] == pytest.approx([20, 10, 16])
+
+
+def test_config_unica_vale_para_todas_as_linhas():
+    linhas = [_linha(1000, filial_id="a"), _linha(1000, filial_id="b")]
+    resultados = calcular_folha_por_config(linhas, {"a": CONFIG_PADRAO}, config_unica=CONFIG)
+    assert [r["comissao_base"] for r in resultados] == pytest.approx([20, 20])
+    assert all(isinstance(r["faixa"], int) for r in resultados)